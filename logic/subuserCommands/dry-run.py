@@ -42,8 +42,7 @@ def dryRun(args):
   >>> dry_run.dryRun(["foo"])
   The image will be prepared using the Dockerfile:
   FROM 2
-  RUN useradd --uid=1000 travis ;export exitstatus=$? ; if [ $exitstatus -eq 4 ] ; then echo uid exists ; elif [ $exitstatus -eq 9 ]; then echo username exists. ; else exit $exitstatus ; fi
-  RUN test -d /home/travis || mkdir /home/travis && chown travis /home/travis
+  RUN ( useradd --uid=1000 travis ;export exitstatus=$? ; if [ $exitstatus -eq 4 ] ; then echo uid exists ; elif [ $exitstatus -eq 9 ]; then echo username exists. ; else exit $exitstatus ; fi ) && ( test -d /home/travis || mkdir /home/travis && chown travis /home/travis )
   <BLANKLINE>
   The command to launch the image is:
   docker 'run' '--rm' '-i' '-t' '-e' 'HOME=/home/travis/test-home' '--workdir=/home/travis/test-home' '--net=none' '--user=1000' '--entrypoint' '/usr/bin/foo' '3'
@@ -82,8 +81,7 @@ def dryRun(args):
   >>> dry_run.dryRun(["bar"])
   The image will be prepared using the Dockerfile:
   FROM 5
-  RUN useradd --uid=1000 travis ;export exitstatus=$? ; if [ $exitstatus -eq 4 ] ; then echo uid exists ; elif [ $exitstatus -eq 9 ]; then echo username exists. ; else exit $exitstatus ; fi
-  RUN test -d /home/travis || mkdir /home/travis && chown travis /home/travis
+  RUN ( useradd --uid=1000 travis ;export exitstatus=$? ; if [ $exitstatus -eq 4 ] ; then echo uid exists ; elif [ $exitstatus -eq 9 ]; then echo username exists. ; else exit $exitstatus ; fi ) && ( test -d /home/travis || mkdir /home/travis && chown travis /home/travis )
   <BLANKLINE>
   The command to launch the image is:
   docker 'run' '--rm' '-i' '-t' '-e' 'HOME=/home/travis/test-home' '--workdir=/home/travis/test-home' '--net=none' '--user=1000' '--entrypoint' '/usr/bin/bar' '6'
@@ -98,7 +96,9 @@ def dryRun(args):
   Unregistering any non-existant installed images.
   Running garbage collector on temporary repositories...
   >>> remove_old_images.removeOldImages([])
-  Removing unneeded image 5 : bar@file:///home/travis/remote-test-repo
+  Removing unneeded image 6 : run-ready image for 5 (0 B)
+  Removing unneeded image 5 : bar@file:///home/travis/remote-test-repo (0 B)
+  Reclaimed 0 B.
   Verifying subuser configuration.
   Verifying registry consistency...
   Unregistering any non-existant installed images.
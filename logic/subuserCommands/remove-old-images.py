@@ -13,7 +13,7 @@ import subuserlib.removeOldImages
 
 def parseCliArgs(realArgs):
   usage = "usage: subuser %prog"
-  description = """ Remove old, no longer used, installed images.  Note, once you do this, you will no longer be able to return to previous configuration states with subuser update checkout."""
+  description = """ Remove old, no longer used, installed images, along with the run-ready images built on top of them.  Images are removed children first, several at a time, and the space reclaimed from each image is reported.  Note, once you do this, you will no longer be able to return to previous configuration states with subuser update checkout."""
   parser=optparse.OptionParser(usage=usage,description=description,formatter=subuserlib.commandLineArguments.HelpFormatterThatDoesntReformatDescription())
   parser.add_option("--dry-run", dest="dryrun",action="store_true",default=False,help="Don't actually delete the images. Print which images would be deleted.")
   parser.add_option("--repo", dest="repo",default=None,help="Only remove images from the given repository.")
@@ -114,7 +114,9 @@ def removeOldImages(realArgs):
   >>> remove_old_images.removeOldImages(["--dry-run"])
   The following images are uneeded and would be deleted.
   DOCKER-ID : SUBUSER-ID
-  Removing unneeded image 6 : bar@file:///home/travis/remote-test-repo
+  Removing unneeded image 7 : run-ready image for 6 (0 B)
+  Removing unneeded image 6 : bar@file:///home/travis/remote-test-repo (0 B)
+  0 B would be reclaimed.
 
   Check to see that dry-run didn't actually remove the un-needed image.
 
@@ -199,7 +201,9 @@ def removeOldImages(realArgs):
   Now we use ``remove-old-images`` to remove images which belong to the local repository.
 
   >>> remove_old_images.removeOldImages(["--repo=/home/travis/local-test-repo"])
-  Removing unneeded image 9 : foo@/home/travis/local-test-repo
+  Removing unneeded image 10 : run-ready image for 9 (0 B)
+  Removing unneeded image 9 : foo@/home/travis/local-test-repo (0 B)
+  Reclaimed 0 B.
   Verifying subuser configuration.
   Verifying registry consistency...
   Unregistering any non-existant installed images.
@@ -209,7 +213,9 @@ def removeOldImages(realArgs):
   Now we use ``remove-old-images`` to clean up the rest of our un-needed installed images.
 
   >>> remove_old_images.removeOldImages([])
-  Removing unneeded image 6 : bar@file:///home/travis/remote-test-repo
+  Removing unneeded image 7 : run-ready image for 6 (0 B)
+  Removing unneeded image 6 : bar@file:///home/travis/remote-test-repo (0 B)
+  Reclaimed 0 B.
   Verifying subuser configuration.
   Verifying registry consistency...
   Unregistering any non-existant installed images.
@@ -6,7 +6,7 @@ import pathConfig
 #external imports
 import sys,os
 #internal imports
-import subuserlib.classes.user
+import subuserlib.launchManifests
 
 ##############################################################
 helpString = """Run the given subuser.
@@ -28,9 +28,20 @@ def run(args):
   subuserName = args[1]
   argsToPassToImage = args[2:]
 
+  manifest = subuserlib.launchManifests.loadLaunchManifest(subuserName)
+  if manifest:
+    subuserlib.launchManifests.launch(manifest,argsToPassToImage,os.environ)
+    # If launch returns, the manifest's run-ready image no longer exists.
+
+  # Subusers without a launch manifest are run with the full registry loaded.
+  import subuserlib.classes.user
   user = subuserlib.classes.user.User()
   user.getRegistry().setLogOutputVerbosity(0)
   if subuserName in user.getRegistry().getSubusers():
+    if manifest:
+      import subuserlib.verify
+      user.getRegistry().getSubusers()[subuserName].getRunReadyImage().setup()
+      subuserlib.verify.compileLaunchManifests(user)
     runtime = user.getRegistry().getSubusers()[subuserName].getRuntime(os.environ)
     if runtime:
       runtime.run(argsToPassToImage)
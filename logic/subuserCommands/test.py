@@ -5,6 +5,7 @@ import pathConfig
 import sys
 import os
 import io
+import tempfile
 #internal imports
 import subuserlib.docker
 import subuserlib.basicPaths
@@ -16,7 +17,7 @@ if "--help" in sys.argv:
 class MockRegistry():
   def __init__(self):
     pass
-  def log(self,message):
+  def log(self,message,verbosityLevel=1):
     print(message)
 
 class MockUser():
@@ -24,6 +25,8 @@ class MockUser():
     pass
   def getRegistry(self):
     return MockRegistry()
+  def getConfig(self):
+    return {"cache-dir":tempfile.mkdtemp()}
 
 if subuserlib.docker.getDockerExecutable():
   from subuserlib.classes.docker.dockerDaemon import DockerDaemon
@@ -59,9 +62,9 @@ subprocess.call([os.path.join(subuserDir,"test/teardown"),subuserDir])
 subprocess.call([os.path.join(subuserDir,"test/setup"),subuserDir])
 
 # classes
-import subuserlib.classes.user,subuserlib.classes.subuser
+import subuserlib.classes.user,subuserlib.classes.subuser,subuserlib.classes.docker.dockerDaemon,subuserlib.classes.docker.connectionPool,subuserlib.classes.docker.dockerIgnore,subuserlib.classes.docker.imageInventory,subuserlib.classes.installedImage
 # libs
-import subuserlib.resolve, subuserlib.hashDirectory, subuserlib.permissions
+import subuserlib.resolve, subuserlib.hashDirectory, subuserlib.permissions, subuserlib.jsonStream, subuserlib.removeOldImages, subuserlib.imageRetention, subuserlib.launchManifests, subuserlib.dockerRun, subuserlib.warmPool, subuserlib.verify, subuserlib.commands, subuserlib.classes.subuserSubmodules.run.runtime
 # commands
 import list,describe,repository,subuser,update
 dry_run = __import__("dry-run")
@@ -72,10 +75,24 @@ modules = [
   # classes
   subuserlib.classes.user
   ,subuserlib.classes.subusers
+  ,subuserlib.classes.docker.dockerDaemon
+  ,subuserlib.classes.docker.connectionPool
+  ,subuserlib.classes.docker.dockerIgnore
+  ,subuserlib.classes.docker.imageInventory
+  ,subuserlib.classes.installedImage
+  ,subuserlib.classes.subuserSubmodules.run.runtime
   # subuserlib modules
   ,subuserlib.permissions
   ,subuserlib.resolve
   ,subuserlib.hashDirectory
+  ,subuserlib.jsonStream
+  ,subuserlib.removeOldImages
+  ,subuserlib.imageRetention
+  ,subuserlib.launchManifests
+  ,subuserlib.dockerRun
+  ,subuserlib.warmPool
+  ,subuserlib.verify
+  ,subuserlib.commands
   # subuser commands
   ,dry_run
   ,list
@@ -26,6 +26,14 @@ def parseCliArgs(realArgs):
   EXAMPLE:
     $ subuser update all
 
+  --background
+      Check for updates and build new images ahead of time, without changing any subusers.  The next update switches the subusers over to the prebuilt images.  Meant to be run periodically, for example from cron.
+
+      Set "update-check-ttl" in your config.json to a number of seconds to skip the check-for-updates scripts of images which were checked more recently than that.  It defaults to 0, so that every run checks every image.  The setting only applies to --background.  `subuser update all` and `subuser update subusers` always run the checks.
+
+  EXAMPLE:
+    $ subuser update --background
+
   subusers
       Updates the specified subusers
 
@@ -46,6 +54,9 @@ def parseCliArgs(realArgs):
 """
   parser=optparse.OptionParser(usage=usage,description=description,formatter=subuserlib.commandLineArguments.HelpFormatterThatDoesntReformatDescription())
   parser.add_option("--accept",dest="accept",action="store_true",default=False,help="Accept permissions without asking.")
+  parser.add_option("--jobs",dest="jobs",type="int",default=1,help="Build up to this many independent images at the same time.")
+  parser.add_option("--background",dest="background",action="store_true",default=False,help="Prebuild updated images without switching any subusers over to them.")
+  parser.add_option("--verbose",dest="verbose",action="store_true",default=False,help="Print more information, such as how long each image took to build.")
   return parser.parse_args(args=realArgs)
 
 #################################################################################################
@@ -222,30 +233,30 @@ def update(realArgs):
   Building...
   Building...
   Building...
-  Successfully built 21
+  Successfully built 20
   Building...
   Building...
   Building...
-  Successfully built 22
+  Successfully built 21
   Installing intermediary ...
   Building...
   Building...
   Building...
-  Successfully built 23
+  Successfully built 22
   Building...
   Building...
   Building...
-  Successfully built 24
+  Successfully built 23
   Installing dependent ...
   Building...
   Building...
   Building...
-  Successfully built 25
+  Successfully built 24
   Building...
   Building...
   Building...
-  Successfully built 26
-  Installed new image <26> for subuser dependent
+  Successfully built 25
+  Installed new image <25> for subuser dependent
   Checking if subuser foo is up to date.
   Checking for updates to: foo@default
   Running garbage collector on temporary repositories...
@@ -309,30 +320,30 @@ def update(realArgs):
   Building...
   Building...
   Building...
-  Successfully built 28
+  Successfully built 27
   Building...
   Building...
   Building...
-  Successfully built 29
+  Successfully built 28
   Installing intermediary ...
   Building...
   Building...
   Building...
-  Successfully built 30
+  Successfully built 29
   Building...
   Building...
   Building...
-  Successfully built 31
+  Successfully built 30
   Installing dependent ...
   Building...
   Building...
   Building...
-  Successfully built 32
+  Successfully built 31
   Building...
   Building...
   Building...
-  Successfully built 33
-  Installed new image <33> for subuser dependent
+  Successfully built 32
+  Installed new image <32> for subuser dependent
   Running garbage collector on temporary repositories...
 
   >>> user = subuserlib.classes.user.User()
@@ -341,22 +352,181 @@ def update(realArgs):
 
   >>> set([i.getImageSourceName() for i in user.getInstalledImages().values()]) == set([u'foo', u'dependency1', u'bar', u'dependent', u'intermediary', u'intermediary', u'dependency2',u'dependency3', u'dependent'])
   True
+
+  New images can be built ahead of time in the background.  This leaves the subusers using their old images.
+
+  >>> with open(user.getRegistry().getRepositories()[u'1']["intermediary"].getSubuserImagefilePath(),mode="w") as subuserImagefile:
+  ...   _ = subuserImagefile.write("FROM-SUBUSER-IMAGE dependency3\\nRUN echo changed")
+  >>> repo1.run(["commit","-a","-m","changed intermediate"])
+  0
+
+  >>> update.update(["--background"])
+  Prebuilding updated images...
+  Updated repository file:///home/travis/remote-test-repo
+  Checking if subuser dependent is up to date.
+  Checking for updates to: dependency3@file:///home/travis/remote-test-repo
+  Installed image intermediary@1 is out of date.
+  Currently installed from image source:
+   c0bf3abcfcf5fdc7382f146dfa252b86b3b3be63
+  Current version:
+   80587d728bc4be3d6ff7901ad85d64a87084bc33
+  <BLANKLINE>
+  Installing intermediary ...
+  Building...
+  Building...
+  Building...
+  Successfully built 34
+  Building...
+  Building...
+  Building...
+  Successfully built 35
+  Installing dependent ...
+  Building...
+  Building...
+  Building...
+  Successfully built 36
+  Building...
+  Building...
+  Building...
+  Successfully built 37
+  Checking if subuser foo is up to date.
+  Checking for updates to: foo@default
+
+  >>> user = subuserlib.classes.user.User()
+  >>> user.getRegistry().getSubusers()["dependent"].getImageId() == "32"
+  True
+
+  The next update then switches the subuser over to the prebuilt image without building anything.
+
+  >>> update.update(["all","--accept"])
+  Updating...
+  Updated repository file:///home/travis/remote-test-repo
+  Verifying subuser configuration.
+  Verifying registry consistency...
+  Unregistering any non-existant installed images.
+  Checking if images need to be updated or installed...
+  Checking if subuser dependent is up to date.
+  Checking for updates to: dependency3@file:///home/travis/remote-test-repo
+  Checking for updates to: intermediary@file:///home/travis/remote-test-repo
+  Checking for updates to: dependent@file:///home/travis/remote-test-repo
+  Installed new image <37> for subuser dependent
+  Checking if subuser foo is up to date.
+  Checking for updates to: foo@default
+  Running garbage collector on temporary repositories...
+
+  With ``--jobs``, independent branches of the tree of images are built at the same time.  Add a subuser which shares the ``intermediary`` image with ``dependent``, and a subuser on a separate branch of the tree.
+
+  >>> subuser.subuser(["add","--accept","intermediary","intermediary@file:///home/travis/remote-test-repo"])
+  Adding subuser intermediary intermediary@file:///home/travis/remote-test-repo
+  Verifying subuser configuration.
+  Verifying registry consistency...
+  Unregistering any non-existant installed images.
+  intermediary would like to have the following permissions:
+   Description: 
+   Maintainer: 
+   Is a library.
+  A - Accept and apply changes
+  E - Apply changes and edit result
+  A
+  Checking if images need to be updated or installed...
+  Checking if subuser intermediary is up to date.
+  Installed new image <35> for subuser intermediary
+  Running garbage collector on temporary repositories...
+  >>> subuser.subuser(["add","--accept","bar","bar@file:///home/travis/remote-test-repo"])
+  Adding subuser bar bar@file:///home/travis/remote-test-repo
+  Verifying subuser configuration.
+  Verifying registry consistency...
+  Unregistering any non-existant installed images.
+  bar would like to have the following permissions:
+   Description: 
+   Maintainer: 
+   Executable: /usr/bin/bar
+  A - Accept and apply changes
+  E - Apply changes and edit result
+  A
+  Checking if images need to be updated or installed...
+  Checking if subuser bar is up to date.
+  Installed new image <7> for subuser bar
+  Running garbage collector on temporary repositories...
+  >>> barImageId = subuserlib.classes.user.User().getRegistry().getSubusers()["bar"].getImageId()
+
+  Now change ``dependency3``, so that the whole ``dependent`` branch has to be rebuilt, and break the ``bar`` image.
+
+  >>> with open(user.getRegistry().getRepositories()[u'1']["dependency3"].getSubuserImagefilePath(),mode="w") as subuserImagefile:
+  ...   _ = subuserImagefile.write("FROM debian\\nRUN echo changed")
+  >>> with open(user.getRegistry().getRepositories()[u'1']["bar"].getSubuserImagefilePath(),mode="w") as subuserImagefile:
+  ...   _ = subuserImagefile.write("FROM debian\\nRUN false")
+  >>> repo1.run(["commit","-a","-m","changed dependency3 and broke bar"])
+  0
+
+  The order in which the messages of the two branches are printed varies, so the output is collected and checked afterwards.
+
+  >>> try:
+  ...   from StringIO import StringIO
+  ... except ImportError:
+  ...   from io import StringIO # Python 3
+  >>> import sys
+  >>> realStdout = sys.stdout
+  >>> sys.stdout = output = StringIO()
+  >>> try:
+  ...   update.update(["all","--accept","--jobs","2","--verbose"])
+  ... finally:
+  ...   sys.stdout = realStdout
+  >>> lines = output.getvalue().splitlines()
+
+  The images which both subusers depend on are built once, and ``dependent`` waits for its parent to be built.
+
+  >>> lines.count("Installing dependency3 ...")
+  1
+  >>> lines.count("Installing intermediary ...")
+  1
+  >>> lines.index("Installing dependency3 ...") < lines.index("Installing intermediary ...") < lines.index("Installing dependent ...")
+  True
+
+  The failure of ``bar`` is reported, but does not stop the other branch from being built.  The time it took to build each image is printed.
+
+  >>> "Build error:The command '/bin/sh -c false' returned a non-zero code: 1" in lines
+  True
+  >>> str(lines[lines.index("Images for the following subusers failed to build:")+1])
+  'bar'
+  >>> sorted([str(line.split(" in ")[0]) for line in lines if line.startswith("Built ")])
+  ['Built dependency3@file:///home/travis/remote-test-repo', 'Built dependent@file:///home/travis/remote-test-repo', 'Built intermediary@file:///home/travis/remote-test-repo']
+
+  ``dependent`` and ``intermediary`` are switched over to their new images, while ``bar`` keeps its old one.
+
+  >>> user = subuserlib.classes.user.User()
+  >>> user.getRegistry().getSubusers()["dependent"].getImageId() == "37"
+  False
+  >>> user.getInstalledImages()[user.getRegistry().getSubusers()["dependent"].getImageId()].getParentImageId() == user.getRegistry().getSubusers()["intermediary"].getImageId()
+  True
+  >>> user.getRegistry().getSubusers()["bar"].getImageId() == barImageId
+  True
   """
   options,args = parseCliArgs(realArgs)
   user = subuserlib.classes.user.User()
   permissionsAccepter = AcceptPermissionsAtCLI(user,alwaysAccept = options.accept)
-  if len(args) < 1:
+  if options.verbose:
+    user.getRegistry().setLogOutputVerbosity(3)
+  if options.background:
+    if args and not ["all"] == args:
+      sys.exit("--background can only be used to update all subusers.")
+    try:
+      with user.getRegistry().getLock():
+        subuserlib.update.prebuildAll(user,jobs=options.jobs)
+    except subuserlib.portalocker.portalocker.LockException:
+      sys.exit("Another subuser process is currently running and has a lock on the registry. Please try again later.")
+  elif len(args) < 1:
     sys.exit("No arguments given. Please use subuser update -h for help.")
   elif ["all"] == args:
     try:
       with user.getRegistry().getLock():
-        subuserlib.update.updateAll(user,permissionsAccepter=permissionsAccepter)
+        subuserlib.update.updateAll(user,permissionsAccepter=permissionsAccepter,jobs=options.jobs)
     except subuserlib.portalocker.portalocker.LockException:
       sys.exit("Another subuser process is currently running and has a lock on the registry. Please try again later.")
   elif "subusers" == args[0]:
     try:
       with user.getRegistry().getLock():
-        subuserlib.update.updateSubusers(user,args[1:],permissionsAccepter=permissionsAccepter)
+        subuserlib.update.updateSubusers(user,args[1:],permissionsAccepter=permissionsAccepter,jobs=options.jobs)
     except subuserlib.portalocker.portalocker.LockException:
       sys.exit("Another subuser process is currently running and has a lock on the registry. Please try again later.")
   elif ["log"] == args:
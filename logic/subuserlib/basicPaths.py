@@ -9,9 +9,15 @@ This module exists only to provide some things that are also int paths, to modul
 #external imports
 import os,inspect
 #internal imports
-#import ...
+import subuserlib.test
 home = os.path.expanduser("~")
 
+def getHomeDir():
+  """ Get the home dir of the user who is running subuser.  While testing, this is the test user's home dir. """
+  if subuserlib.test.testing:
+    return "/home/travis/test-home"
+  return home
+
 def getSubuserDir():
   """ Get the toplevel directory for subuser. """
   return os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe()))))) # BLEGH!
@@ -0,0 +1,340 @@
+#!/usr/bin/env python
+# This file should be compatible with both Python 2 and 3.
+# If it is not, please file a bug report.
+
+"""
+A thread safe pool of keep-alive HTTP connections to the Docker daemon's unix socket.
+
+Each request checks a connection out of the pool, so concurrent callers never share a connection.  Once the response has been read, the connection is returned to the pool and reused for the next request.
+
+The daemon may close an idle connection at any time.  Idle connections which the daemon has closed are dropped when they are checked out.  If a reused connection fails anyway, the request is only sent again if it is safe to do so, that is, if it is a GET or HEAD request, or if the request was never sent in full.  A POST such as ``containers/create`` may already have been carried out by the daemon, and sending it again could, for example, create a second container.
+"""
+
+#external imports
+import socket,threading,time,contextlib,select
+try:
+ import httplib
+except ImportError:
+ import http.client
+ httplib = http.client
+#internal imports
+from subuserlib.classes.uhttpConnection import UHTTPConnection
+
+# All requests to the Docker daemon are made against this version of its API.  Version 1.25 came with Docker 1.13, which is the oldest version of Docker that subuser supports.
+apiVersion = "/v1.25"
+defaultSocketPath = "/var/run/docker.sock"
+
+# Requests which can be sent a second time without changing their outcome.
+idempotentMethods = ["GET","HEAD"]
+
+def isClosedByPeer(connection):
+  """
+  Returns True if the other end has closed the idle connection.  Nothing should arrive over an idle connection, so if there is anything to read, it is the end of the stream.
+  """
+  if connection.sock is None: # Not yet connected.
+    return False
+  try:
+    (readable,_,_) = select.select([connection.sock],[],[],0)
+  except (select.error,ValueError,socket.error):
+    return True
+  return bool(readable)
+
+class Response():
+  """
+  A response whose body has already been read in full.
+  """
+  def __init__(self,status,reason,body):
+    self.status = status
+    self.reason = reason
+    self.body = body
+
+  def read(self):
+    return self.body
+
+class ConnectionPool():
+  """
+  >>> import os,socket,threading,tempfile,time,shutil
+  >>> from subuserlib.classes.docker.connectionPool import ConnectionPool
+
+  A daemon which answers "ok" to every request.  It can be told to close the connection after answering, to close it instead of answering, or to take its time.
+
+  >>> tempDir = tempfile.mkdtemp()
+  >>> socketPath = os.path.join(tempDir,"docker.sock")
+  >>> receivedRequests = []
+  >>> behaviour = {"close":False,"drop":False,"delay":0}
+  >>> def serve(connection):
+  ...   data = b""
+  ...   while True:
+  ...     while not b"\\r\\n\\r\\n" in data:
+  ...       received = connection.recv(4096)
+  ...       if not received:
+  ...         connection.close()
+  ...         return
+  ...       data += received
+  ...     (head,data) = data.split(b"\\r\\n\\r\\n",1)
+  ...     receivedRequests.append(str(head.split(b"\\r\\n")[0].decode("ascii")))
+  ...     for header in head.split(b"\\r\\n")[1:]:
+  ...       if header.lower().startswith(b"content-length:"):
+  ...         while len(data) < int(header.split(b":")[1]):
+  ...           data += connection.recv(4096)
+  ...         data = data[int(header.split(b":")[1]):]
+  ...     if behaviour["drop"]:
+  ...       behaviour["drop"] = False
+  ...       connection.close()
+  ...       return
+  ...     time.sleep(behaviour["delay"])
+  ...     connection.sendall(b"HTTP/1.1 200 OK\\r\\nContent-Length: 2\\r\\n\\r\\nok")
+  ...     if behaviour["close"]:
+  ...       connection.close()
+  ...       return
+  >>> def accept(server):
+  ...   while True:
+  ...     (connection,_) = server.accept()
+  ...     connectionThread = threading.Thread(target=serve,args=(connection,))
+  ...     connectionThread.daemon = True
+  ...     connectionThread.start()
+  >>> server = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+  >>> server.bind(socketPath)
+  >>> server.listen(8)
+  >>> serverThread = threading.Thread(target=accept,args=(server,))
+  >>> serverThread.daemon = True
+  >>> serverThread.start()
+
+  Connections are reused.
+
+  >>> pool = ConnectionPool(socketPath,timeout=5)
+  >>> pool.request("GET","/v1.25/images/json").read() == b"ok"
+  True
+  >>> pool.request("GET","/v1.25/images/json").read() == b"ok"
+  True
+  >>> statistics = pool.getStatistics()
+  >>> statistics["requests"],statistics["new-connections"],statistics["reused-connections"]
+  (2, 1, 1)
+
+  A connection which is checked out is not handed out again until it is checked back in.
+
+  >>> (first,_) = pool.checkout()
+  >>> (second,reused) = pool.checkout()
+  >>> first is second,reused
+  (False, False)
+  >>> pool.checkin(second)
+  >>> pool.checkin(first)
+  >>> pool.checkout()[0] is first
+  True
+  >>> pool.checkin(first)
+  >>> pool.close()
+
+  Idle connections which the daemon has closed are not reused.
+
+  >>> pool = ConnectionPool(socketPath,timeout=5)
+  >>> behaviour["close"] = True
+  >>> pool.request("GET","/v1.25/images/json").read() == b"ok"
+  True
+  >>> time.sleep(0.2)
+  >>> behaviour["close"] = False
+  >>> pool.request("GET","/v1.25/images/json").read() == b"ok"
+  True
+  >>> statistics = pool.getStatistics()
+  >>> statistics["new-connections"],statistics["reused-connections"],statistics["reconnects"]
+  (2, 0, 0)
+
+  If a reused connection fails after a GET request was sent, the request is sent again over a new connection.
+
+  >>> receivedRequests[:] = []
+  >>> behaviour["drop"] = True
+  >>> pool.request("GET","/v1.25/images/json").read() == b"ok"
+  True
+  >>> receivedRequests
+  ['GET /v1.25/images/json HTTP/1.1', 'GET /v1.25/images/json HTTP/1.1']
+  >>> pool.getStatistics()["reconnects"]
+  1
+
+  A POST is not sent twice, because the daemon may already have carried it out.
+
+  >>> receivedRequests[:] = []
+  >>> behaviour["drop"] = True
+  >>> try:
+  ...   pool.request("POST","/v1.25/containers/create",body=b"{}")
+  ... except Exception:
+  ...   print("The request failed.")
+  The request failed.
+  >>> receivedRequests
+  ['POST /v1.25/containers/create HTTP/1.1']
+
+  Requests time out.
+
+  >>> behaviour["delay"] = 1
+  >>> try:
+  ...   pool.request("GET","/v1.25/images/json",timeout=0.2)
+  ... except socket.timeout:
+  ...   print("The request timed out.")
+  The request timed out.
+  >>> behaviour["delay"] = 0
+  >>> pool.close()
+  >>> server.close()
+  >>> shutil.rmtree(tempDir)
+  """
+  def __init__(self,socketPath,timeout=60,maxIdleConnections=8):
+    """
+    The timeout is given in seconds and is applied to requests made with ``request``.  At most ``maxIdleConnections`` connections are kept open while not in use.
+    """
+    self.__socketPath = socketPath
+    self.__timeout = timeout
+    self.__maxIdleConnections = maxIdleConnections
+    self.__idleConnections = []
+    self.__lock = threading.Lock()
+    self.__statistics = {
+      "requests": 0,
+      "new-connections": 0,
+      "reused-connections": 0,
+      "reconnects": 0,
+      "total-latency": 0.0,
+      "max-latency": 0.0}
+
+  def getSocketPath(self):
+    return self.__socketPath
+
+  def getStatistics(self):
+    """
+    Return a dictionary of counters: the number of requests made, how many connections were opened, reused and re-established after the daemon closed them, as well as the total and maximum latency(time until the response headers arrived) in seconds.
+    """
+    with self.__lock:
+      return dict(self.__statistics)
+
+  def _recordLatency(self,latency):
+    with self.__lock:
+      self.__statistics["requests"] += 1
+      self.__statistics["total-latency"] += latency
+      if latency > self.__statistics["max-latency"]:
+        self.__statistics["max-latency"] = latency
+
+  def _newConnection(self):
+    return UHTTPConnection(self.__socketPath,timeout=self.__timeout)
+
+  def checkout(self):
+    """
+    Take an idle connection out of the pool, or open a new one if none are idle.
+    Returns a tuple ``(connection,reused)``.
+    """
+    while True:
+      with self.__lock:
+        if not self.__idleConnections:
+          self.__statistics["new-connections"] += 1
+          break
+        connection = self.__idleConnections.pop()
+        if not isClosedByPeer(connection):
+          self.__statistics["reused-connections"] += 1
+          return (connection,True)
+      connection.close()
+    return (self._newConnection(),False)
+
+  def checkin(self,connection):
+    """
+    Give a connection back to the pool.  The last response sent over the connection must have been read in full.
+    """
+    with self.__lock:
+      if len(self.__idleConnections) < self.__maxIdleConnections:
+        self.__idleConnections.append(connection)
+        return
+    connection.close()
+
+  def close(self):
+    """
+    Close all idle connections.
+    """
+    with self.__lock:
+      idleConnections = self.__idleConnections
+      self.__idleConnections = []
+    for connection in idleConnections:
+      connection.close()
+
+  def _sendRequest(self,connection,method,url,body,headers):
+    """
+    Send a request.  If the body is an iterable of byte strings, rather than a string or file, it is sent with chunked transfer encoding as it is being generated.
+    """
+    if body is None or isinstance(body,(bytes,str)) or hasattr(body,"read"):
+      connection.request(method,url,body=body,headers=headers)
+      return
+    connection.putrequest(method,url)
+    for header,value in headers.items():
+      connection.putheader(header,value)
+    connection.putheader("Transfer-Encoding","chunked")
+    connection.endheaders()
+    for chunk in body:
+      if chunk:
+        connection.send(("%x\r\n" % len(chunk)).encode("ascii")+chunk+b"\r\n")
+    connection.send(b"0\r\n\r\n")
+
+  def _getResponse(self,method,url,body,headers,timeout):
+    """
+    Send the request over a pooled connection and wait for the response headers.
+    If the connection was an idle keep-alive connection which the daemon has since closed, reconnect and send the request again, provided that doing so is safe(see the module's documentation).
+    Returns a tuple ``(connection,response)``.
+    """
+    if headers is None:
+      headers = {}
+    startTime = time.time()
+    (connection,reused) = self.checkout()
+    connection.setTimeout(timeout)
+    sent = False
+    try:
+      self._sendRequest(connection,method,url,body,headers)
+      sent = True
+      response = connection.getresponse()
+    except socket.timeout:
+      connection.close()
+      raise
+    except (socket.error,httplib.HTTPException):
+      connection.close()
+      # Only bodies which we have in memory can be sent a second time.
+      if not reused or not (body is None or isinstance(body,(bytes,str))):
+        raise
+      if sent and not method in idempotentMethods:
+        raise
+      with self.__lock:
+        self.__statistics["reconnects"] += 1
+      connection = self._newConnection()
+      connection.setTimeout(timeout)
+      try:
+        self._sendRequest(connection,method,url,body,headers)
+        response = connection.getresponse()
+      except:
+        connection.close()
+        raise
+    self._recordLatency(time.time()-startTime)
+    return (connection,response)
+
+  def request(self,method,url,body=None,headers=None,timeout=None):
+    """
+    Make a request to the Docker daemon and read the whole response.  Returns a ``Response`` object.
+
+    If timeout is None, the pool's default timeout is used.
+    """
+    if timeout is None:
+      timeout = self.__timeout
+    (connection,response) = self._getResponse(method,url,body,headers,timeout)
+    try:
+      responseBody = response.read()
+    except:
+      connection.close()
+      raise
+    self.checkin(connection)
+    return Response(response.status,response.reason,responseBody)
+
+  @contextlib.contextmanager
+  def streamingRequest(self,method,url,body=None,headers=None,timeout=None):
+    """
+    Make a request whose response is to be read incrementally, such as the output of a build.  To be used with with.  Yields an `HTTPResponse <https://docs.python.org/2/library/httplib.html#httpresponse-objects>`_ object.
+
+    Unlike ``request``, a timeout of None means that reads will block forever.  If the response has not been read in full when the with block exits, the connection is closed rather than being returned to the pool.
+    """
+    (connection,response) = self._getResponse(method,url,body,headers,timeout)
+    try:
+      yield response
+    except:
+      connection.close()
+      raise
+    if response.isclosed():
+      self.checkin(connection)
+    else:
+      connection.close()
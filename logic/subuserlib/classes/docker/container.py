@@ -10,6 +10,7 @@ Container objects allow you to interact with docker containers via the Docker da
 import json
 #internal imports
 from subuserlib.classes.userOwnedObject import UserOwnedObject
+from subuserlib.classes.docker.connectionPool import apiVersion
 
 class Container(UserOwnedObject):
   def __init__(self,user,containerId):
@@ -21,18 +22,14 @@ class Container(UserOwnedObject):
      Returns a dictionary of container properties.
      If the container no longer exists, return None.
     """
-    self.getUser().getDockerDaemon().getConnection().request("GET","/v1.13/containers/"+self.__containerId+"/json")
-    response = self.getUser().getDockerDaemon().getConnection().getresponse()
+    response = self.getUser().getDockerDaemon().getConnectionPool().request("GET",apiVersion+"/containers/"+self.__containerId+"/json")
     if not response.status == 200:
-      response.read() # Read the response and discard it to prevent the server from getting locked up: http://stackoverflow.com/questions/3231543/python-httplib-responsenotready
       return None
     else:
       return json.loads(response.read().decode("utf-8"))
 
   def stop(self):
-    self.getUser().getDockerDaemon().getConnection().request("POST","/v1.13/containers/"+self.getId()+"/stop")
-    response = self.getUser().getDockerDaemon().getConnection().getresponse()
-    response.read()
+    self.getUser().getDockerDaemon().getConnectionPool().request("POST",apiVersion+"/containers/"+self.getId()+"/stop")
 
   def getId(self):
     return self.__containerId
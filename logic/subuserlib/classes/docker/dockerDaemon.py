@@ -7,32 +7,83 @@ The DockerDaemon object allows us to communicate with the Docker daemon via the
 """
 
 #external imports
-import urllib,tarfile,os,tempfile,fnmatch,re,json,sys
+import urllib,tarfile,os,re,json,io,threading,time
 try:
  import httplib
 except ImportError:
  import http.client
  httplib = http.client
-try:
- import StringIO
-except ImportError:
- import io
 #internal imports
 from subuserlib.classes.userOwnedObject import UserOwnedObject
-from subuserlib.classes.uhttpConnection import UHTTPConnection
 import subuserlib.docker
+import subuserlib.dockerRun
+import subuserlib.jsonStream
 import subuserlib.test
 from subuserlib.classes.docker.container import Container
+from subuserlib.classes.docker.connectionPool import apiVersion
+from subuserlib.classes.docker.dockerIgnore import getDockerIgnore
+
+fullImageIdPattern = re.compile("^(?:sha256:)?([0-9a-f]{64})$")
+# Lookups of images which do not exist are only cached for this many seconds.
+negativeImagePropertiesTTL = 5
+# The on disk image properties cache is discarded if it has not been checked against the daemon's events for this many seconds.
+maxImagePropertiesCacheAge = 7 * 24 * 60 * 60
+# The Docker daemon only remembers a limited number of events.  If we get this many, we may have missed some.
+maxDockerEvents = 256
+
+def getTarEntry(tarinfo,fileObject=None,blockSize=65536):
+  """
+  A generator which yields a tar header for the given TarInfo object, followed by the entry's padded contents read from fileObject in blocks.
+  """
+  yield tarinfo.tobuf(tarfile.GNU_FORMAT,"utf-8")
+  if fileObject is None:
+    return
+  bytesLeft = tarinfo.size
+  while bytesLeft > 0:
+    block = fileObject.read(min(blockSize,bytesLeft))
+    if not block: # The file has shrunk since we read its size, pad it out with zeros.
+      block = b"\0" * min(blockSize,bytesLeft)
+    bytesLeft -= len(block)
+    yield block
+  remainder = tarinfo.size % tarfile.BLOCKSIZE
+  if remainder:
+    yield b"\0" * (tarfile.BLOCKSIZE - remainder)
 
-def archiveBuildContext(archive,directoryWithDockerfile,excludePatterns,dockerfile=None):
+def generateBuildContext(directoryWithDockerfile,dockerIgnore,dockerfile=None):
   """
-  Archive files from directoryWithDockerfile into the FileObject archive excluding files who's paths(relative to directoryWithDockerfile) are in excludePatterns.
+  A generator which yields a tar archive of the files in directoryWithDockerfile, excluding files and directories which are excluded by the given DockerIgnore object, as a series of blocks.
   If dockerfile is set to a string, include that string as the file Dockerfile in the archive.
+
+  The archive is produced lazily, so it can be sent to the Docker daemon while it is being generated.  At most one block of each file is held in memory at a time.
+
+  >>> import os,io,tarfile,tempfile,shutil
+  >>> from subuserlib.classes.docker.dockerDaemon import generateBuildContext
+  >>> from subuserlib.classes.docker.dockerIgnore import getDockerIgnore
+  >>> contextDir = tempfile.mkdtemp()
+  >>> os.mkdir(os.path.join(contextDir,"sub"))
+  >>> bigFileContents = b"subuser" * 20000 # Bigger than the blocks in which files are read.
+  >>> for (fileName,contents) in [("small",b"hello"),("big",bigFileContents),(os.path.join("sub","nested"),b""),("ignored",b"secret"),(".dockerignore",b"ignored")]:
+  ...   with open(os.path.join(contextDir,fileName),"wb") as contextFile:
+  ...     _ = contextFile.write(contents)
+  >>> blocks = list(generateBuildContext(contextDir,getDockerIgnore(contextDir),dockerfile="FROM 3\\n"))
+  >>> len(b"".join(blocks)) % tarfile.BLOCKSIZE
+  0
+  >>> archive = tarfile.open(fileobj=io.BytesIO(b"".join(blocks)),mode="r")
+  >>> sorted(archive.getnames())
+  ['.dockerignore', 'Dockerfile', 'big', 'small', 'sub/nested']
+  >>> archive.extractfile("big").read() == bigFileContents
+  True
+  >>> archive.extractfile("small").read() == b"hello"
+  True
+  >>> archive.extractfile("Dockerfile").read() == b"FROM 3\\n"
+  True
+  >>> shutil.rmtree(contextDir)
   """
   # Inspired by and partialy taken from https://github.com/docker/docker-py
-  contexttarfile = tarfile.open(mode="w",fileobj=archive)
+  # We never write to this TarFile. We only use it to create TarInfo objects.
+  tarinfoFactory = tarfile.TarFile(fileobj=io.BytesIO(),mode="w")
   if directoryWithDockerfile:
-    fileList = os.walk(directoryWithDockerfile)
+    fileList = dockerIgnore.walk(directoryWithDockerfile)
   else:
     fileList = []
   for dirpath, _, filenames in fileList:
@@ -40,65 +91,78 @@ def archiveBuildContext(archive,directoryWithDockerfile,excludePatterns,dockerfi
     if relpath == '.':
       relpath = ''
     for filename in filenames:
-      exclude = False
       fileNameInArchive = os.path.join(relpath,filename)
-      for excludePattern in excludePatterns:
-        if fnmatch.fnmatch(fileNameInArchive,excludePattern):
-          exclude = True
-      if not exclude:
-        contexttarfile.add(os.path.join(directoryWithDockerfile,fileNameInArchive), arcname=fileNameInArchive,recursive=False) # Explicit setting of recursive is not strictly necessary.
+      path = os.path.join(directoryWithDockerfile,fileNameInArchive)
+      tarinfo = tarinfoFactory.gettarinfo(path,arcname=fileNameInArchive)
+      if tarinfo is None: # Sockets and other special files cannot be archived.
+        continue
+      if tarinfo.isreg():
+        with open(path,"rb") as fileObject:
+          for block in getTarEntry(tarinfo,fileObject):
+            yield block
+      else:
+        for block in getTarEntry(tarinfo):
+          yield block
   # Add the provided Dockerfile if necessary
   if not dockerfile == None:
-    try:
-      dockerfileFileObject = StringIO.StringIO(dockerfile)
-    except NameError:
-      dockerfileFileObject = io.BytesIO(bytes(dockerfile,"UTF-8"))
+    if not isinstance(dockerfile,bytes):
+      dockerfile = dockerfile.encode("utf-8")
     tarinfo = tarfile.TarInfo(name="Dockerfile")
-    dockerfileFileObject.seek(0, os.SEEK_END)
-    tarinfo.size = dockerfileFileObject.tell()
-    dockerfileFileObject.seek(0)
-    contexttarfile.addfile(tarinfo,dockerfileFileObject)
-  contexttarfile.close()
-  archive.seek(0)
-
-def readAndPrintStreamingBuildStatus(user,response):
-  jsonSegmentBytes = b''
-  output = b''
-  byte = response.read(1)
-  while byte:
-    jsonSegmentBytes += byte
-    output += byte
-    byte = response.read(1)
-    try:
-      lineDict = json.loads(jsonSegmentBytes.decode("utf-8"))
-      if "stream" in lineDict:
-        user.getRegistry().log(lineDict["stream"])
-      elif "status" in lineDict:
-        user.getRegistry().log(lineDict["status"])
-      elif "errorDetail" in lineDict:
-        raise ImageBuildException("Build error:"+lineDict["errorDetail"]["message"]+"\n"+response.read())
-      else:
-        raise ImageBuildException("Build error:"+jsonSegmentBytes.decode("utf-8")+"\n"+response.read())
-      jsonSegmentBytes = b''
-    except ValueError:
-      pass
-  return output.decode("utf-8")
+    tarinfo.size = len(dockerfile)
+    for block in getTarEntry(tarinfo,io.BytesIO(dockerfile)):
+      yield block
+  # The end of the archive is marked by two empty blocks.
+  yield b"\0" * (2 * tarfile.BLOCKSIZE)
+
+def readStreamingBuildStatus(user,response,printStatus=True):
+  """
+  Read the stream of JSON status messages that the Docker daemon sends while building an image, logging them if printStatus is True.
+  Returns the Id of the built image, as reported by the daemon, or None if the daemon did not report one.
+  Raises an ImageBuildException if the daemon reports an error.
+  """
+  imageId = None
+  for message in subuserlib.jsonStream.readJsonStream(response):
+    if "stream" in message:
+      if printStatus:
+        user.getRegistry().log(message["stream"])
+      match = re.search(r'Successfully built ([0-9a-f]+)',message["stream"])
+      if match:
+        imageId = match.group(1)
+    elif "status" in message:
+      if printStatus:
+        user.getRegistry().log(message["status"])
+    elif "aux" in message:
+      if "ID" in message["aux"]:
+        imageId = message["aux"]["ID"]
+    elif "errorDetail" in message:
+      raise ImageBuildException("Build error:"+message["errorDetail"]["message"])
+    else:
+      raise ImageBuildException("Build error:"+json.dumps(message))
+  return imageId
 
 class DockerDaemon(UserOwnedObject):
   def __init__(self,user):
-    self.__connection = None
+    self.__connectionPool = None
+    self.__connectionPoolLock = threading.Lock()
+    self.__imagePropertiesCache = {} # {imageId : (imageProperties or None,timeFetched)}
+    self.__imagePropertiesCacheLock = threading.Lock()
+    self.__imagePropertiesCacheChecked = False
+    self.__imagePropertiesCacheStatistics = {"hits":0,"disk-hits":0,"misses":0}
+    self.__imageLineageCache = {} # {imageId : [layerId]}
+    self.__imageLineageCacheLock = threading.Lock()
+    self.__imageHistoryUnsupported = False
     UserOwnedObject.__init__(self,user)
 
-  def getConnection(self):
+  def getConnectionPool(self):
     """
-     Get an `HTTPConnection <https://docs.python.org/2/library/httplib.html#httplib.HTTPConnection>`_ to the Docker daemon.
+     Get the :doc:`ConnectionPool <docker>` through which all requests to the Docker daemon are made.  The pool may be shared between threads.
 
      Note: You can find more info in the `Docker API docs <https://docs.docker.com/reference/api/docker_remote_api_v1.13/>`_
     """
-    if not self.__connection:
-      subuserlib.docker.getAndVerifyDockerExecutable()
-      self.__connection = UHTTPConnection("/var/run/docker.sock")
-    return self.__connection
+    with self.__connectionPoolLock:
+      if not self.__connectionPool:
+        self.__connectionPool = subuserlib.dockerRun.getConnectionPool()
+    return self.__connectionPool
 
   def getContainer(self,containerId):
     return Container(self.getUser(),containerId)
@@ -106,26 +170,315 @@ class DockerDaemon(UserOwnedObject):
   def getImageProperties(self,imageTagOrId):
     """
      Returns a dictionary of image properties, or None if the image does not exist.
+
+     Images are content addressed, so the properties of an image which is referred to by its full Id are cached, both in memory and on disk.  Lookups of images which do not exist are cached for a few seconds.  Lookups by tag or by short Id always go to the daemon.
+
+    >>> import json,shutil
+    >>> import subuserlib.classes.user,subuserlib.classes.docker.dockerDaemon
+    >>> from subuserlib.classes.docker.dockerDaemon import RealDockerDaemon
+    >>> try:
+    ...   from urlparse import urlparse,parse_qs
+    ... except ImportError:
+    ...   from urllib.parse import urlparse,parse_qs # Python 3
+    >>> class Response(object):
+    ...   def __init__(self,status,body):
+    ...     self.status = status
+    ...     self.body = body
+    ...   def read(self):
+    ...     return self.body
+    >>> class FakeConnectionPool(object):
+    ...   def __init__(self,images,events):
+    ...     self.images = images
+    ...     self.events = events
+    ...   def request(self,method,url,body=None,headers=None,timeout=None):
+    ...     path = urlparse(url).path
+    ...     if path.endswith("/events"):
+    ...       print("Checking events filtered by "+parse_qs(urlparse(url).query)["filters"][0])
+    ...       return Response(200,b"".join([json.dumps(event).encode("utf-8")+b"\\n" for event in self.events]))
+    ...     imageId = path.split("/")[-2].split(":")[-1]
+    ...     print("Inspecting "+imageId[:4])
+    ...     if imageId in self.images:
+    ...       return Response(200,json.dumps(self.images[imageId]).encode("utf-8"))
+    ...     return Response(404,b"")
+    >>> class FakeDaemon(RealDockerDaemon):
+    ...   def __init__(self,user,images,events=[]):
+    ...     RealDockerDaemon.__init__(self,user)
+    ...     self.connectionPool = FakeConnectionPool(images,events)
+    ...   def getConnectionPool(self):
+    ...     return self.connectionPool
+    >>> user = subuserlib.classes.user.User()
+    >>> shutil.rmtree(os.path.join(user.getConfig()["cache-dir"],"docker-images"),ignore_errors=True)
+    >>> (a,b,c) = ("a"*64,"b"*64,"c"*64)
+    >>> images = {a:{"Id":"sha256:"+a,"Parent":""},b:{"Id":"sha256:"+b,"Parent":a}}
+
+    The first lookup of an image goes to the daemon.  Later lookups are answered from memory.
+
+    >>> daemon = FakeDaemon(user,images)
+    >>> str(daemon.getImageProperties(a)["Id"]) == "sha256:"+a
+    Inspecting aaaa
+    True
+    >>> str(daemon.getImageProperties(a)["Id"]) == "sha256:"+a
+    True
+    >>> _ = daemon.getImageProperties("sha256:"+b)
+    Inspecting bbbb
+
+    Images which do not exist are looked up again once ``negativeImagePropertiesTTL`` has passed.
+
+    >>> daemon.getImageProperties(c)
+    Inspecting cccc
+    >>> daemon.getImageProperties(c)
+    >>> subuserlib.classes.docker.dockerDaemon.negativeImagePropertiesTTL = 0
+    >>> daemon.getImageProperties(c)
+    Inspecting cccc
+    >>> subuserlib.classes.docker.dockerDaemon.negativeImagePropertiesTTL = 5
+    >>> sorted(daemon.getImagePropertiesCacheStatistics().items())
+    [('disk-hits', 0), ('hits', 2), ('misses', 4)]
+
+    Another process finds the properties on disk, once it has asked the daemon which images have changed since the cache was last used.  Images which have been deleted, tagged or untagged in the mean time are dropped from the cache.
+
+    >>> daemon = FakeDaemon(user,images,events=[{"Type":"image","Action":"untag","Actor":{"ID":"sha256:"+a}}])
+    >>> _ = daemon.getImageProperties(a)
+    Checking events filtered by {"type": ["image"]}
+    Inspecting aaaa
+    >>> _ = daemon.getImageProperties(b)
+    >>> sorted(daemon.getImagePropertiesCacheStatistics().items())
+    [('disk-hits', 1), ('hits', 0), ('misses', 1)]
+
+    If there are too many events to be sure that none were missed, the whole on disk cache is dropped.
+
+    >>> daemon = FakeDaemon(user,images,events=[{"Type":"image","Action":"tag","Actor":{"ID":"sha256:"+c}}]*subuserlib.classes.docker.dockerDaemon.maxDockerEvents)
+    >>> _ = daemon.getImageProperties(b)
+    Checking events filtered by {"type": ["image"]}
+    Inspecting bbbb
+    """
+    match = fullImageIdPattern.match(imageTagOrId)
+    if not match:
+      with self.__imagePropertiesCacheLock:
+        self.__imagePropertiesCacheStatistics["misses"] += 1
+      return self._inspectImage(imageTagOrId)
+    imageId = match.group(1)
+    with self.__imagePropertiesCacheLock:
+      self._checkImagePropertiesCache()
+      if imageId in self.__imagePropertiesCache:
+        (imageProperties,timeFetched) = self.__imagePropertiesCache[imageId]
+        if imageProperties is not None or time.time() - timeFetched < negativeImagePropertiesTTL:
+          self.__imagePropertiesCacheStatistics["hits"] += 1
+          return imageProperties
+      imageProperties = self._loadCachedImageProperties(imageId)
+      if imageProperties is not None:
+        self.__imagePropertiesCacheStatistics["disk-hits"] += 1
+        self.__imagePropertiesCache[imageId] = (imageProperties,time.time())
+        return imageProperties
+      self.__imagePropertiesCacheStatistics["misses"] += 1
+    imageProperties = self._inspectImage(imageTagOrId)
+    with self.__imagePropertiesCacheLock:
+      self.__imagePropertiesCache[imageId] = (imageProperties,time.time())
+      if imageProperties is not None:
+        self._saveCachedImageProperties(imageId,imageProperties)
+    return imageProperties
+
+  def getImagePropertiesCacheStatistics(self):
+    """
+    Return a dictionary with the number of image property lookups which were answered from memory("hits"), from disk("disk-hits") and by the daemon("misses").
+    """
+    with self.__imagePropertiesCacheLock:
+      return dict(self.__imagePropertiesCacheStatistics)
+
+  def getImageLineage(self,imageId):
+    """
+    Return the list(lineage) of Ids of Docker image layers which goes from a base image to the given image, including all of the image's ancestors in order of dependency.  If the image does not exist, return [].
+
+    The whole lineage is fetched with a single call to the daemon's image history API.  Lineages are remembered, along with the lineages of every ancestor, so that looking up the lineages of many related images costs one call per distinct branch.
+
+    >>> import subuserlib.classes.user
+    >>> from subuserlib.classes.docker.dockerDaemon import RealDockerDaemon
+    >>> class HistoryDaemon(RealDockerDaemon):
+    ...   def getImageHistory(self,imageId):
+    ...     print("Fetching the history of "+imageId)
+    ...     return {"c":[{"Id":"sha256:c"},{"Id":"b"},{"Id":"a"}],"e":[{"Id":"e"},{"Id":"d"},{"Id":"<missing>"}]}.get(imageId)
+    >>> daemon = HistoryDaemon(subuserlib.classes.user.User())
+    >>> daemon.getImageLineage("c")
+    Fetching the history of c
+    ['a', 'b', 'c']
+    >>> daemon.getImageLineage("b")
+    ['a', 'b']
+
+    Layers without Ids belong to pulled images, and are left out.
+
+    >>> daemon.getImageLineage("e")
+    Fetching the history of e
+    ['d', 'e']
+
+    If the daemon cannot provide the history, the image's parents are walked one at a time, stopping at the first layer who's lineage is already known.
+
+    >>> class OldDaemon(RealDockerDaemon):
+    ...   def getImageHistory(self,imageId):
+    ...     return None
+    ...   def getImageProperties(self,imageId):
+    ...     print("Inspecting "+imageId)
+    ...     return {"a":{"Parent":""},"b":{"Parent":"a"},"c":{"Parent":"b"}}.get(imageId)
+    >>> daemon = OldDaemon(subuserlib.classes.user.User())
+    >>> daemon.getImageLineage("b")
+    Inspecting b
+    Inspecting a
+    ['a', 'b']
+    >>> daemon.getImageLineage("c")
+    Inspecting c
+    ['a', 'b', 'c']
+    >>> daemon.getImageLineage("x")
+    Inspecting x
+    []
+    """
+    with self.__imageLineageCacheLock:
+      if imageId in self.__imageLineageCache:
+        return list(self.__imageLineageCache[imageId])
+    history = None
+    if not self.__imageHistoryUnsupported:
+      history = self.getImageHistory(imageId)
+    if history is not None:
+      lineage = []
+      for layer in history:
+        if layer["Id"] == "<missing>": # Layers of pulled images have no Ids of their own and are not images in their own right.
+          break
+        lineage.insert(0,layer["Id"])
+      if lineage: # Refer to the image itself in the same way as the caller did.
+        lineage[-1] = imageId
+    else: # Walk the image's parents one at a time.
+      ancestors = []
+      layer = imageId
+      while layer:
+        with self.__imageLineageCacheLock:
+          if layer in self.__imageLineageCache:
+            break
+        imageProperties = self.getImageProperties(layer)
+        if imageProperties is None:
+          break
+        ancestors.insert(0,layer)
+        layer = imageProperties["Parent"]
+      with self.__imageLineageCacheLock:
+        lineage = list(self.__imageLineageCache.get(layer,[])) + ancestors
+      if ancestors: # The image exists, yet we could not get its history.
+        self.__imageHistoryUnsupported = True
+    with self.__imageLineageCacheLock:
+      for depth in range(len(lineage)):
+        self.__imageLineageCache[lineage[depth]] = lineage[:depth+1]
+    return lineage
+
+  def listImages(self):
+    """
+    Returns a list of dictionaries summarizing every image that the daemon has, including intermediate layers.  Returns None if the list could not be fetched.
+    """
+    response = self.getConnectionPool().request("GET",apiVersion+"/images/json?all=1")
+    if not response.status == 200:
+      return None
+    return json.loads(response.read().decode("utf-8"))
+
+  def getImageHistory(self,imageId):
+    """
+    Returns the image's history as a list of dictionaries, one per layer, starting with the image itself.  Returns None if the history could not be fetched.
     """
-    self.getConnection().request("GET","/v1.13/images/"+imageTagOrId+"/json")
-    response = self.getConnection().getresponse()
+    response = self.getConnectionPool().request("GET",apiVersion+"/images/"+imageId+"/history")
+    if not response.status == 200:
+      return None
+    return json.loads(response.read().decode("utf-8"))
+
+  def _inspectImage(self,imageTagOrId):
+    response = self.getConnectionPool().request("GET",apiVersion+"/images/"+imageTagOrId+"/json")
     if not response.status == 200:
-      response.read() # Read the response and discard it to prevent the server from getting locked up: http://stackoverflow.com/questions/3231543/python-httplib-responsenotready
       return None
     else:
       return json.loads(response.read().decode("utf-8"))
 
+  def _getImagePropertiesCacheDir(self):
+    return os.path.join(self.getUser().getConfig()["cache-dir"],"docker-images")
+
+  def _loadCachedImageProperties(self,imageId):
+    try:
+      with open(os.path.join(self._getImagePropertiesCacheDir(),imageId+".json"),"r") as cacheFile:
+        return json.load(cacheFile)
+    except (IOError,OSError,ValueError):
+      return None
+
+  def _saveCachedImageProperties(self,imageId,imageProperties):
+    cachePath = os.path.join(self._getImagePropertiesCacheDir(),imageId+".json")
+    try:
+      temporaryCachePath = cachePath+".tmp."+str(os.getpid())
+      with open(temporaryCachePath,"w") as cacheFile:
+        json.dump(imageProperties,cacheFile)
+      os.rename(temporaryCachePath,cachePath)
+    except (IOError,OSError): # The cache is only an optimization.
+      pass
+
+  def _uncacheImageProperties(self,imageId):
+    self.__imagePropertiesCache.pop(imageId,None)
+    try:
+      os.remove(os.path.join(self._getImagePropertiesCacheDir(),imageId+".json"))
+    except OSError:
+      pass
+
+  def _checkImagePropertiesCache(self):
+    """
+    The first time that the cache is used, ask the daemon which images have been deleted, tagged or untagged since it was last used and drop them from the on disk cache.  If we cannot be sure that we have heard about every such event, the whole on disk cache is dropped.
+    """
+    if self.__imagePropertiesCacheChecked:
+      return
+    self.__imagePropertiesCacheChecked = True
+    cacheDir = self._getImagePropertiesCacheDir()
+    lastCheckPath = os.path.join(cacheDir,"last-checked.json")
+    now = int(time.time())
+    try:
+      with open(lastCheckPath,"r") as lastCheckFile:
+        lastCheck = json.load(lastCheckFile)["time"]
+    except (IOError,OSError,ValueError,KeyError):
+      lastCheck = None
+    cacheValid = lastCheck is not None and now - lastCheck < maxImagePropertiesCacheAge
+    if cacheValid:
+      queryParameters = [("since",str(lastCheck)),("until",str(now)),("filters",json.dumps({"type":["image"]}))]
+      try:
+        queryParametersString = urllib.urlencode(queryParameters)
+      except AttributeError:
+        queryParametersString = urllib.parse.urlencode(queryParameters) # Python 3
+      response = self.getConnectionPool().request("GET",apiVersion+"/events?"+queryParametersString)
+      cacheValid = response.status == 200
+    if cacheValid:
+      try:
+        events = list(subuserlib.jsonStream.readJsonStream(io.BytesIO(response.read())))
+      except ValueError:
+        events = None
+      if events is None or len(events) >= maxDockerEvents:
+        cacheValid = False
+      else:
+        for event in events:
+          match = fullImageIdPattern.match(event.get("id") or event.get("Actor",{}).get("ID",""))
+          if match:
+            self._uncacheImageProperties(match.group(1))
+    try:
+      if not cacheValid and os.path.exists(cacheDir):
+        for fileName in os.listdir(cacheDir):
+          os.remove(os.path.join(cacheDir,fileName))
+      if not os.path.exists(cacheDir):
+        os.makedirs(cacheDir)
+      with open(lastCheckPath,"w") as lastCheckFile:
+        json.dump({"time":now},lastCheckFile)
+    except (IOError,OSError):
+      pass
+
   def removeImage(self,imageId):
-    self.getConnection().request("DELETE","/v1.13/images/"+imageId)
-    response = self.getConnection().getresponse()
+    response = self.getConnectionPool().request("DELETE",apiVersion+"/images/"+imageId)
+    with self.__imageLineageCacheLock:
+      self.__imageLineageCache = {}
+    match = fullImageIdPattern.match(imageId)
+    with self.__imagePropertiesCacheLock:
+      if match:
+        self._uncacheImageProperties(match.group(1))
+      else:
+        self.__imagePropertiesCache = {}
     if response.status == 404:
-      raise ImageDoesNotExistsException("The image "+imageId+" could not be deleted.\n"+response.read())
+      raise ImageDoesNotExistsException("The image "+imageId+" could not be deleted.\n"+response.read().decode("utf-8"))
     elif response.status == 409:
-      raise ContainerDependsOnImageException("The image "+imageId+" could not be deleted.\n"+response.read())
+      raise ContainerDependsOnImageException("The image "+imageId+" could not be deleted.\n"+response.read().decode("utf-8"))
     elif response.status == 500:
-      raise ServerErrorException("The image "+imageId+" could not be deleted.\n"+response.read())
-    else:
-      response.read()
+      raise ServerErrorException("The image "+imageId+" could not be deleted.\n"+response.read().decode("utf-8"))
 
   def build(self,directoryWithDockerfile=None,useCache=True,rm=True,forceRm=True,quiet=False,tag=None,dockerfile=None,quietClient=False):
     """
@@ -148,51 +501,60 @@ class DockerDaemon(UserOwnedObject):
       queryParametersString = urllib.urlencode(queryParameters)
     except AttributeError:
       queryParametersString = urllib.parse.urlencode(queryParameters) # Python 3
-    excludePatterns = []
     if directoryWithDockerfile:
-      dockerignore = os.path.join(directoryWithDockerfile, '.dockerignore')
-      if os.path.exists(dockerignore):
-        with open(dockerignore, 'r') as f:
-          exclude = list(filter(bool, f.read().split('\n')))
-    # Python 2.x ONLY works with unnamed temporary files.
-    # Python 3.x ONLY works with named temporary files
-    if sys.version_info[0] == 2:
-      with tempfile.TemporaryFile() as tmpArchive:
-        archiveBuildContext(tmpArchive,directoryWithDockerfile,excludePatterns,dockerfile=dockerfile)
-        self.getConnection().request("POST","/v1.13/build?"+queryParametersString,body=tmpArchive)
-    if sys.version_info[0] == 3:
-      with tempfile.NamedTemporaryFile() as tmpArchive:
-        archiveBuildContext(tmpArchive,directoryWithDockerfile,excludePatterns,dockerfile=dockerfile)
-        self.getConnection().request("POST","/v1.13/build?"+queryParametersString,body=tmpArchive)
-
+      dockerIgnore = getDockerIgnore(directoryWithDockerfile)
+    else:
+      dockerIgnore = None
+    buildContext = generateBuildContext(directoryWithDockerfile,dockerIgnore,dockerfile=dockerfile)
     try:
-      response = self.getConnection().getresponse()
-    except httplib.ResponseNotReady as rnr:
-      raise ImageBuildException(rnr)
+      with self.getConnectionPool().streamingRequest("POST",apiVersion+"/build?"+queryParametersString,body=buildContext,headers={"Content-Type":"application/tar"}) as response:
+        return self._readBuildResponse(response,quietClient)
+    except httplib.HTTPException as e:
+      raise ImageBuildException(e)
 
+  def _readBuildResponse(self,response,quietClient):
+    """
+    Read the streaming response to a build request.  Returns the Id of the newly built image.
+    """
     if response.status != 200:
-      if quietClient:
-        response.read()
-      else:
-        readAndPrintStreamingBuildStatus(self.getUser(), response)
+      try:
+        readStreamingBuildStatus(self.getUser(),response,printStatus=not quietClient)
+      except ValueError as e:
+        raise ImageBuildException("Building image failed.\n"+str(e))
       raise ImageBuildException("Building image failed.\n"
                      +"status: "+str(response.status)+"\n"
                      +"Reason: "+response.reason+"\n")
+    try:
+      imageId = readStreamingBuildStatus(self.getUser(),response,printStatus=not quietClient)
+    except ValueError as e:
+      raise ImageBuildException("Unexpected server response when building image:\n"+str(e))
+    if not imageId:
+      raise ImageBuildException("Unexpected server response when building image: No image Id was reported.")
+    return self.getImageProperties(imageId)["Id"]
 
-    if quietClient:
-      output = response.read().decode("utf-8")
-    else:
-      output = readAndPrintStreamingBuildStatus(self.getUser(),response)
-    # Now we move to regex code stolen from the official python Docker bindings. This is REALLY UGLY!
-    outputLines = output.split("\n")
-    search = r'Successfully built ([0-9a-f]+)' #This is REALLY ugly!
-    match = re.search(search, outputLines[-1]) #This is REALLY ugly!
-    if not match:
-      match = re.search(search, outputLines[-2]) #This is REALLY ugly!
-    if not match:
-      raise ImageBuildException("Unexpected server response when building image:\n"+output)
-    shortId = match.group(1) #This is REALLY ugly!
-    return self.getImageProperties(shortId)["Id"]
+  def doesImageContainFile(self,imageId,path):
+    """
+    Returns True if the image contains a file at the given path, False if it does not, or None if the daemon cannot tell us.
+
+    Rather than running a container, this creates one, which is never started, and looks at its file system using the archive API.
+    """
+    response = self.getConnectionPool().request("POST",apiVersion+"/containers/create",body=json.dumps({"Image":imageId,"Cmd":["/bin/true"],"NetworkDisabled":True}),headers={"Content-Type":"application/json"})
+    if not response.status == 201:
+      return None
+    containerId = json.loads(response.read().decode("utf-8"))["Id"]
+    try:
+      queryParametersString = urllib.urlencode({"path":path})
+    except AttributeError:
+      queryParametersString = urllib.parse.urlencode({"path":path}) # Python 3
+    try:
+      response = self.getConnectionPool().request("HEAD",apiVersion+"/containers/"+containerId+"/archive?"+queryParametersString)
+    finally:
+      self.getConnectionPool().request("DELETE",apiVersion+"/containers/"+containerId+"?force=1")
+    if response.status == 200:
+      return True
+    elif response.status == 404:
+      return False
+    return None
 
   def execute(self,args,cwd=None,background=False):
     """
@@ -205,6 +567,18 @@ class DockerDaemon(UserOwnedObject):
     else:
       return subuserlib.docker.runDocker(args,cwd=cwd)
 
+  def runInteractively(self,runArgs):
+    """
+    Run a container in the foreground, as ``docker run`` would with the given arguments, but without launching the docker client.  Returns the container's exit code.
+    """
+    return subuserlib.dockerRun.runInteractively(self.getConnectionPool(),runArgs)
+
+  def runInBackground(self,runArgs):
+    """
+    Create and start a container, as ``docker run`` would with the given arguments, without waiting for it to exit.  Returns a Container object.
+    """
+    return self.getContainer(subuserlib.dockerRun.runInBackground(self.getConnectionPool(),runArgs))
+
 class ImageBuildException(Exception):
   pass
 
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# This file should be compatible with both Python 2 and 3.
+# If it is not, please file a bug report.
+
+"""
+Implements the semantics of Docker's ``.dockerignore`` files, which list the files that should not be sent to the Docker daemon as part of an image's build context.
+"""
+
+#external imports
+import os,re,posixpath
+#internal imports
+#import ...
+
+def translatePattern(pattern):
+  """
+  Translate a ``.dockerignore`` pattern into a regular expression(without anchors).
+
+  ``*`` and ``?`` do not match path separators, ``**`` matches any number of directories.
+
+  >>> import subuserlib.classes.docker.dockerIgnore
+  >>> subuserlib.classes.docker.dockerIgnore.translatePattern("**/*.pyc")
+  '(?:.*/)?[^/]*\\\\.pyc'
+  """
+  regex = ""
+  i = 0
+  while i < len(pattern):
+    character = pattern[i]
+    if pattern.startswith("**",i):
+      i += 2
+      if pattern.startswith("/",i):
+        regex += "(?:.*/)?"
+        i += 1
+      else:
+        regex += ".*"
+      continue
+    if character == "*":
+      regex += "[^/]*"
+    elif character == "?":
+      regex += "[^/]"
+    elif character == "[" and "]" in pattern[i+2:]:
+      end = pattern.index("]",i+2)
+      characterClass = pattern[i+1:end]
+      if characterClass.startswith("!"):
+        characterClass = "^" + characterClass[1:]
+      regex += "[" + characterClass.replace("\\","\\\\") + "]"
+      i = end
+    elif character == "\\" and i + 1 < len(pattern):
+      i += 1
+      regex += re.escape(pattern[i])
+    else:
+      regex += re.escape(character)
+    i += 1
+  return regex
+
+class DockerIgnore():
+  """
+  A compiled set of ``.dockerignore`` patterns.
+
+  A pattern excludes the paths it matches along with everything beneath them.  Patterns starting with ``!`` re-include paths which were excluded by earlier patterns.  The last matching pattern wins.
+
+  >>> from subuserlib.classes.docker.dockerIgnore import DockerIgnore
+  >>> dockerIgnore = DockerIgnore(["# Comment","node_modules","**/*.pyc","assets/*","!assets/logo.png",".git"])
+  >>> [path for path in ["node_modules/a/b.js","src/main.pyc","main.pyc","src/main.py","assets/big.iso","assets/logo.png",".gitignore"] if dockerIgnore.isExcluded(path)]
+  ['node_modules/a/b.js', 'src/main.pyc', 'main.pyc', 'assets/big.iso']
+  >>> dockerIgnore.isPrunable("node_modules")
+  True
+  >>> dockerIgnore.isPrunable("assets")
+  False
+  """
+  def __init__(self,patterns):
+    self.__patterns = [] # [(regex,negated)]
+    self.__negatedPatternComponents = []
+    for pattern in patterns:
+      pattern = pattern.strip()
+      if not pattern or pattern.startswith("#"):
+        continue
+      negated = pattern.startswith("!")
+      if negated:
+        pattern = pattern[1:].strip()
+      pattern = posixpath.normpath(pattern).lstrip("/")
+      if pattern in ["","."]:
+        continue
+      regex = "(?:"+translatePattern(pattern)+")(?:/.*)?" # A pattern also matches everything beneath the paths it matches.
+      self.__patterns.append((re.compile(regex+"$",re.DOTALL),negated))
+      if negated:
+        self.__negatedPatternComponents.append([re.compile(translatePattern(component)+"$",re.DOTALL) if component != "**" else None for component in pattern.split("/")])
+    # When there are no exceptions, a single combined expression decides whether a path is excluded.
+    if self.__patterns and not self.__negatedPatternComponents:
+      self.__combinedPattern = re.compile("|".join(["(?:"+regex.pattern+")" for (regex,_) in self.__patterns]),re.DOTALL)
+    else:
+      self.__combinedPattern = None
+
+  def isExcluded(self,path):
+    """
+    Returns True if the given path, relative to the root of the build context, is excluded.
+    """
+    if self.__combinedPattern:
+      return bool(self.__combinedPattern.match(path))
+    for regex,negated in reversed(self.__patterns):
+      if regex.match(path):
+        return not negated
+    return False
+
+  def isPrunable(self,directory):
+    """
+    Returns True if the directory, relative to the root of the build context, is excluded and no exception pattern could re-include anything beneath it.  Such directories need not be walked at all.
+    """
+    if not self.isExcluded(directory):
+      return False
+    directoryComponents = directory.split("/")
+    for patternComponents in self.__negatedPatternComponents:
+      couldMatch = True
+      for patternComponent,directoryComponent in zip(patternComponents,directoryComponents):
+        if patternComponent is None: # **
+          break
+        if not patternComponent.match(directoryComponent):
+          couldMatch = False
+          break
+      if couldMatch:
+        return False
+    return True
+
+  def walk(self,directory):
+    """
+    Like `os.walk <https://docs.python.org/2/library/os.html#os.walk>`_ except that excluded files are left out and excluded directories are not descended into.
+    """
+    for dirpath,dirnames,filenames in os.walk(directory):
+      relpath = os.path.relpath(dirpath,directory)
+      if relpath == ".":
+        relpath = ""
+      dirnames[:] = [dirname for dirname in dirnames if not self.isPrunable(posixpath.join(relpath,dirname))]
+      filenames = [filename for filename in filenames if not self.isExcluded(posixpath.join(relpath,filename))]
+      yield (dirpath,dirnames,filenames)
+
+def getDockerIgnore(directory):
+  """
+  Return a DockerIgnore object for the ``.dockerignore`` file in the given directory.  If there is no such file, nothing is excluded.
+  """
+  dockerignorePath = os.path.join(directory,".dockerignore")
+  if not os.path.exists(dockerignorePath):
+    return DockerIgnore([])
+  with open(dockerignorePath,"r") as dockerignore:
+    return DockerIgnore(dockerignore.read().splitlines())
@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+# This file should be compatible with both Python 2 and 3.
+# If it is not, please file a bug report.
+
+"""
+The ImageInventory is a snapshot of all of the images which the Docker daemon has, fetched with a single request.  It answers questions such as "does this image exist?" and "what is this image's parent?" without inspecting each image separately.
+"""
+
+#external imports
+import threading
+#internal imports
+from subuserlib.classes.userOwnedObject import UserOwnedObject
+
+def normalizeImageId(imageId):
+  """
+  Newer versions of Docker prefix image Ids with the name of the hash algorithm.
+
+  >>> from subuserlib.classes.docker.imageInventory import normalizeImageId
+  >>> normalizeImageId("sha256:4b0d5ae6f5c8")
+  '4b0d5ae6f5c8'
+  """
+  if imageId.startswith("sha256:"):
+    return imageId[len("sha256:"):]
+  return imageId
+
+class ImageInventory(UserOwnedObject):
+  def __init__(self,user):
+    self.__images = None # {normalizedImageId : image summary}
+    self.__stale = True
+    self.__lock = threading.RLock()
+    UserOwnedObject.__init__(self,user)
+
+  def refresh(self):
+    """
+    Fetch the list of images from the Docker daemon.  Only the entries of images which have been added or removed since the last refresh are updated.
+
+    Returns a tuple of lists ``(addedImageIds,removedImageIds)``.
+
+    >>> import subuserlib.classes.user
+    >>> user = subuserlib.classes.user.User()
+    >>> images = user.getDockerDaemon().images
+    >>> inventory = user.getImageInventory()
+    >>> _ = inventory.refresh()
+    >>> images["sha256:f00d0000"] = {"Parent":"","Created":"0"}
+    >>> images["sha256:f00d1111"] = {"Parent":"sha256:f00d0000","Created":"1"}
+    >>> (addedImageIds,removedImageIds) = inventory.refresh()
+    >>> sorted(addedImageIds),removedImageIds
+    (['f00d0000', 'f00d1111'], [])
+
+    Entries of images which are still there are kept as they were.
+
+    >>> baseImage = inventory.getImage("f00d0000")
+    >>> del images["sha256:f00d1111"]
+    >>> images["sha256:f00d2222"] = {"Parent":"sha256:f00d0000","Created":"2"}
+    >>> inventory.refresh()
+    (['f00d2222'], ['f00d1111'])
+    >>> inventory.getImage("f00d0000") is baseImage
+    True
+    """
+    with self.__lock:
+      imageSummaries = self.getUser().getDockerDaemon().listImages()
+      self.__stale = False
+      if imageSummaries is None: # The daemon did not answer, keep what we had.
+        if self.__images is None:
+          self.__images = {}
+        return ([],[])
+      newImageIds = set([normalizeImageId(imageSummary["Id"]) for imageSummary in imageSummaries])
+      if self.__images is None:
+        self.__images = {}
+      removedImageIds = [imageId for imageId in self.__images if not imageId in newImageIds]
+      for imageId in removedImageIds:
+        del self.__images[imageId]
+      addedImageIds = []
+      for imageSummary in imageSummaries:
+        imageId = normalizeImageId(imageSummary["Id"])
+        if not imageId in self.__images:
+          self.__images[imageId] = imageSummary
+          addedImageIds.append(imageId)
+      return (addedImageIds,removedImageIds)
+
+  def markStale(self):
+    """
+    Call this after images have been built or removed, so that the inventory is refreshed the next time that it is used.
+
+    >>> import subuserlib.classes.user
+    >>> user = subuserlib.classes.user.User()
+    >>> images = user.getDockerDaemon().images
+    >>> inventory = user.getImageInventory()
+    >>> images["sha256:f00d0000"] = {"Parent":"","Created":"0"}
+    >>> inventory.hasImage("f00d0000")
+    True
+    >>> del images["sha256:f00d0000"]
+    >>> inventory.hasImage("f00d0000")
+    True
+    >>> inventory.markStale()
+    >>> inventory.hasImage("f00d0000")
+    False
+    """
+    with self.__lock:
+      self.__stale = True
+
+  def discard(self,imageId):
+    """
+    Forget about an image which has been removed, without refreshing the whole inventory.
+
+    >>> import subuserlib.classes.user
+    >>> user = subuserlib.classes.user.User()
+    >>> user.getDockerDaemon().images["sha256:f00d0000"] = {"Parent":"","Created":"0"}
+    >>> inventory = user.getImageInventory()
+    >>> inventory.hasImage("f00d0000")
+    True
+    >>> inventory.discard("sha256:f00d0000")
+    >>> inventory.hasImage("f00d0000")
+    False
+    """
+    with self.__lock:
+      if self.__images is not None:
+        self.__images.pop(normalizeImageId(imageId),None)
+
+  def __getImages(self):
+    with self.__lock:
+      if self.__stale:
+        self.refresh()
+      return self.__images
+
+  def getImage(self,imageId):
+    """
+    Returns the daemon's summary of the image, a dictionary with the keys "Id", "ParentId", "Created" and "Size", among others.  Images may also be refered to by a unique prefix of their Id.  Returns None if the image does not exist, or if more than one image matches the prefix.
+
+    >>> import subuserlib.classes.user
+    >>> user = subuserlib.classes.user.User()
+    >>> images = user.getDockerDaemon().images
+    >>> images["sha256:f00d0000"] = {"Parent":"","Created":"0"}
+    >>> images["sha256:f00d1111"] = {"Parent":"sha256:f00d0000","Created":"1"}
+    >>> inventory = user.getImageInventory()
+    >>> str(inventory.getImage("sha256:f00d0000")["Id"])
+    'sha256:f00d0000'
+    >>> str(inventory.getImage("f00d1")["Id"])
+    'sha256:f00d1111'
+    >>> inventory.getImage("f00d") is None
+    True
+    >>> inventory.getImage("f00d2") is None
+    True
+    """
+    imageId = normalizeImageId(imageId)
+    with self.__lock:
+      images = self.__getImages()
+      if imageId in images:
+        return images[imageId]
+      if imageId:
+        matchingImages = [imageSummary for fullImageId,imageSummary in images.items() if fullImageId.startswith(imageId)]
+        if len(matchingImages) == 1:
+          return matchingImages[0]
+    return None
+
+  def hasImage(self,imageId):
+    return not self.getImage(imageId) is None
+
+  def getImageIds(self):
+    """
+    Returns a list of the Ids of all of the images that the daemon has, as the daemon reports them.
+    """
+    with self.__lock:
+      return [imageSummary["Id"] for imageSummary in self.__getImages().values()]
+
+  def getImageLineage(self,imageId):
+    """
+    Return the list(lineage) of Ids of Docker image layers which goes from a base image to the given image, following the parent Ids in the inventory.  Returns None if the image is not in the inventory.
+
+    >>> import subuserlib.classes.user
+    >>> user = subuserlib.classes.user.User()
+    >>> images = user.getDockerDaemon().images
+    >>> images["sha256:f00d0000"] = {"Parent":"","Created":"0"}
+    >>> images["sha256:f00d1111"] = {"Parent":"sha256:f00d0000","Created":"1"}
+    >>> images["sha256:f00d2222"] = {"Parent":"sha256:f00d1111","Created":"2"}
+    >>> inventory = user.getImageInventory()
+    >>> [str(layer) for layer in inventory.getImageLineage("sha256:f00d2222")]
+    ['sha256:f00d0000', 'sha256:f00d1111', 'sha256:f00d2222']
+    >>> [str(layer) for layer in inventory.getImageLineage("sha256:f00d0000")]
+    ['sha256:f00d0000']
+    >>> inventory.getImageLineage("sha256:f00d3333") is None
+    True
+    """
+    with self.__lock:
+      imageSummary = self.getImage(imageId)
+      if imageSummary is None:
+        return None
+      lineage = [imageId]
+      parentId = imageSummary.get("ParentId")
+      while parentId:
+        imageSummary = self.getImage(parentId)
+        if imageSummary is None:
+          break
+        lineage.insert(0,imageSummary["Id"])
+        parentId = imageSummary.get("ParentId")
+      return lineage
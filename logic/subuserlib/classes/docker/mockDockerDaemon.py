@@ -8,7 +8,7 @@ In order to make our test suit work, we must use a MockDockerDaemon rather than
 """
 
 #external imports
-import json,os
+import json,os,contextlib,threading
 #internal imports
 from subuserlib.classes.userOwnedObject import UserOwnedObject
 import subuserlib.classes.docker.dockerDaemon
@@ -17,14 +17,15 @@ class MockDockerDaemon(UserOwnedObject):
   def __init__(self,user):
     self.images = {}
     self.nextImageId = 1
+    self.buildLock = threading.Lock()
     UserOwnedObject.__init__(self,user)
     self.imagesPath = "/root/subuser/test/docker/images.json"
     if not os.path.exists(self.imagesPath):
       self.imagesPath = "/home/travis/build/subuser-security/subuser/test/docker/images.json"
     self.__load()
     self.dockerDaemon = subuserlib.classes.docker.dockerDaemon.RealDockerDaemon(user)
-    self.connection = MockConnection(self)
-    self.dockerDaemon.getConnection = self.getConnection
+    self.connectionPool = MockConnectionPool(self)
+    self.dockerDaemon.getConnectionPool = self.getConnectionPool
     self.dockerDaemon.getImageProperties = self.getImageProperties
  
   def __load(self):
@@ -35,8 +36,8 @@ class MockDockerDaemon(UserOwnedObject):
     with open(self.imagesPath,"w") as imagesFile:
       json.dump(self.images,imagesFile)
 
-  def getConnection(self):
-    return self.connection
+  def getConnectionPool(self):
+    return self.connectionPool
 
   def getImageProperties(self,imageTagOrId):
     """
@@ -47,12 +48,30 @@ class MockDockerDaemon(UserOwnedObject):
     else:
       return None
 
+  def listImages(self):
+    return [{"Id":imageId,"ParentId":image["Parent"],"Created":image["Created"],"Size":image.get("Size",0)} for imageId,image in self.images.items()]
+
+  def getImageLineage(self,imageId):
+    lineage = []
+    while imageId in self.images:
+      lineage.insert(0,imageId)
+      imageId = self.images[imageId]["Parent"]
+    return lineage
+
   def build(self,directoryWithDockerfile=None,useCache=True,rm=True,forceRm=True,quiet=False,quietClient=False,tag=None,dockerfile=None):
     """
     Build a Docker image.  If a the dockerfile argument is set to a string, use that string as the Dockerfile.  Return the newly created images Id or raises an exception if the build fails.
+
+    Builds of Dockerfiles containing the line ``RUN false`` fail, so that build errors can be tested.
     """
+    with self.buildLock:
+      return self._build(directoryWithDockerfile,useCache,rm,forceRm,quiet,quietClient,tag,dockerfile)
+
+  def _build(self,directoryWithDockerfile,useCache,rm,forceRm,quiet,quietClient,tag,dockerfile):
     while str(self.nextImageId) in self.images:
       self.nextImageId = self.nextImageId+1
+    if "RUN false" in dockerfile.split("\n"):
+      raise subuserlib.classes.docker.dockerDaemon.ImageBuildException("Build error:The command '/bin/sh -c false' returned a non-zero code: 1")
     self.newId = str(self.nextImageId)
     parent = dockerfile.split("\n")[0].split(" ")[1].rstrip()
     if "debian" in dockerfile:
@@ -63,17 +82,31 @@ class MockDockerDaemon(UserOwnedObject):
     return self.newId
 
   def removeImage(self,imageId):
-    del self.images[imageId]
-    self.__save()
+    with self.buildLock:
+      if not imageId in self.images:
+        raise subuserlib.classes.docker.dockerDaemon.ImageDoesNotExistsException("The image "+imageId+" could not be deleted.")
+      del self.images[imageId]
+      self.__save()
+
+  def doesImageContainFile(self,imageId,path):
+    return False
 
   def execute(self,args,cwd=None):
     pass
 
+  def runInteractively(self,runArgs):
+    return 0
+
+  def runInBackground(self,runArgs):
+    return self.dockerDaemon.getContainer("0")
+
 class MockResponse():
-  def __init__(self,mockDockerDaemon):
+  def __init__(self,mockDockerDaemon,status=200,body=None):
     self.mockDockerDaemon = mockDockerDaemon
-    self.status = 200
-    self.body = b"{\"stream\":\"Building...\"}\n{\"stream\":\"Building...\"}\n{\"stream\":\"Building...\"}\n{\"stream\":\"Successfully built "+mockDockerDaemon.newId.encode("utf-8")+b"\"}"
+    self.status = status
+    self.body = body
+    if body is None:
+      self.body = b"{\"stream\":\"Building...\"}\n{\"stream\":\"Building...\"}\n{\"stream\":\"Building...\"}\n{\"stream\":\"Successfully built "+mockDockerDaemon.newId.encode("utf-8")+b"\"}"
 
   def read(self,bytes=None):
     if bytes:
@@ -83,13 +116,33 @@ class MockResponse():
     else:
       return self.body
 
-class MockConnection():
+class MockConnectionPool():
 
   def __init__(self,mockDockerDaemon):
     self.mockDockerDaemon=mockDockerDaemon
+    self.containers = [] # The Ids of the containers which have been created and not yet removed.
+    self.nextContainerId = 1
+    self.containersLock = threading.Lock()
    
-  def request(self,method,url,body=None,headers=None):
-    pass
-
-  def getresponse(self):
+  def request(self,method,url,body=None,headers=None,timeout=None):
+    path = url.split("?")[0]
+    with self.containersLock:
+      if method == "POST" and path.endswith("/containers/create"):
+        containerId = "container"+str(self.nextContainerId)
+        self.nextContainerId += 1
+        self.containers.append(containerId)
+        return MockResponse(self.mockDockerDaemon,status=201,body=json.dumps({"Id":containerId}).encode("utf-8"))
+      if method == "DELETE" and "/containers/" in path:
+        containerId = path.split("/containers/")[1]
+        if not containerId in self.containers:
+          return MockResponse(self.mockDockerDaemon,status=404,body=b"")
+        self.containers.remove(containerId)
+        return MockResponse(self.mockDockerDaemon,status=204,body=b"")
     return MockResponse(self.mockDockerDaemon)
+
+  @contextlib.contextmanager
+  def streamingRequest(self,method,url,body=None,headers=None,timeout=None):
+    if body is not None and not isinstance(body,(bytes,str)):
+      for _ in body: # Consume generated request bodies, such as build contexts, as the real daemon would.
+        pass
+    yield MockResponse(self.mockDockerDaemon)
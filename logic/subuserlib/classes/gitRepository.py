@@ -9,12 +9,30 @@ This is a Class which allows one to manipulate a git repository.
 #external imports
 import os
 import tempfile
+import subprocess
+import threading
+import json
+import re
+import atexit
 #internal imports
 import subuserlib.subprocessExtras as subprocessExtras
 
+commitHashPattern = re.compile("^[0-9a-f]{40}$")
+
 class GitRepository():
-  def __init__(self,path):
+  def __init__(self,path,cacheDir=None):
+    """
+    If a cacheDir is given, the results of listing and reading files at a given commit are cached there.  As the contents of a commit never change, these caches never need to be invalidated.  Lookups made by branch name rather than commit hash are not cached.  New results are written to disk by ``close``, or when subuser exits.
+    """
     self.__path = path
+    self.__cacheDir = cacheDir
+    self.__commitCaches = {} # {commitHash : {key : value}}
+    self.__changedCommitCaches = set() # Hashes of the commits whose caches have not been written to disk yet.
+    self.__commitCacheLock = threading.Lock()
+    self.__catFileProcesses = {} # {mode : subprocess.Popen}
+    self.__catFileLock = threading.Lock()
+    if cacheDir is not None:
+      atexit.register(self.saveCommitCaches)
 
   def getPath(self):
     return self.__path
@@ -31,41 +49,190 @@ class GitRepository():
     """
     return subprocessExtras.callCollectOutput(["git"]+args,cwd=self.getPath())
  
-  def ls(self,commitHash, subfolder,extraArgs=[]):
+  def _catFile(self,mode,objectName):
+    """
+    Look up an object using a long lived ``git cat-file`` process, so that reading many objects does not cost one git process each.  The mode is either "--batch" or "--batch-check".
+
+    Returns a tuple ``(objectHash,objectType,contents)`` where contents is None in "--batch-check" mode.  Returns None if there is no such object.
+    """
+    with self.__catFileLock:
+      process = self.__catFileProcesses.get(mode)
+      if process is None or process.poll() is not None:
+        if not os.path.isdir(self.getPath()):
+          return None
+        with open(os.devnull,"w") as devnull:
+          process = subprocess.Popen(["git","cat-file",mode],stdin=subprocess.PIPE,stdout=subprocess.PIPE,stderr=devnull,cwd=self.getPath(),close_fds=True) # Python 2 would otherwise let the process inherit the registry lock.
+        self.__catFileProcesses[mode] = process
+      try:
+        process.stdin.write(objectName.encode("utf-8")+b"\n")
+        process.stdin.flush()
+        header = process.stdout.readline().decode("utf-8").split()
+      except (IOError,OSError): # The process died, for example because this is not a git repository.
+        return None
+      if len(header) != 3: # "<name> missing", "<name> ambiguous" or the process died.
+        return None
+      (objectHash,objectType,size) = header
+      contents = None
+      if mode == "--batch":
+        contents = process.stdout.read(int(size))
+        process.stdout.read(1) # The newline following the contents.
+      return (objectHash,objectType,contents)
+
+  def _getCommitCache(self,commitHash):
+    """
+    Returns the dictionary of cached lookups for the given commit, loading it from disk if need be.  Returns None if lookups at this commit should not be cached.
+    """
+    if self.__cacheDir is None or not commitHashPattern.match(commitHash):
+      return None
+    with self.__commitCacheLock:
+      if commitHash in self.__commitCaches:
+        return self.__commitCaches[commitHash]
+    commitCache = None
+    try:
+      with open(self._getCommitCachePath(commitHash),"r") as cacheFile:
+        commitCache = json.load(cacheFile)
+    except (IOError,OSError,ValueError):
+      # Don't cache anything for commits which have not been fetched yet, otherwise we would remember them as empty.
+      commit = self._catFile("--batch-check",commitHash)
+      if commit is None or not commit[1] == "commit":
+        return None
+      commitCache = {}
+    with self.__commitCacheLock:
+      return self.__commitCaches.setdefault(commitHash,commitCache)
+
+  def _getCommitCachePath(self,commitHash):
+    return os.path.join(self.__cacheDir,commitHash+".json")
+
+  def _cachedLookup(self,commitHash,key,lookup):
+    """
+    Return the result of calling lookup(), cached under the given key for the given commit.
+    """
+    commitCache = self._getCommitCache(commitHash)
+    if commitCache is None:
+      return lookup()
+    with self.__commitCacheLock:
+      if key in commitCache:
+        return commitCache[key]
+    value = lookup()
+    with self.__commitCacheLock:
+      commitCache[key] = value
+      self.__changedCommitCaches.add(commitHash)
+    return value
+
+  def saveCommitCaches(self):
+    """
+    Write the caches of the commits which have had new lookups to disk, each in a single write.
+    """
+    with self.__commitCacheLock:
+      for commitHash in self.__changedCommitCaches:
+        try:
+          try:
+            os.makedirs(self.__cacheDir)
+          except OSError:
+            pass
+          temporaryCachePath = self._getCommitCachePath(commitHash)+".tmp."+str(os.getpid())
+          with open(temporaryCachePath,"w") as cacheFile:
+            json.dump(self.__commitCaches[commitHash],cacheFile)
+          os.rename(temporaryCachePath,self._getCommitCachePath(commitHash))
+        except (IOError,OSError): # The cache is only an optimization.
+          pass
+      self.__changedCommitCaches = set()
+
+  def _normalizePath(self,path):
+    path = os.path.normpath(path).strip("/")
+    if path == ".":
+      return ""
+    return path
+
+  def lsTree(self,commitHash,subfolder):
+    """
+    Returns a list of ``(path,objectType)`` tuples for the entries in the subfolder, where objectType is one of "blob", "tree" or "commit"(a submodule).
+    Paths are relative to the repository as a whole.
+    """
+    subfolder = self._normalizePath(subfolder)
+    return [tuple(entry) for entry in self._cachedLookup(commitHash,"ls-tree:"+subfolder,lambda: self._lsTree(commitHash,subfolder))]
+
+  def _lsTree(self,commitHash,subfolder):
+    tree = self._catFile("--batch",commitHash+":"+subfolder)
+    if tree is None or not tree[1] == "tree":
+      return [] # It is simpler to just return [] here than to check if the repository is properly initialized everywhere else.
+    (treeHash,_,contents) = tree
+    hashLength = len(treeHash)//2
+    prefix = subfolder+"/" if subfolder else ""
+    entries = []
+    position = 0
+    # Each entry is "<octal mode> <name>\0<binary object id>".
+    while position < len(contents):
+      space = contents.index(b" ",position)
+      null = contents.index(b"\0",space)
+      mode = contents[position:space]
+      name = contents[space+1:null].decode("utf-8")
+      position = null + 1 + hashLength
+      if mode == b"40000":
+        objectType = "tree"
+      elif mode == b"160000":
+        objectType = "commit"
+      else:
+        objectType = "blob"
+      entries.append((prefix+name,objectType))
+    return entries
+
+  def ls(self,commitHash,subfolder):
     """
     Returns a list of file and folder paths.
     Paths are relative to the repository as a whole.
     """
-    if not subfolder.endswith("/"):
-      subfolder += "/"
-    if subfolder == "/":
-      subfolder = "./"
-    (returncode,output) = self.runCollectOutput(["ls-tree","--name-only"]+extraArgs+[commitHash,subfolder])
-    if returncode != 0:
-      return [] # This commenting out is intentional. It is simpler to just return [] here than to check if the repository is properly initialized everywhere else.
-      #raise OSError("Git ls-tree failed:"+output+"\n args were:"+str(["ls-tree","--name-only"]+extraArgs+[commitHash,subfolder])+"\nCwd was:"+self.getPath())
-    return output.splitlines()
+    return [path for (path,_) in self.lsTree(commitHash,subfolder)]
 
   def lsFiles(self,commitHash,subfolder):
     """
     Returns a list of paths to files in the subfolder.
     Paths are relative to the repository as a whole.
     """
-    return list(set(self.ls(commitHash,subfolder)) - set(self.lsFolders(commitHash,subfolder)))
+    return [path for (path,objectType) in self.lsTree(commitHash,subfolder) if not objectType == "tree"]
 
   def lsFolders(self,commitHash,subfolder):
     """
     Returns a list of paths to folders in the subfolder.
     Paths are relative to the repository as a whole.
     """
-    return self.ls(commitHash,subfolder,["-d"])
+    return [path for (path,objectType) in self.lsTree(commitHash,subfolder) if objectType == "tree"]
 
   def show(self,commitHash,path):
     """
-    Returns the contents of the given file at the given commit.
+    Returns the contents of the given file at the given commit.  Returns an empty string if there is no such file.
+    """
+    path = self._normalizePath(path)
+    def lookup():
+      blob = self._catFile("--batch",commitHash+":"+path)
+      if blob is None or not blob[1] == "blob":
+        return ""
+      return blob[2].decode("utf-8")
+    return self._cachedLookup(commitHash,"show:"+path,lookup)
+
+  def getTreeHash(self,commitHash,path):
+    """
+    Returns the git object id of the tree(directory) at the given path and commit, or None if there is no such tree.
+    """
+    path = self._normalizePath(path)
+    def lookup():
+      tree = self._catFile("--batch-check",commitHash+":"+path)
+      if tree is None or not tree[1] == "tree":
+        return None
+      return tree[0]
+    return self._cachedLookup(commitHash,"tree-hash:"+path,lookup)
+
+  def close(self):
+    """
+    Stop the ``git cat-file`` processes and save the lookup caches.  The processes are restarted automatically if they are needed again.
     """
-    (errorcode,content) = self.runCollectOutput(["show",commitHash+":"+path])
-    return content
+    self.saveCommitCaches()
+    with self.__catFileLock:
+      for process in self.__catFileProcesses.values():
+        if process.poll() is None:
+          process.stdin.close()
+          process.wait()
+      self.__catFileProcesses = {}
 
   def commit(self,message):
     """
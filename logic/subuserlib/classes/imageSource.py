@@ -10,9 +10,11 @@ Images in subuser are built from ImageSource objects.
 import os
 import io
 import uuid
+import hashlib
 #internal imports
 import subuserlib.classes.userOwnedObject,subuserlib.classes.describable,subuserlib.resolve, subuserlib.hashDirectory
 import subuserlib.classes.docker.dockerDaemon
+import subuserlib.classes.docker.dockerIgnore
 
 class ImageSource(subuserlib.classes.userOwnedObject.UserOwnedObject,subuserlib.classes.describable.Describable):
 
@@ -48,40 +50,44 @@ class ImageSource(subuserlib.classes.userOwnedObject.UserOwnedObject,subuserlib.
     return subusers
 
   def getDockerImageDir(self):
+    return os.path.join(self.getRepository().getRepoPath(),self.getRelativeDockerImageDir())
+
+  def getRelativeDockerImageDir(self):
+    """
+    Get the path of the ``docker-image`` directory relative to the root of the repository.
+    """
     repoConfig = self.getRepository().getRepoConfig()
     if repoConfig:
       if "docker-image-dir" in repoConfig:
         if repoConfig["docker-image-dir"].startswith("../"):
           raise ValueError("Paths in .subuser.json may not be relative to a higher directory.")
-        return os.path.join(self.getSourceDir(),repoConfig["docker-image-dir"])
-    return os.path.join(self.getSourceDir(),"docker-image")
+        return os.path.join(self.getRelativeSourceDir(),repoConfig["docker-image-dir"])
+    return os.path.join(self.getRelativeSourceDir(),"docker-image")
 
   def getSourceDir(self):
     return os.path.join(self.getRepository().getSubuserRepositoryRoot(),self.getName())
 
+  def getRelativeSourceDir(self):
+    """
+    Get the path of the ImageSource's directory relative to the root of the repository.
+    """
+    return os.path.join(self.getRepository().getSubuserRepositoryRelativeRoot(),self.getName())
+
   def getLatestInstalledImage(self):
     """
     Get the most up-to-date InstalledImage based on this ImageSource.
     Returns None if no images have been installed from this ImageSource.
     """
-    imageCreationDateTimeBestSoFar=''
-    mostUpToDateImage = None
-    for installedImage in self.getInstalledImages():
-      thisImagesCreationDateTime = installedImage.getCreationDateTime()
-      if thisImagesCreationDateTime > imageCreationDateTimeBestSoFar:
-        mostUpToDateImage = installedImage
-        imageCreationDateTimeBestSoFar = thisImagesCreationDateTime
-    return mostUpToDateImage
+    installedImages = self.getInstalledImages()
+    if installedImages:
+      return installedImages[-1]
+    return None
 
   def getInstalledImages(self):
     """
-    Return the installed images which are based on this image.
+    Return the installed images which are based on this image, oldest first.
     """
-    installedImagesBasedOnThisImageSource = []
-    for _,installedImage in self.getUser().getInstalledImages().items():
-      if installedImage.getImageSourceName() == self.getName() and installedImage.getSourceRepoId() == self.getRepository().getName():
-        installedImagesBasedOnThisImageSource.append(installedImage)
-    return installedImagesBasedOnThisImageSource
+    return self.getUser().getInstalledImages().getInstalledImagesBySource(self.getRepository().getName(),self.getName())
 
   def getPermissionsFilePath(self):
     return os.path.join(self.getSourceDir(),"permissions.json")
@@ -106,13 +112,18 @@ class ImageSource(subuserlib.classes.userOwnedObject.UserOwnedObject,subuserlib.
     self.getPermissions().describe()
 
   def build(self,parent):
+    """
+    Build the image, using the image with the Id ``parent`` as the base for ``FROM-SUBUSER-IMAGE``.
+    Returns a tuple ``(imageId,hasCheckForUpdatesScript)``.  Whether the image has a ``/subuser/check-for-updates`` script is looked up in the built image's file system right away, so that it never has to be probed for later.  It is None if the daemon cannot tell.
+    """
     dockerImageDir = self.getDockerImageDir()
     dockerFileContents = self.getDockerfileContents(parent=parent)
     imageId = self.getUser().getDockerDaemon().build(directoryWithDockerfile=dockerImageDir,rm=True,dockerfile=dockerFileContents) 
     subuserSetupDockerFile = ""
     subuserSetupDockerFile += "FROM "+imageId+"\n"
     subuserSetupDockerFile += "RUN mkdir /subuser ; echo "+str(uuid.uuid4())+" > /subuser/uuid\n" # This ensures that all images have unique Ids.  Even images that are otherwise the same.
-    return self.getUser().getDockerDaemon().build(dockerfile=subuserSetupDockerFile)
+    imageId = self.getUser().getDockerDaemon().build(dockerfile=subuserSetupDockerFile)
+    return (imageId,self.getUser().getDockerDaemon().doesImageContainFile(imageId,"/subuser/check-for-updates"))
 
   def getSubuserImagefilePath(self):
     """
@@ -125,6 +136,12 @@ class ImageSource(subuserlib.classes.userOwnedObject.UserOwnedObject,subuserlib.
     """
      Returns the contents of the SubuserImagefile.  If there is no SubuserImagefile return None.
     """
+    if not self.getRepository().isLocal() and self.getRepository().getGitCommitHash():
+      gitRepository = self.getRepository().getGitRepository()
+      subuserImagefilePath = os.path.normpath(os.path.join(self.getRelativeDockerImageDir(),"SubuserImagefile"))
+      if subuserImagefilePath in gitRepository.lsFiles(self.getRepository().getGitCommitHash(),self.getRelativeDockerImageDir()):
+        return gitRepository.show(self.getRepository().getGitCommitHash(),subuserImagefilePath)
+      return None
     if os.path.isfile(self.getSubuserImagefilePath()):
       with io.open(self.getSubuserImagefilePath(),mode="r",encoding="utf-8") as subuserImagefile:
         return subuserImagefile.read()
@@ -171,8 +188,19 @@ class ImageSource(subuserlib.classes.userOwnedObject.UserOwnedObject,subuserlib.
     return None
 
   def getHash(self):
-    """ Return the hash of the ``docker-image`` directory. """
-    return subuserlib.hashDirectory.getHashOfDirs(self.getDockerImageDir())
+    """
+    Return the hash of the ``docker-image`` directory.
+
+    For git repositories, this is the git tree id of the directory at the repository's current commit.  For local repositories, the directory is hashed, leaving out any files excluded by its ``.dockerignore`` file.
+    """
+    if not self.getRepository().isLocal() and self.getRepository().getGitCommitHash():
+      treeHash = self.getRepository().getGitRepository().getTreeHash(self.getRepository().getGitCommitHash(),self.getRelativeDockerImageDir())
+      if treeHash is None:
+        return -1
+      return treeHash
+    dockerImageDir = self.getDockerImageDir()
+    hashCachePath = os.path.join(self.getUser().getConfig()["cache-dir"],"file-hashes",hashlib.sha1(dockerImageDir.encode("utf-8")).hexdigest()+".json")
+    return subuserlib.hashDirectory.getHashOfDirs(dockerImageDir,dockerIgnore=subuserlib.classes.docker.dockerIgnore.getDockerIgnore(dockerImageDir),cachePath=hashCachePath)
 
 class SyntaxError(Exception):
   """
@@ -7,20 +7,65 @@ Each user has a set of images that have been installed.
 """
 
 #external imports
-import os,json
+import os,json,time,threading,re,calendar
 #internal imports
 from subuserlib.classes.userOwnedObject import UserOwnedObject
 from subuserlib.classes.describable import Describable
 import subuserlib.classes.docker.dockerDaemon as dockerDaemon
 
+def parseDockerTimestamp(timestamp):
+  """
+  Docker reports creation times either as unix timestamps or as RFC 3339 strings in UTC.  Returns the time as a unix timestamp.
+
+  >>> from subuserlib.classes.installedImage import parseDockerTimestamp
+  >>> parseDockerTimestamp("2015-06-02T13:29:13.478427183Z")
+  1433251753.478427
+  >>> parseDockerTimestamp(1433251753)
+  1433251753.0
+  """
+  try:
+    return float(timestamp)
+  except ValueError:
+    pass
+  match = re.match(r"(\d+)-(\d+)-(\d+)T(\d+):(\d+):(\d+)(\.\d+)?",timestamp)
+  if not match:
+    return 0.0
+  seconds = calendar.timegm(tuple([int(field) for field in match.groups()[:6]]))
+  if match.group(7):
+    seconds += round(float(match.group(7)),6)
+  return seconds
+
+def getImageCreationTime(user,imageId):
+  """
+  Return the time at which the Docker daemon says that the image was created, as a unix timestamp, or None if the image does not exist.  Using the daemon's clock for every image keeps images ordered by creation time, even if the client's clock is off.
+  """
+  imageSummary = user.getImageInventory().getImage(imageId)
+  if imageSummary is None:
+    return None
+  return parseDockerTimestamp(imageSummary["Created"])
+
 class InstalledImage(UserOwnedObject,Describable):
 
-  def __init__(self,user,imageId,imageSourceName,sourceRepoId,imageSourceHash):
+  def __init__(self,user,imageId,imageSourceName,sourceRepoId,imageSourceHash,hasCheckForUpdatesScript=None,lastUpdateCheck=None,parentImageId=None,lineagePosition=None,creationTime=None):
+    """
+    hasCheckForUpdatesScript is None if it is not yet known whether the image has a ``/subuser/check-for-updates`` script.
+
+    lastUpdateCheck is either None or a dictionary with the "time" at which the image was last checked for updates and whether it "needs-update".
+
+    parentImageId is the Id of the installed image that this image was built on top of.  lineagePosition is the number of installed images below this one in its lineage, 0 for images which have no installed parent, or None if it was not recorded when the image was installed.  creationTime is a unix timestamp.
+    """
     self.__imageId = imageId
+    self.__parentImageId = parentImageId
+    self.__lineagePosition = lineagePosition
+    self.__creationTime = creationTime
+    self.__hasCheckForUpdatesScript = hasCheckForUpdatesScript
+    self.__lastUpdateCheck = lastUpdateCheck
     self.__imageSourceHash = imageSourceHash
     self.__imageSourceName = imageSourceName
     self.__sourceRepoId = sourceRepoId
     self.__alreadyCheckedForUpdates = None
+    self.__updateCheckResult = None # (needsUpdate,secondsTaken)
+    self.__updateCheckLock = threading.Lock()
     UserOwnedObject.__init__(self,user)
 
   def getImageId(self):
@@ -38,39 +83,56 @@ class InstalledImage(UserOwnedObject,Describable):
   def getImageSourceHash(self):
     return self.__imageSourceHash
 
-  def isDockerImageThere(self):
+  def getParentImageId(self):
+    return self.__parentImageId
+
+  def getLineagePosition(self):
+    return self.__lineagePosition
+
+  def getCreationTime(self):
     """
-     Does the Docker daemon have an image with this imageId?
+    Return the time at which the image was created as a unix timestamp.  This is recorded when the image is installed.  For images which were installed before that was the case, the Docker daemon is asked once.  Returns 0 if the image does not exist.
     """
-    return not (self.getUser().getDockerDaemon().getImageProperties(self.getImageId()) == None)
+    if self.__creationTime is None:
+      creationTime = getImageCreationTime(self.getUser(),self.getImageId())
+      if creationTime is None:
+        return 0
+      self.__creationTime = creationTime
+    return self.__creationTime
 
-  def removeCachedRuntimes(self):
+  def getKnownCreationTime(self):
     """
-    Remove cached runtime environments.
+    Like ``getCreationTime`` except that it returns None rather than asking the Docker daemon if the creation time was not recorded.
     """
-    pathToImagesRuntimeCacheDir = os.path.join(self.getUser().getConfig()["runtime-cache"],self.getImageId())
-    try:
-      for permissionsSpecificCacheInfoFileName in os.listdir(pathToImagesRuntimeCacheDir):
-        permissionsSpecificCacheInfoFilePath = os.path.join(pathToImagesRuntimeCacheDir,permissionsSpecificCacheInfoFileName)
-        with open(permissionsSpecificCacheInfoFilePath,mode='r') as permissionsSpecificCacheInfoFileHandle:
-          permissionsSpecificCacheInfo = json.load(permissionsSpecificCacheInfoFileHandle)
-          try:
-            try:
-              self.getUser().getDockerDaemon().removeImage(permissionsSpecificCacheInfo['run-ready-image-id'])
-            except dockerDaemon.ImageDoesNotExistsException:
-              pass
-            os.remove(permissionsSpecificCacheInfoFilePath)
-          except dockerDaemon.ContainerDependsOnImageException:
-            pass
-    except OSError:
-      pass
-  
+    return self.__creationTime
+
+  def hasCheckForUpdatesScript(self):
+    """
+    Does the image have a ``/subuser/check-for-updates`` script?  This is recorded when the image is built.  For images which were installed before that was the case, the Docker daemon is asked once, and the answer is remembered the next time the installed images list is saved.  Returns None if the daemon cannot tell.
+    """
+    if self.__hasCheckForUpdatesScript is None:
+      self.__hasCheckForUpdatesScript = self.getUser().getDockerDaemon().doesImageContainFile(self.getImageId(),"/subuser/check-for-updates")
+    return self.__hasCheckForUpdatesScript
+
+  def getKnownHasCheckForUpdatesScript(self):
+    """
+    Like ``hasCheckForUpdatesScript`` except that it returns None rather than asking the Docker daemon if the answer is not yet known.
+    """
+    return self.__hasCheckForUpdatesScript
+
+  def isDockerImageThere(self):
+    """
+     Does the Docker daemon have an image with this imageId?
+    """
+    return self.getUser().getImageInventory().hasImage(self.getImageId())
+
   def removeDockerImage(self):
     """
       Remove the image from the Docker daemon's image store.
     """
     try:
       self.getUser().getDockerDaemon().removeImage(self.getImageId())
+      self.getUser().getImageInventory().discard(self.getImageId())
     except (dockerDaemon.ImageDoesNotExistsException,dockerDaemon.ContainerDependsOnImageException,dockerDaemon.ServerErrorException):
       pass
 
@@ -82,22 +144,90 @@ class InstalledImage(UserOwnedObject,Describable):
       print("Image is broken, image source does not exist!")
     print("Last update time: "+self.getCreationDateTime())
 
-  def checkForUpdates(self):
-    """ Check for updates using the image's built in check-for-updates script. This launches the script as root in a privilageless container. Returns True if the image needs to be updated. """
+  def checkForUpdates(self,updateCheckTTL=0):
+    """ Check for updates using the image's built in check-for-updates script. This launches the script as root in a privilageless container. Returns True if the image needs to be updated. See ``runUpdateCheck`` for ``updateCheckTTL``. """
     if self.__alreadyCheckedForUpdates:
       return False
     self.__alreadyCheckedForUpdates = True
     self.getUser().getRegistry().log("Checking for updates to: " + self.getImageSource().getIdentifier())
-    if self.getUser().getDockerDaemon().execute(["run","--rm","--entrypoint","/usr/bin/test",self.getImageId(),"-e","/subuser/check-for-updates"]) == 0:
-      returnCode = self.getUser().getDockerDaemon().execute(["run","--rm","--entrypoint","/subuser/check-for-updates"],self.getImageId())
-      if returnCode == 0:
-        return True
-    return False
+    (needsUpdate,secondsTaken) = self.runUpdateCheck(updateCheckTTL=updateCheckTTL)
+    if secondsTaken is None:
+      self.getUser().getRegistry().log("Using the result of the last check for updates to "+self.getImageSource().getIdentifier()+", which was %d seconds ago." % (time.time()-self.__lastUpdateCheck["time"]),verbosityLevel=3)
+    else:
+      self.getUser().getRegistry().log("Checked for updates to "+self.getImageSource().getIdentifier()+" in %.1f seconds." % secondsTaken,verbosityLevel=3)
+    return needsUpdate
+
+  def getLastUpdateCheck(self):
+    """
+    Returns a dictionary with the "time" at which the image was last checked for updates and whether it "needs-update", or None if it has never been checked.
+    """
+    return self.__lastUpdateCheck
+
+  def runUpdateCheck(self,updateCheckTTL=0):
+    """
+    Run the image's check-for-updates script, without logging anything.  The result is remembered, so that the check may be run ahead of time, in parallel with the checks of other images, and reported later by ``checkForUpdates``.
+
+    If the image was checked less than ``updateCheckTTL`` seconds ago, the result of that check is used instead.  Background updates pass the ``update-check-ttl`` setting from ``config.json``, interactive updates always run the script.
+
+    Returns a tuple ``(needsUpdate,secondsTaken)``.  secondsTaken is None if the script was not run.
+
+    >>> import subuserlib.classes.user
+    >>> from subuserlib.classes.installedImage import InstalledImage
+    >>> user = subuserlib.classes.user.User()
+    >>> executedCommands = []
+    >>> def execute(args,cwd=None):
+    ...   executedCommands.append((args,cwd))
+    ...   return 0
+    >>> user.getDockerDaemon().execute = execute
+    >>> installedImage = InstalledImage(user,"2","foo","default","0",hasCheckForUpdatesScript=True)
+    >>> installedImage.runUpdateCheck()[0]
+    True
+    >>> executedCommands
+    [(['run', '--rm', '--entrypoint', '/subuser/check-for-updates', '2'], None)]
+
+    The script is only run once.
+
+    >>> installedImage.runUpdateCheck()[0]
+    True
+    >>> len(executedCommands)
+    1
+
+    A recent result is only reused when an ``updateCheckTTL`` is given.
+
+    >>> import time
+    >>> lastUpdateCheck = {"time":time.time(),"needs-update":False}
+    >>> InstalledImage(user,"2","foo","default","0",hasCheckForUpdatesScript=True,lastUpdateCheck=lastUpdateCheck).runUpdateCheck(updateCheckTTL=3600)
+    (False, None)
+    >>> len(executedCommands)
+    1
+    >>> InstalledImage(user,"2","foo","default","0",hasCheckForUpdatesScript=True,lastUpdateCheck=lastUpdateCheck).runUpdateCheck()[0]
+    True
+    >>> len(executedCommands)
+    2
+    """
+    with self.__updateCheckLock:
+      if self.__updateCheckResult is None and self.__lastUpdateCheck:
+        if time.time() - self.__lastUpdateCheck["time"] < updateCheckTTL:
+          self.__updateCheckResult = (self.__lastUpdateCheck["needs-update"],None)
+      if self.__updateCheckResult is None:
+        startTime = time.time()
+        needsUpdate = False
+        hasCheckForUpdatesScript = self.hasCheckForUpdatesScript()
+        if hasCheckForUpdatesScript is None: # Fall back to looking for the script from within a container.
+          hasCheckForUpdatesScript = self.getUser().getDockerDaemon().execute(["run","--rm","--entrypoint","/usr/bin/test",self.getImageId(),"-e","/subuser/check-for-updates"]) == 0
+        if hasCheckForUpdatesScript:
+          returnCode = self.getUser().getDockerDaemon().execute(["run","--rm","--entrypoint","/subuser/check-for-updates",self.getImageId()])
+          if returnCode == 0:
+            needsUpdate = True
+        self.__updateCheckResult = (needsUpdate,time.time()-startTime)
+        self.__lastUpdateCheck = {"time":startTime,"needs-update":needsUpdate}
+      return self.__updateCheckResult
 
   def getCreationDateTime(self):
     """ Return the creation date/time of the installed docker image. Or None if the image does not exist. """
-    imageProperties = self.getUser().getDockerDaemon().getImageProperties(self.getImageId())
-    if not imageProperties is None:
-      return imageProperties["Created"]
-    else:
+    imageSummary = self.getUser().getImageInventory().getImage(self.getImageId())
+    if imageSummary is None:
       return None
+    if isinstance(imageSummary["Created"],(int,float)):
+      return time.strftime("%Y-%m-%dT%H:%M:%SZ",time.gmtime(imageSummary["Created"]))
+    return imageSummary["Created"]
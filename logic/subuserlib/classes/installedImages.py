@@ -7,15 +7,81 @@ This is the set of installed images that bellongs to a given user.
 """
 
 #external imports
-import os,json,collections,sys
+import os,json,collections,sys,threading
 #internal imports
 import subuserlib.classes.installedImage,subuserlib.classes.fileBackedObject, subuserlib.classes.userOwnedObject
 
 class InstalledImages(dict,subuserlib.classes.userOwnedObject.UserOwnedObject,subuserlib.classes.fileBackedObject.FileBackedObject):
   def __init__(self,user):
+    self.__lock = threading.RLock()
+    self.__imagesBySource = None
+    self.__lineages = {} # {imageId : [installedImageId]}
+    self.__lineagesGeneration = 0
     subuserlib.classes.userOwnedObject.UserOwnedObject.__init__(self,user)
     self.reloadInstalledImagesList()
 
+  def getLock(self):
+    """
+    A lock which must be held while modifying the list of installed images from multiple threads.
+    """
+    return self.__lock
+
+  def __setitem__(self,imageId,installedImage):
+    with self.getLock():
+      self.__imagesBySource = None
+      self.__lineages = {}
+      self.__lineagesGeneration += 1
+      dict.__setitem__(self,imageId,installedImage)
+
+  def __delitem__(self,imageId):
+    with self.getLock():
+      self.__imagesBySource = None
+      self.__lineages = {}
+      self.__lineagesGeneration += 1
+      dict.__delitem__(self,imageId)
+
+  def clear(self):
+    with self.getLock():
+      self.__imagesBySource = None
+      self.__lineages = {}
+      self.__lineagesGeneration += 1
+      dict.clear(self)
+
+  def getInstalledImagesBySource(self,sourceRepoId,imageSourceName):
+    """
+    Return a list of the installed images which were built from the given image source, sorted by creation time, oldest first.  The index is built once and kept up to date as images are added and removed.
+    """
+    with self.getLock():
+      if self.__imagesBySource is None:
+        imagesBySource = {}
+        for installedImage in self.values():
+          imagesBySource.setdefault((installedImage.getSourceRepoId(),installedImage.getImageSourceName()),[]).append(installedImage)
+        for images in imagesBySource.values():
+          images.sort(key=lambda installedImage: installedImage.getCreationTime())
+        self.__imagesBySource = imagesBySource
+      return list(self.__imagesBySource.get((sourceRepoId,imageSourceName),[]))
+
+  def getKnownImageLineage(self,imageId):
+    """
+    Returns a tuple ``(lineage,generation)``.  lineage is the list of the Ids of the installed images in the given image's lineage, if it has been remembered with ``rememberImageLineage``, otherwise None.  generation is to be passed on to ``rememberImageLineage``.
+    """
+    with self.getLock():
+      lineage = self.__lineages.get(imageId)
+      if not lineage is None:
+        lineage = list(lineage)
+      return (lineage,self.__lineagesGeneration)
+
+  def rememberImageLineage(self,imageId,lineage,generation):
+    """
+    Remember the Ids of the installed images in the given image's lineage, as well as in the lineages of each of those installed images.  Everything that is remembered is forgotten as soon as an image is added or removed.  Lineages which were looked up before the last such change, that is, in an older generation, are not remembered.
+    """
+    with self.getLock():
+      if not generation == self.__lineagesGeneration:
+        return
+      for depth in range(len(lineage)):
+        self.__lineages[lineage[depth]] = lineage[:depth+1]
+      self.__lineages[imageId] = list(lineage)
+
   def reloadInstalledImagesList(self):
     """ Reload the installed images list from disk, discarding the current in-memory version. """
     self.clear()
@@ -40,18 +106,34 @@ class InstalledImages(dict,subuserlib.classes.userOwnedObject.UserOwnedObject,su
         imageId=imageId,
         imageSourceName=imageAttributes["image-source"],
         sourceRepoId=imageAttributes["source-repo"],
-        imageSourceHash=imageSourceHash)
+        imageSourceHash=imageSourceHash,
+        hasCheckForUpdatesScript=imageAttributes.get("has-check-for-updates-script"),
+        lastUpdateCheck=imageAttributes.get("last-update-check"),
+        parentImageId=imageAttributes.get("parent-image-id"),
+        lineagePosition=imageAttributes.get("lineage-position"),
+        creationTime=imageAttributes.get("creation-time"))
       self[imageId]=image
 
   def save(self):
     """ Save attributes of the installed images to disk. """
     # Build a dictionary of installed images.
     installedImagesDict = {}
-    for _,installedImage in self.items():
+    with self.getLock():
+      installedImages = list(self.values())
+    for installedImage in installedImages:
       imageAttributes = {}
       imageAttributes["image-source-hash"] = installedImage.getImageSourceHash()
       imageAttributes["image-source"] = installedImage.getImageSourceName()
       imageAttributes["source-repo"] = installedImage.getSourceRepoId()
+      if not installedImage.getKnownHasCheckForUpdatesScript() is None:
+        imageAttributes["has-check-for-updates-script"] = installedImage.getKnownHasCheckForUpdatesScript()
+      if installedImage.getLastUpdateCheck():
+        imageAttributes["last-update-check"] = installedImage.getLastUpdateCheck()
+      if not installedImage.getLineagePosition() is None:
+        imageAttributes["parent-image-id"] = installedImage.getParentImageId()
+        imageAttributes["lineage-position"] = installedImage.getLineagePosition()
+      if not installedImage.getKnownCreationTime() is None:
+        imageAttributes["creation-time"] = installedImage.getKnownCreationTime()
       installedImagesDict[installedImage.getImageId()] = imageAttributes
 
     # Write that dictionary to disk.
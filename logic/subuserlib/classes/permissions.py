@@ -7,7 +7,7 @@ Each subuser has a set of permissions which specify what parts of the host syste
 """
 
 #external imports
-import collections,hashlib
+import collections,hashlib,json
 #internal imports
 from subuserlib.classes.userOwnedObject import UserOwnedObject
 from subuserlib.classes.fileBackedObject import FileBackedObject
@@ -35,6 +35,14 @@ class Permissions(collections.OrderedDict,UserOwnedObject,FileBackedObject):
     hasher.update(subuserlib.permissions.getPermissonsJSONString(self).encode('utf-8'))
     return hasher.hexdigest()
 
+  def getHashOfSubset(self,permissionNames):
+    """
+    Return the SHA512 hash of just the given permissions.
+    """
+    hasher = hashlib.sha512()
+    hasher.update(json.dumps([[permissionName,self[permissionName]] for permissionName in sorted(permissionNames)]).encode('utf-8'))
+    return hasher.hexdigest()
+
   def applyChanges(self,permissionsToRemove,permissionsToAddOrChange):
     for permission in permissionsToRemove:
       self[permission] = subuserlib.permissions.permissionDefaults[permission]
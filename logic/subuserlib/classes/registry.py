@@ -10,6 +10,7 @@ Each user's settings are stored in a "registry". This is a git repository with a
 import os
 import errno
 import sys
+import threading
 #semi-external imports
 import subuserlib.portalocker.utils
 #internal imports
@@ -22,6 +23,7 @@ class Registry(userOwnedObject.UserOwnedObject):
   def __init__(self,user,gitReadHash="master"):
     self.__subusers = None
     self.__changeLog = ""
+    self.__logLock = threading.Lock()
     self.__changed = False
     self.__logOutputVerbosity = 2
     self.__repositories = None
@@ -64,13 +66,17 @@ class Registry(userOwnedObject.UserOwnedObject):
   def getLogOutputVerbosity(self):
     return self.__logOutputVerbosity
 
-  def log(self,message):
+  def log(self,message,verbosityLevel=1):
     """
     Add a log message to the registry's change log and print it to the screen, but do not mark the registry as changed.
+
+    The message is only printed if the log output verbosity is at least ``verbosityLevel``.  Messages with a verbosityLevel above the default verbosity of 2, such as timing information, are not added to the change log.
     """
-    self.__changeLog = self.__changeLog + message+"\n"
-    if self.getLogOutputVerbosity() > 0:
-      print(message)
+    with self.__logLock:
+      if verbosityLevel <= 2:
+        self.__changeLog = self.__changeLog + message+"\n"
+      if self.getLogOutputVerbosity() >= verbosityLevel:
+        print(message)
 
   def logChange(self,message):
     """
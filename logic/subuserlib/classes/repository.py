@@ -7,7 +7,7 @@ A repository is a collection of ``ImageSource`` s which are published in a git r
 """
 
 #external imports
-import os,shutil,io,json
+import os,shutil,io,json,hashlib
 #internal imports
 import subuserlib.subprocessExtras
 from subuserlib.classes.userOwnedObject import UserOwnedObject
@@ -25,8 +25,9 @@ class Repository(dict,UserOwnedObject,Describable):
     self.__lastGitCommitHash = gitCommitHash
     self.__temporary=temporary
     self.__sourceDir=sourceDir
+    self.__repoConfigCache = None # (commitHash,config)
     UserOwnedObject.__init__(self,user)
-    self.__gitRepository = GitRepository(self.getRepoPath())
+    self.__gitRepository = GitRepository(self.getRepoPath(),cacheDir=os.path.join(self.getUser().getConfig()["cache-dir"],"git",hashlib.sha1(self.getRepoPath().encode("utf-8")).hexdigest()))
     self.loadProgramSources()
 
   def getName(self):
@@ -87,6 +88,14 @@ class Repository(dict,UserOwnedObject,Describable):
     """
     Either returns the config as a dictionary or None if no configuration exists or can be parsed.
     """
+    if not self.isLocal() and self.__repoConfigCache and self.__repoConfigCache[0] == self.getGitCommitHash():
+      return self.__repoConfigCache[1]
+    repoConfig = self._loadRepoConfig()
+    if not self.isLocal():
+      self.__repoConfigCache = (self.getGitCommitHash(),repoConfig)
+    return repoConfig
+
+  def _loadRepoConfig(self):
     if self.isLocal() and os.path.exists(self.getRepoConfigPath()):
       with io.open(self.getRepoConfigPath(),"r",encoding="utf-8") as configFile:
         configFileContents = configFile.read()
@@ -132,6 +141,7 @@ class Repository(dict,UserOwnedObject,Describable):
     Remove the downloaded git repo associated with this repository from disk.
     """
     if not self.isLocal():
+      self.getGitRepository().close()
       shutil.rmtree(self.getRepoPath())
 
   def updateSources(self):
@@ -11,6 +11,9 @@ import sys,os,getpass
 #internal imports
 from subuserlib.classes.userOwnedObject import UserOwnedObject
 
+# The run-ready image depends on these permissions and on no others.
+buildRelevantPermissions = ["serial-devices","sudo"]
+
 class RunReadyImage(UserOwnedObject):
   def __init__(self,user,subuser):
     self.__subuser = subuser
@@ -18,10 +21,15 @@ class RunReadyImage(UserOwnedObject):
     UserOwnedObject.__init__(self,user)
 
   def setup(self):
-    if not "run-ready-image-id" in self.getSubuser().getRuntimeCache():
+    runtimeCache = self.getSubuser().getRuntimeCache()
+    if "run-ready-image-id" in runtimeCache and not self.getUser().getImageInventory().hasImage(runtimeCache["run-ready-image-id"]): # The image was removed behind subuser's back.
+      del runtimeCache["run-ready-image-id"]
+      self.__id = None
+    if not "run-ready-image-id" in runtimeCache:
       self.__id = self.build()
-      self.getSubuser().getRuntimeCache()["run-ready-image-id"] = self.__id
-      self.getSubuser().getRuntimeCache().save()
+      self.getUser().getImageInventory().markStale()
+      runtimeCache["run-ready-image-id"] = self.__id
+      runtimeCache.save()
 
   def getSubuser(self):
     return self.__subuser
@@ -34,17 +42,21 @@ class RunReadyImage(UserOwnedObject):
   def generateImagePreparationDockerfile(self):
     """
     There is still some preparation that needs to be done before an image is ready to be run.  But this preparation requires run time information, so we cannot preform that preparation at build time.
+
+    All of the preparation is done by a single RUN instruction, so that building the run-ready image runs one container and adds one layer.  Each step runs in its own subshell and the build fails at the first step that fails.
     """
-    dockerfileContents  = "FROM "+self.getSubuser().getImageId()+"\n"
-    dockerfileContents += "RUN useradd --uid="+str(os.getuid())+" "+getpass.getuser()+" ;export exitstatus=$? ; if [ $exitstatus -eq 4 ] ; then echo uid exists ; elif [ $exitstatus -eq 9 ]; then echo username exists. ; else exit $exitstatus ; fi\n"
-    dockerfileContents += "RUN test -d /home/"+getpass.getuser()+" || mkdir /home/"+getpass.getuser()+" && chown "+getpass.getuser()+" /home/"+getpass.getuser()+"\n"
+    steps = []
+    steps.append("useradd --uid="+str(os.getuid())+" "+getpass.getuser()+" ;export exitstatus=$? ; if [ $exitstatus -eq 4 ] ; then echo uid exists ; elif [ $exitstatus -eq 9 ]; then echo username exists. ; else exit $exitstatus ; fi")
+    steps.append("test -d /home/"+getpass.getuser()+" || mkdir /home/"+getpass.getuser()+" && chown "+getpass.getuser()+" /home/"+getpass.getuser())
     if self.getSubuser().getPermissions()["serial-devices"]:
-      dockerfileContents += "RUN groupadd dialout; export exitstatus=$? ; if [ $exitstatus -eq 4 ] ; then echo gid exists ; elif [ $exitstatus -eq 9 ]; then echo groupname exists. ; else exit $exitstatus ; fi\n"
-      dockerfileContents += "RUN groupadd uucp; export exitstatus=$? ; if [ $exitstatus -eq 4 ] ; then echo gid exists ; elif [ $exitstatus -eq 9 ]; then echo groupname exists. ; else exit $exitstatus ; fi\n"
-      dockerfileContents += "RUN usermod -a -G dialout "+getpass.getuser()+"\n"
-      dockerfileContents += "RUN usermod -a -G uucp "+getpass.getuser()+"\n"
+      steps.append("groupadd dialout; export exitstatus=$? ; if [ $exitstatus -eq 4 ] ; then echo gid exists ; elif [ $exitstatus -eq 9 ]; then echo groupname exists. ; else exit $exitstatus ; fi")
+      steps.append("groupadd uucp; export exitstatus=$? ; if [ $exitstatus -eq 4 ] ; then echo gid exists ; elif [ $exitstatus -eq 9 ]; then echo groupname exists. ; else exit $exitstatus ; fi")
+      steps.append("usermod -a -G dialout "+getpass.getuser())
+      steps.append("usermod -a -G uucp "+getpass.getuser())
     if self.getSubuser().getPermissions()["sudo"]:
-      dockerfileContents += "RUN (umask 337; echo \""+getpass.getuser()+" ALL=(ALL) NOPASSWD: ALL\" > /etc/sudoers.d/allowsudo )\n"
+      steps.append("umask 337; echo \""+getpass.getuser()+" ALL=(ALL) NOPASSWD: ALL\" > /etc/sudoers.d/allowsudo")
+    dockerfileContents  = "FROM "+self.getSubuser().getImageId()+"\n"
+    dockerfileContents += "RUN "+" && ".join(["( "+step+" )" for step in steps])+"\n"
     return dockerfileContents
   
   def build(self):
@@ -13,6 +13,7 @@ import os
 import time
 #internal imports
 from subuserlib.classes.userOwnedObject import UserOwnedObject
+import subuserlib.dockerRun
 
 def getRecursiveDirectoryContents(directory):
   files = []
@@ -21,6 +22,66 @@ def getRecursiveDirectoryContents(directory):
       files.append(os.path.join(directory,fileName))
   return files
 
+def getSerialDevices():
+  return [device for device in os.listdir("/dev/") if device.startswith("ttyS") or device.startswith("ttyUSB") or device.startswith("ttyACM")]
+
+def getSoundArgs():
+  soundArgs = []
+  if os.path.exists("/dev/snd"):
+    soundArgs += ["--volume=/dev/snd:/dev/snd"]
+    soundArgs += ["--device=/dev/snd/"+device for device in os.listdir("/dev/snd") if not device == "by-id" and not device == "by-path"]
+  if os.path.exists("/dev/dsp"):
+    soundArgs += ["--volume=/dev/dsp:/dev/dsp"]
+    soundArgs += ["--device=/dev/dsp/"+device for device in os.listdir("/dev/dsp")]
+  return soundArgs
+
+def setupUserdirsSymlink(homeDirOnHost):
+  """
+  Create the Userdirs symlink in the subuser's home dir, which points to the user dirs it has access to.
+  """
+  symlinkPath = os.path.join(homeDirOnHost,"Userdirs")
+  destinationPath = "/userdirs"
+  if not os.path.exists(symlinkPath):
+    try:
+      os.makedirs(homeDirOnHost)
+    except OSError:
+      pass
+    try:
+      os.symlink(destinationPath,symlinkPath) #Arg, why are source and destination switched?
+    #os.symlink(where does the symlink point to, where is the symlink)
+    #I guess it's to be like cp...
+    except OSError:
+      pass
+
+def expandFlags(flags,environment):
+  """
+  Flags which depend on the environment in which the subuser is launched, rather than on its permissions, are represented by dictionaries.  Replace them with the docker run flags which they stand for at this moment.
+
+  >>> from subuserlib.classes.subuserSubmodules.run.runtime import expandFlags
+  >>> expandFlags(["--rm",{"pass-env":"LANG"},{"pass-env":"TZ"}],{"LANG":"en_US.UTF-8"})
+  ['--rm', '-e', 'LANG=en_US.UTF-8']
+  """
+  expandedFlags = []
+  for flag in flags:
+    if not isinstance(flag,dict):
+      expandedFlags.append(flag)
+    elif "pass-env" in flag:
+      if flag["pass-env"] in environment:
+        expandedFlags += ["-e",flag["pass-env"]+"="+environment[flag["pass-env"]]]
+    elif "sound-card" in flag:
+      expandedFlags += getSoundArgs()
+    elif "serial-devices" in flag:
+      expandedFlags += ["--device=/dev/"+device for device in getSerialDevices()]
+    elif "devices-with-prefix" in flag:
+      expandedFlags += ["--device=/dev/"+device for device in os.listdir("/dev/") if device.startswith(flag["devices-with-prefix"])]
+    elif "devices-in-dir" in flag:
+      expandedFlags += ["--device="+flag["devices-in-dir"]+"/"+device for device in os.listdir(flag["devices-in-dir"])]
+    elif "working-directory" in flag:
+      expandedFlags += ["-v="+os.getcwd()+":/pwd:rw","--workdir=/pwd"]
+    elif "x11-display" in flag:
+      expandedFlags += ["-e","DISPLAY=unix"+environment['DISPLAY']]
+  return expandedFlags
+
 class Runtime(UserOwnedObject):
   def __init__(self,user,subuser,environment):
     self.__subuser = subuser
@@ -45,14 +106,12 @@ $ subuser repair
     return self.__environment
 
   def getSerialDevices(self):
-    return [device for device in os.listdir("/dev/") if device.startswith("ttyS") or device.startswith("ttyUSB") or device.startswith("ttyACM")]
-  def getCidFile(self):
-    return "/tmp/subuser-"+self.getSubuser().getName()
-  
+    return getSerialDevices()
+
   def getBasicFlags(self):
     common = ["--rm"]
     if self.getBackground():
-      return common + ["--cidfile",self.getCidFile()]
+      return common
     else:
       return common + [
         "-i",
@@ -62,43 +121,33 @@ $ subuser repair
     """
     Generate the arguments required to pass on a given ENV var to the container from the host.
     """
-    try:
-      return ["-e",envVar+"="+self.getEnvironment()[envVar]]
-    except KeyError:
-      return []
+    return expandFlags([{"pass-env":envVar}],self.getEnvironment())
 
   def getSoundArgs(self):
-    soundArgs = []
-    if os.path.exists("/dev/snd"):
-      soundArgs += ["--volume=/dev/snd:/dev/snd"]
-      soundArgs += ["--device=/dev/snd/"+device for device in os.listdir("/dev/snd") if not device == "by-id" and not device == "by-path"]
-    if os.path.exists("/dev/dsp"):
-      soundArgs += ["--volume=/dev/dsp:/dev/dsp"]
-      soundArgs += ["--device=/dev/dsp/"+device for device in os.listdir("/dev/dsp")]
-    return soundArgs
-  
+    return getSoundArgs()
+
   def getPermissionFlagDict(self):
     """
-    This is a dictionary mapping permissions to functions which when given the permission's values return docker run flags.
+    This is a dictionary mapping permissions to functions which when given the permission's values return docker run flags.  Flags which depend on the environment at launch time are left for ``expandFlags`` to fill in.
     """
     return collections.OrderedDict([
      # Conservative permissions
      ("stateful-home", lambda p : ["-v="+self.getSubuser().getHomeDirOnHost()+":"+self.getSubuser().getDockersideHome()+":rw","-e","HOME="+self.getSubuser().getDockersideHome()] if p else ["-e","HOME="+self.getSubuser().getDockersideHome()]),
-     ("inherit-locale", lambda p : self.passOnEnvVar("LANG")+self.passOnEnvVar("LANGUAGE") if p else []),
-     ("inherit-timezone", lambda p : self.passOnEnvVar("TZ")+["-v=/etc/localtime:/etc/localtime:ro"] if p else []),
+     ("inherit-locale", lambda p : [{"pass-env":"LANG"},{"pass-env":"LANGUAGE"}] if p else []),
+     ("inherit-timezone", lambda p : [{"pass-env":"TZ"},"-v=/etc/localtime:/etc/localtime:ro"] if p else []),
      # Moderate permissions
      ("gui", lambda p : ["-e","DISPLAY=unix:100","-v",self.getSubuser().getX11Bridge().getServerSideX11Path()+":/tmp/.X11-unix"] if p else []),
      ("user-dirs", lambda userDirs : ["-v="+os.path.join(self.getSubuser().getUser().homeDir,userDir)+":"+os.path.join("/userdirs/",userDir)+":rw" for userDir in userDirs]),
-     ("inherit-envvars", lambda envVars: [arg for var in envVars for arg in self.passOnEnvVar (var)]),
-     ("sound-card", lambda p: self.getSoundArgs() if p else []),
-     ("webcam", lambda p: ["--device=/dev/"+device for device in os.listdir("/dev/") if device.startswith("video")] if p else []),
-     ("access-working-directory", lambda p: ["-v="+os.getcwd()+":/pwd:rw","--workdir=/pwd"] if p else ["--workdir="+self.getSubuser().getDockersideHome()]),
+     ("inherit-envvars", lambda envVars: [{"pass-env":var} for var in envVars]),
+     ("sound-card", lambda p: [{"sound-card":True}] if p else []),
+     ("webcam", lambda p: [{"devices-with-prefix":"video"}] if p else []),
+     ("access-working-directory", lambda p: [{"working-directory":True}] if p else ["--workdir="+self.getSubuser().getDockersideHome()]),
      ("allow-network-access", lambda p: ["--net=bridge","--dns=8.8.8.8"] if p else ["--net=none"]),
      # Liberal permissions
-     ("x11", lambda p: ["-e","DISPLAY=unix"+os.environ['DISPLAY'],"-v=/tmp/.X11-unix:/tmp/.X11-unix:rw"] if p else []),
+     ("x11", lambda p: [{"x11-display":True},"-v=/tmp/.X11-unix:/tmp/.X11-unix:rw"] if p else []),
      ("system-dirs", lambda systemDirs : ["-v="+source+":"+dest+":rw" for source,dest in systemDirs.items()]),
-     ("graphics-card", lambda p: ["--device=/dev/dri/"+device for device in os.listdir("/dev/dri")] if p else []),
-     ("serial-devices", lambda sd: ["--device=/dev/"+device for device in self.getSerialDevices()] if sd else []),
+     ("graphics-card", lambda p: [{"devices-in-dir":"/dev/dri"}] if p else []),
+     ("serial-devices", lambda sd: [{"serial-devices":True}] if sd else []),
      ("system-dbus", lambda dbus: ["--volume=/var/run/dbus/system_bus_socket:/var/run/dbus/system_bus_socket"] if dbus else []),
      ("as-root", lambda root: ["--user=0"] if root else ["--user="+str(os.getuid())]),
      # Anarchistic permissions
@@ -112,9 +161,9 @@ $ subuser repair
     self.__extraFlags.append("-h")
     self.__extraFlags.append(hostname)
   
-  def getCommand(self,args):
+  def getFlagTemplate(self):
     """
-    Returns the command required to run the subuser as a list of string arguments.
+    Returns the docker run flags, with the flags that depend on the environment at launch time left unexpanded(see ``expandFlags``).
     """
     flags = self.getBasicFlags()
     flags.extend(self.__extraFlags)
@@ -122,7 +171,13 @@ $ subuser repair
     permissions = self.getSubuser().getPermissions()
     for permission, flagGenerator in permissionFlagDict.items():
       flags.extend(flagGenerator(permissions[permission]))
-  
+    return flags
+
+  def getCommand(self,args):
+    """
+    Returns the command required to run the subuser as a list of string arguments.
+    """
+    flags = expandFlags(self.getFlagTemplate(),self.getEnvironment())
     return ["run"]+flags+["--entrypoint"]+[self.getSubuser().getPermissions()["executable"]]+[self.getRunReadyImageId()]+args
   
   def getPrettyCommand(self,args):
@@ -147,44 +202,27 @@ $ subuser repair
     def reallyRun():
       if not self.getSubuser().getPermissions()["executable"]:
         sys.exit("Cannot run subuser, no executable configured in permissions.json file.")
-      def setupSymlinks():
-        symlinkPath = os.path.join(self.getSubuser().getHomeDirOnHost(),"Userdirs")
-        destinationPath = "/userdirs"
-        if not os.path.exists(symlinkPath):
-          try:
-            os.makedirs(self.getSubuser().getHomeDirOnHost())
-          except OSError:
-            pass
-          try:
-            os.symlink(destinationPath,symlinkPath) #Arg, why are source and destination switched?
-          #os.symlink(where does the symlink point to, where is the symlink)
-          #I guess it's to be like cp...
-          except OSError:
-            pass
-    
       if self.getSubuser().getPermissions()["stateful-home"]:
-        setupSymlinks()
+        setupUserdirsSymlink(self.getSubuser().getHomeDirOnHost())
   
       #Note, subusers with gui permission cannot be run in the background.
       # Make sure that everything is setup and ready to go.
       if not self.getSubuser().getPermissions()["gui"] is None:
         self.getSubuser().getX11Bridge().addClient()
       command = self.getCommand(args)
-      returnCode = self.getUser().getDockerDaemon().execute(command,background=self.getBackground())
+      # Remember when the run-ready image was last used, so that the retention policy can remove the least recently used images first.
+      self.getSubuser().getRuntimeCache()["last-used"] = int(time.time())
+      self.getSubuser().getRuntimeCache().save()
+      try:
+        if self.getBackground():
+          result = self.getUser().getDockerDaemon().runInBackground(command[1:])
+        else:
+          result = self.getUser().getDockerDaemon().runInteractively(command[1:])
+      except subuserlib.dockerRun.ContainerRunException as e:
+        sys.exit(str(e))
       if not self.getSubuser().getPermissions()["gui"] is None:
         self.getSubuser().getX11Bridge().removeClient()
-      if self.getBackground():
-        while not os.path.exists(self.getCidFile()) or os.path.getsize(self.getCidFile()) == 0:
-          time.sleep(0.05)
-        with open(self.getCidFile(),"r") as cidFile:
-          containerId = cidFile.read()
-          container = self.getUser().getDockerDaemon().getContainer(containerId)
-          if container is None:
-            sys.exit("Container failed to start:"+containerId)
-          os.remove(self.getCidFile())
-          return container
-      else:
-        return returnCode
+      return result
 
     #try:
     return reallyRun()
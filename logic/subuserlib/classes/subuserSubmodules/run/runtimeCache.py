@@ -4,13 +4,37 @@
 
 """
 Stores metadata about images which are built to encorporate changes to subuser images which are required in order to implement various permissions.
+
+The cache is keyed on the subuser's image and on only those permissions which change the run-ready image.  Subusers which share both share a single run-ready image.
 """
 
 #external imports
-import sys,os,getpass,json
+import sys,os,getpass,json,time
 #internal imports
 from subuserlib.classes.userOwnedObject import UserOwnedObject
 from subuserlib.classes.fileBackedObject import FileBackedObject
+from subuserlib.classes.subuserSubmodules.run.runReadyImage import buildRelevantPermissions
+
+def writeRuntimeCacheFile(pathToRuntimeCacheFile,runtimeCache):
+  """
+  Replace the runtime cache file in a single step, so that subusers which are launched at the same time never see it half written.
+  """
+  temporaryRuntimeCacheFilePath = pathToRuntimeCacheFile+".tmp."+str(os.getpid())
+  with open(temporaryRuntimeCacheFilePath,mode='w') as runtimeCacheFileHandle:
+    json.dump(runtimeCache,runtimeCacheFileHandle,indent=1,separators=(',',': '))
+  os.rename(temporaryRuntimeCacheFilePath,pathToRuntimeCacheFile)
+
+def recordLastUsed(pathToRuntimeCacheFile):
+  """
+  Remember when the run-ready image was last used, so that the retention policy can remove the least recently used images first.  This works without loading the subuser, for launches from a launch manifest.
+  """
+  try:
+    with open(pathToRuntimeCacheFile,mode="r") as runtimeCacheFileHandle:
+      runtimeCache = json.load(runtimeCacheFileHandle)
+    runtimeCache["last-used"] = int(time.time())
+    writeRuntimeCacheFile(pathToRuntimeCacheFile,runtimeCache)
+  except (IOError,OSError,ValueError):
+    pass
 
 class RuntimeCache(dict,UserOwnedObject,FileBackedObject):
   def __init__(self,user,subuser):
@@ -18,12 +42,15 @@ class RuntimeCache(dict,UserOwnedObject,FileBackedObject):
     UserOwnedObject.__init__(self,user)
     if not self.getSubuser().getImageId():
       raise NoRuntimeCacheForSubusersWhichDontHaveExistantImagesException
-    self.__pathToRuntimeCacheFile = os.path.join(self.getPathToCurrentImagesRuntimeCacheDir(),self.getSubuser().getPermissions().getHash()+".json")
+    self.__pathToRuntimeCacheFile = os.path.join(self.getPathToCurrentImagesRuntimeCacheDir(),self.getSubuser().getPermissions().getHashOfSubset(buildRelevantPermissions)+".json")
     self.load()
 
   def getPathToCurrentImagesRuntimeCacheDir(self):
     return os.path.join(self.getUser().getConfig()["runtime-cache"],self.getSubuser().getImageId())
 
+  def getPathToRuntimeCacheFile(self):
+    return self.__pathToRuntimeCacheFile
+
   def getSubuser(self):
     return self.__subuser
 
@@ -32,8 +59,7 @@ class RuntimeCache(dict,UserOwnedObject,FileBackedObject):
       os.makedirs(self.getPathToCurrentImagesRuntimeCacheDir())
     except OSError:
       pass
-    with open(self.__pathToRuntimeCacheFile,mode='w') as runtimeCacheFileHandle:
-      json.dump(self,runtimeCacheFileHandle,indent=1,separators=(',',': '))
+    writeRuntimeCacheFile(self.__pathToRuntimeCacheFile,self)
 
   def load(self):
     if os.path.exists(self.__pathToRuntimeCacheFile):
@@ -164,9 +164,7 @@ class XpraX11Bridge(Service):
     serverRuntime.setBackground(True)
     serverContainer = serverRuntime.run(args=serverArgs)
     serviceStatus["xpra-server-service-cid"] = serverContainer.getId()
-    self.waitForServerContainerToLaunch()
-    serverContainerInfo = serverContainer.inspect()
-    if serverContainerInfo is None:
+    if not self.waitForServerContainerToLaunch(serverContainer):
       exit("The xpra server container failed to launch. Container id:" + serverContainer.getId())
     # Launch xpra client
     clientArgs = ["attach","--no-tray","--compress=0","--encoding=rgb"]
@@ -178,10 +176,16 @@ class XpraX11Bridge(Service):
     serviceStatus["xpra-client-service-cid"] = clientRuntime.run(args=clientArgs).getId()
     return serviceStatus
 
-  def waitForServerContainerToLaunch(self):
+  def waitForServerContainerToLaunch(self,serverContainer):
+    """
+    Wait for the xpra server to create its X11 socket.  Returns False if the server container exits first.
+    """
     while True:
       if os.path.exists(os.path.join(self.getServerSideX11Path(),"X100")):
-        return
+        return True
+      serverContainerInfo = serverContainer.inspect()
+      if serverContainerInfo is None or not serverContainerInfo["State"]["Running"]:
+        return False
       time.sleep(0.05)
 
   def stop(self,serviceStatus):
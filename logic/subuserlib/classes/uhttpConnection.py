@@ -22,12 +22,22 @@ class UHTTPConnection(httplib.HTTPConnection):
   """Subclass of Python library HTTPConnection that uses a unix-domain socket.
   """
 
-  def __init__(self, path):
+  def __init__(self, path, timeout=None):
     httplib.HTTPConnection.__init__(self, 'localhost')
     self.path = path
+    self.timeout = timeout
 
   def connect(self):
     sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(self.timeout)
     sock.connect(self.path)
     self.sock = sock
 
+  def setTimeout(self, timeout):
+    """
+    Set the timeout(in seconds) for blocking socket operations.  None means block forever.
+    """
+    self.timeout = timeout
+    if self.sock:
+      self.sock.settimeout(timeout)
+
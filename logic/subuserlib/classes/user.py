@@ -15,6 +15,7 @@ from subuserlib.classes import registry
 from subuserlib.classes import config
 from subuserlib.classes import installedImages
 from subuserlib.classes.docker import dockerDaemon
+from subuserlib.classes.docker import imageInventory
 from subuserlib import test
 from subuserlib import paths
 
@@ -36,6 +37,7 @@ class User(object):
     self.__registry = None
     self.__installedImages = None
     self.__dockerDaemon = None
+    self.__imageInventory = None
     self.__runtimeCache = None
     if os.path.exists(os.path.join(paths.getSubuserDir(),"installed-images.json")):
       sys.exit("""Hey, it looks like you are using an old version of subuser.  First of, thanks for being an early adopter!  That really means a lot to me :)  Subuser has recently undergone a major re-write.  Unfortunately, you'll have to set up everything all over again.  You can find your subuser home dirs in subuser/homes.  The new version of subuser keeps them in ~/.subuser/homes.  You can find out all about the different locations subuser serializes to by looking in the enw config.json file.  I hope I'll have some docs up soon at subuser.org.  Sorry for the inconvenience.
@@ -54,10 +56,7 @@ To disable this message delete your subuser/installed-programs.json file.
     if homeDir:
       self.homeDir = homeDir
     else:
-      if test.testing:
-        self.homeDir = "/home/travis/test-home"
-      else:
-        self.homeDir = os.path.expanduser("~")
+      self.homeDir = paths.getHomeDir()
  
   def getConfig(self):
     """
@@ -102,3 +101,13 @@ To disable this message delete your subuser/installed-programs.json file.
     if self.__dockerDaemon == None:
       self.__dockerDaemon = dockerDaemon.DockerDaemon(self)
     return self.__dockerDaemon
+
+  def getImageInventory(self):
+    """
+    Get the :doc:`ImageInventory <docker>`, a snapshot of all of the images which the Docker daemon has.
+
+    Note: the snapshot is fetched the first time that it is used.
+    """
+    if self.__imageInventory == None:
+      self.__imageInventory = imageInventory.ImageInventory(self)
+    return self.__imageInventory
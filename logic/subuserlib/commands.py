@@ -2,11 +2,13 @@
 # This file should be compatible with both Python 2 and 3.
 # If it is not, please file a bug report.
 """
-This module helps us figure out which subuser subcommands can be called.
+This module helps us figure out which subuser subcommands can be called, and calls them.
+
+Built in commands are run in the same Python process as the ``subuser`` entry point.  External commands are stand alone executables in the user's $PATH.  Scanning the $PATH for them is slow, so the list of external commands is cached in ``~/.subuser/external-commands.json``.  The cache is rebuilt whenever the $PATH, or the modification time of one of its directories, changes.
 """
 
 #external imports
-import os
+import os,sys,json,runpy
 #internal imports
 import subuserlib.executablePath,subuserlib.paths
 
@@ -18,34 +20,137 @@ def getBuiltInSubuserCommands():
   commands = list(apparentCommandsSet.difference(nonCommands))
   return [command[:-3] for command in commands if not command.endswith(".pyc") and not command.startswith("__")] #remove the .py suffixes.
 
-def getExternalSubuserCommands():
-  """ Return the list of "external" subuser commands.  These are not built in commands but rather stand alone executables which appear in the user's $PATH and who's names start with "subuser-" """
+def getBuiltInSubuserCommandPath(command):
+  """ Returns the path to the built in command's script, or None if there is no such built in command. """
+  if command+".py" in nonCommands:
+    return None
+  builtInCommandPath = os.path.join(subuserlib.paths.getSubuserCommandsDir(),command+".py")
+  if os.path.exists(builtInCommandPath):
+    return builtInCommandPath
+  return None
 
-  def isPathToSubuserCommand(path):
-    directory, executableName = os.path.split(path)
-    return executableName.startswith("subuser-")
+def getExternalCommandsCachePath():
+  return os.path.join(subuserlib.paths.home,".subuser","external-commands.json")
 
-  externalCommandPaths = subuserlib.executablePath.queryPATH(isPathToSubuserCommand)
+def getPATHDirs():
+  return [path.strip('"') for path in os.environ.get("PATH","").split(os.pathsep)]
 
-  externalCommands = []
+def getModificationTimes(directories):
+  """ Returns a dictionary ``{directory : modification time}``.  Directories which do not exist have a modification time of None. """
+  modificationTimes = {}
+  for directory in directories:
+    try:
+      modificationTimes[directory] = os.stat(directory).st_mtime
+    except OSError:
+      modificationTimes[directory] = None
+  return modificationTimes
+
+def scanPATHForExternalSubuserCommands(pathDirs):
+  """ Returns a dictionary ``{commandName : path}`` of the executables in the given directories who's names start with "subuser-".  As with ``which``, directories which come first in the $PATH take precedence. """
+  externalCommands = {}
   subuserPrefixLength=len("subuser-")
-  for externalCommandPath in externalCommandPaths:
-    commandDir, executableName = os.path.split(externalCommandPath)
-    commandName = executableName[subuserPrefixLength:]
-    externalCommands.append(commandName)
+  for directory in pathDirs:
+    try:
+      fileNames = os.listdir(directory)
+    except OSError:
+      continue
+    for fileName in fileNames:
+      if not fileName.startswith("subuser-") or fileName[subuserPrefixLength:] in externalCommands:
+        continue
+      externalCommandPath = os.path.join(directory,fileName)
+      if subuserlib.executablePath.isExecutable(externalCommandPath):
+        externalCommands[fileName[subuserPrefixLength:]] = externalCommandPath
+  return externalCommands
+
+def getExternalSubuserCommandPaths():
+  """
+  Returns a dictionary ``{commandName : path}`` of the "external" subuser commands.  The $PATH is only scanned if it has changed since the cache was last written.
+
+  >>> import os,stat,shutil,tempfile
+  >>> import subuserlib.commands,subuserlib.paths
+  >>> def makeCommand(directory,name):
+  ...   commandPath = os.path.join(directory,name)
+  ...   open(commandPath,"w").close()
+  ...   os.chmod(commandPath,stat.S_IRWXU)
+  >>> tempDir = tempfile.mkdtemp()
+  >>> first = os.path.join(tempDir,"first")
+  >>> second = os.path.join(tempDir,"second")
+  >>> for directory in [first,second,os.path.join(tempDir,".subuser")]:
+  ...   os.mkdir(directory)
+  >>> makeCommand(first,"subuser-hello")
+  >>> makeCommand(second,"subuser-hello")
+  >>> makeCommand(second,"subuser-bye")
+  >>> for directory in [first,second]:
+  ...   os.utime(directory,(1000000000,1000000000))
+  >>> oldPATH = os.environ["PATH"]
+  >>> oldHome = subuserlib.paths.home
+  >>> os.environ["PATH"] = os.pathsep.join([first,second])
+  >>> subuserlib.paths.home = tempDir
+
+  Directories which come first in the $PATH take precedence.
 
-  return list(set(externalCommands)) # remove duplicate entries
+  >>> commands = subuserlib.commands.getExternalSubuserCommandPaths()
+  >>> commands["hello"] == os.path.join(first,"subuser-hello")
+  True
+  >>> commands["bye"] == os.path.join(second,"subuser-bye")
+  True
+
+  So long as no directory in the $PATH has been modified, the cache is used.
+
+  >>> os.remove(os.path.join(first,"subuser-hello"))
+  >>> os.utime(first,(1000000000,1000000000))
+  >>> subuserlib.commands.getExternalSubuserCommandPaths()["hello"] == os.path.join(first,"subuser-hello")
+  True
+
+  Once a directory's modification time changes, the $PATH is scanned again.
+
+  >>> os.utime(first,(1000000060,1000000060))
+  >>> subuserlib.commands.getExternalSubuserCommandPaths()["hello"] == os.path.join(second,"subuser-hello")
+  True
+  >>> os.environ["PATH"] = oldPATH
+  >>> subuserlib.paths.home = oldHome
+  >>> shutil.rmtree(tempDir)
+  """
+  pathDirs = getPATHDirs()
+  modificationTimes = getModificationTimes(pathDirs)
+  cachePath = getExternalCommandsCachePath()
+  try:
+    with open(cachePath,"r") as cacheFile:
+      cache = json.load(cacheFile)
+    if cache["path-dirs"] == pathDirs and cache["modification-times"] == modificationTimes:
+      return cache["commands"]
+  except (IOError,OSError,ValueError,KeyError,TypeError):
+    pass
+  externalCommands = scanPATHForExternalSubuserCommands(pathDirs)
+  try:
+    temporaryCachePath = cachePath+".tmp."+str(os.getpid())
+    with open(temporaryCachePath,"w") as cacheFile:
+      json.dump({"path-dirs":pathDirs,"modification-times":modificationTimes,"commands":externalCommands},cacheFile,indent=1,separators=(',',': '))
+    os.rename(temporaryCachePath,cachePath)
+  except (IOError,OSError): # The cache is only an optimization.
+    pass
+  return externalCommands
+
+def getExternalSubuserCommands():
+  """ Return the list of "external" subuser commands.  These are not built in commands but rather stand alone executables which appear in the user's $PATH and who's names start with "subuser-" """
+  return list(getExternalSubuserCommandPaths().keys())
 
 def getSubuserCommands():
   """ Returns a list of commands that may be called by the user. """
   return getBuiltInSubuserCommands() + getExternalSubuserCommands()
 
 def getSubuserCommandPath(command):
-  builtInCommandPath = os.path.join(subuserlib.paths.getSubuserCommandsDir(),command)
-  if os.path.exists(builtInCommandPath):
+  builtInCommandPath = getBuiltInSubuserCommandPath(command)
+  if builtInCommandPath:
     return builtInCommandPath
-  elif os.path.exists(builtInCommandPath+".py"):
-    return (builtInCommandPath+".py")
-  else:
-    externalCommandPath = subuserlib.executablePath.which("subuser-"+command)
-    return externalCommandPath
+  return getExternalSubuserCommandPaths().get(command)
+
+def runBuiltInSubuserCommand(builtInCommandPath,args):
+  """
+  Run a built in command in the current process, as if its script had been executed with the given arguments.  The command exits by raising SystemExit, just as it would if it were run on its own.
+  """
+  commandsDir = os.path.dirname(builtInCommandPath)
+  if not commandsDir in sys.path: # So that the command can import pathConfig.
+    sys.path.insert(0,commandsDir)
+  sys.argv = [builtInCommandPath]+args
+  runpy.run_path(builtInCommandPath,run_name="__main__")
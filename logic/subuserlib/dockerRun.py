@@ -0,0 +1,354 @@
+#!/usr/bin/env python
+# This file should be compatible with both Python 2 and 3.
+# If it is not, please file a bug report.
+
+"""
+This module runs containers through the Docker daemon's HTTP API, rather than by launching the docker client.
+
+Subusers are described by the arguments that would be given to ``docker run``(see ``Runtime.getCommand``).  ``getContainerConfig`` translates those arguments into the configuration that the daemon's create container endpoint expects.  The container is then created, attached to and started over the daemon's socket, and the terminal is forwarded to it until it exits.
+"""
+
+#external imports
+import os,sys,json,socket,select,signal,errno,struct
+try:
+  import termios,tty,fcntl
+except ImportError:
+  termios = None
+#internal imports
+import subuserlib.docker
+from subuserlib.classes.docker.connectionPool import ConnectionPool,apiVersion,defaultSocketPath
+
+class ContainerRunException(Exception):
+  pass
+
+class ImageDoesNotExistException(ContainerRunException):
+  pass
+
+def getContainerConfig(runArgs):
+  """
+  Translate the arguments of a ``docker run`` command into the configuration of a container.  Returns a tuple ``(containerConfig,remove)``, where remove is True if the container should be removed once it has exited.
+
+  >>> from subuserlib.dockerRun import getContainerConfig,ContainerRunException
+  >>> (containerConfig,remove) = getContainerConfig(["--rm","-i","-t","-e","HOME=/home/foo","-v=/home/me/foo:/home/foo:rw","--device=/dev/video0","--net=none","--user=1000","--entrypoint","/usr/bin/foo","3","--help"])
+  >>> remove
+  True
+  >>> containerConfig["Entrypoint"],containerConfig["Image"],containerConfig["Cmd"],containerConfig["Env"],containerConfig["User"],containerConfig["Tty"]
+  (['/usr/bin/foo'], '3', ['--help'], ['HOME=/home/foo'], '1000', True)
+  >>> containerConfig["HostConfig"]["Binds"],containerConfig["HostConfig"]["NetworkMode"]
+  (['/home/me/foo:/home/foo:rw'], 'none')
+  >>> containerConfig["HostConfig"]["Devices"][0]["PathInContainer"]
+  '/dev/video0'
+
+  Flags that this translation does not know about are refused, rather than being silently dropped.
+
+  >>> try:
+  ...   getContainerConfig(["--rm","--cap-add=SYS_ADMIN","3"])
+  ... except ContainerRunException as e:
+  ...   print(e)
+  Unsupported docker run flag: --cap-add
+  >>> try:
+  ...   getContainerConfig(["--rm","-i"])
+  ... except ContainerRunException as e:
+  ...   print(e)
+  No image was given.
+  >>> try:
+  ...   getContainerConfig(["--rm","--user"])
+  ... except ContainerRunException as e:
+  ...   print(e)
+  The flag --user requires a value.
+  """
+  hostConfig = {"Binds":[],"Devices":[],"Dns":[],"Privileged":False}
+  containerConfig = {"Env":[],"Tty":False,"OpenStdin":False,"StdinOnce":False,"AttachStdin":False,"AttachStdout":True,"AttachStderr":True,"HostConfig":hostConfig}
+  remove = False
+  booleanFlags = ["--rm","-i","-t","--privileged"]
+  args = list(runArgs)
+  while args and args[0].startswith("-"):
+    flag = args.pop(0)
+    if flag in booleanFlags:
+      value = None
+    elif "=" in flag:
+      (flag,value) = flag.split("=",1)
+    elif args:
+      value = args.pop(0)
+    else:
+      raise ContainerRunException("The flag "+flag+" requires a value.")
+    if flag == "--rm":
+      remove = True
+    elif flag == "-i":
+      containerConfig["OpenStdin"] = True
+      containerConfig["StdinOnce"] = True
+      containerConfig["AttachStdin"] = True
+    elif flag == "-t":
+      containerConfig["Tty"] = True
+    elif flag == "--privileged":
+      hostConfig["Privileged"] = True
+    elif flag == "-e":
+      containerConfig["Env"].append(value)
+    elif flag in ["-v","--volume"]:
+      hostConfig["Binds"].append(value)
+    elif flag == "--device":
+      hostConfig["Devices"].append({"PathOnHost":value,"PathInContainer":value,"CgroupPermissions":"rwm"})
+    elif flag == "--workdir":
+      containerConfig["WorkingDir"] = value
+    elif flag == "--net":
+      hostConfig["NetworkMode"] = value
+    elif flag == "--dns":
+      hostConfig["Dns"].append(value)
+    elif flag == "--user":
+      containerConfig["User"] = value
+    elif flag == "-h":
+      containerConfig["Hostname"] = value
+    elif flag == "--entrypoint":
+      containerConfig["Entrypoint"] = [value]
+    else:
+      raise ContainerRunException("Unsupported docker run flag: "+flag)
+  if not args:
+    raise ContainerRunException("No image was given.")
+  containerConfig["Image"] = args[0]
+  containerConfig["Cmd"] = args[1:]
+  return (containerConfig,remove)
+
+def getConnectionPool():
+  """
+  Returns a connection pool for the daemon's socket.  If we cannot connect to the daemon, exit with a message that explains why.
+  """
+  try:
+    probe = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+    probe.connect(defaultSocketPath)
+    probe.close()
+  except socket.error:
+    subuserlib.docker.getAndVerifyDockerExecutable()
+    sys.exit("Error: Cannot connect to the Docker daemon at "+defaultSocketPath+".")
+  return ConnectionPool(defaultSocketPath)
+
+def createContainer(connectionPool,containerConfig):
+  """
+  Returns the Id of the newly created container.  Raises an ImageDoesNotExistException if the container's image does not exist.
+  """
+  response = connectionPool.request("POST",apiVersion+"/containers/create",body=json.dumps(containerConfig),headers={"Content-Type":"application/json"})
+  if response.status == 404:
+    raise ImageDoesNotExistException("The image "+containerConfig["Image"]+" does not exist.\n"+response.read().decode("utf-8"))
+  if not response.status == 201:
+    raise ContainerRunException("The container could not be created.\n"+response.read().decode("utf-8"))
+  return json.loads(response.read().decode("utf-8"))["Id"]
+
+def startContainer(connectionPool,containerId):
+  response = connectionPool.request("POST",apiVersion+"/containers/"+containerId+"/start")
+  if not response.status in [204,304]:
+    raise ContainerRunException("The container could not be started.\n"+response.read().decode("utf-8"))
+
+def waitForContainer(connectionPool,containerId):
+  """
+  Block until the container exits.  Returns its exit code.
+  """
+  with connectionPool.streamingRequest("POST",apiVersion+"/containers/"+containerId+"/wait") as response:
+    body = response.read().decode("utf-8")
+  if not response.status == 200:
+    raise ContainerRunException("Could not wait for the container to exit.\n"+body)
+  return json.loads(body)["StatusCode"]
+
+def removeContainer(connectionPool,containerId,force=False):
+  connectionPool.request("DELETE",apiVersion+"/containers/"+containerId+("?force=1" if force else ""))
+
+def attachToContainer(connectionPool,containerId,attachStdin):
+  """
+  Attach to the container's standard streams, including stdin if attachStdin is True.  The daemon hijacks the connection, which then carries the streams in both directions.  Returns a tuple ``(socket,bytes which were received along with the response headers)``.
+  """
+  attachSocket = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+  attachSocket.connect(connectionPool.getSocketPath())
+  attachSocket.sendall(("POST "+apiVersion+"/containers/"+containerId+"/attach?stream=1&stdin="+("1" if attachStdin else "0")+"&stdout=1&stderr=1 HTTP/1.1\r\n"
+    +"Host: docker\r\n"
+    +"Content-Type: text/plain\r\n"
+    +"Connection: Upgrade\r\n"
+    +"Upgrade: tcp\r\n\r\n").encode("ascii"))
+  response = b""
+  while not b"\r\n\r\n" in response:
+    data = attachSocket.recv(4096)
+    if not data:
+      attachSocket.close()
+      raise ContainerRunException("The daemon closed the connection while attaching to the container.")
+    response += data
+  (headers,remainder) = response.split(b"\r\n\r\n",1)
+  status = int(headers.split(b" ")[1])
+  if not status in [101,200]:
+    attachSocket.close()
+    raise ContainerRunException("Could not attach to the container.\n"+headers.decode("utf-8","replace"))
+  return (attachSocket,remainder)
+
+def getTerminalSize(fd):
+  """
+  Returns a tuple ``(rows,columns)`` or None if fd is not a terminal.
+  """
+  try:
+    (rows,columns,_,_) = struct.unpack("hhhh",fcntl.ioctl(fd,termios.TIOCGWINSZ,b"\0"*8))
+  except (IOError,OSError,AttributeError,NameError):
+    return None
+  if not rows or not columns: # The size of the terminal is unknown.
+    return None
+  return (rows,columns)
+
+def resizeContainerTTY(connectionPool,containerId,fd):
+  size = getTerminalSize(fd)
+  if size:
+    connectionPool.request("POST",apiVersion+"/containers/"+containerId+"/resize?h="+str(size[0])+"&w="+str(size[1]))
+
+def writeAll(fd,data):
+  while data:
+    data = data[os.write(fd,data):]
+
+class StreamDemultiplexer():
+  """
+  Without a TTY, the daemon sends stdout and stderr over the same connection in frames, each of which has an eight byte header giving the stream and the frame's length.
+  """
+  def __init__(self):
+    self.__buffer = b""
+
+  def feed(self,data):
+    """
+    Returns a list of ``(stream,data)`` tuples for the frames that have been received in full.  stream is 1 for stdout and 2 for stderr.
+
+    >>> import struct
+    >>> from subuserlib.dockerRun import StreamDemultiplexer
+    >>> def frame(stream,data):
+    ...   return struct.pack(">BxxxL",stream,len(data))+data
+    >>> demultiplexer = StreamDemultiplexer()
+    >>> demultiplexer.feed(frame(1,b"out")+frame(2,b"err")) == [(1,b"out"),(2,b"err")]
+    True
+
+    Frames which are split across reads, even in the middle of the header, are returned once the rest of them arrives.
+
+    >>> data = frame(1,b"hello")+frame(2,b"world")
+    >>> demultiplexer.feed(data[:4])
+    []
+    >>> demultiplexer.feed(data[4:10])
+    []
+    >>> demultiplexer.feed(data[10:16]) == [(1,b"hello")]
+    True
+    >>> demultiplexer.feed(data[16:]) == [(2,b"world")]
+    True
+    >>> demultiplexer.feed(frame(1,b"")) == [(1,b"")]
+    True
+    """
+    self.__buffer += data
+    frames = []
+    while len(self.__buffer) >= 8:
+      (stream,length) = struct.unpack(">BxxxL",self.__buffer[:8])
+      if len(self.__buffer) < 8 + length:
+        break
+      frames.append((stream,self.__buffer[8:8+length]))
+      self.__buffer = self.__buffer[8+length:]
+    return frames
+
+def forwardStreams(attachSocket,initialOutput,useTTY,stdinFd,stdoutFd,stderrFd):
+  """
+  Copy stdin to the container and the container's output to stdout and stderr, until the container closes its end of the connection.  If stdinFd is None, nothing is sent to the container.
+  """
+  demultiplexer = None
+  if not useTTY:
+    demultiplexer = StreamDemultiplexer()
+  def writeOutput(data):
+    if demultiplexer is None:
+      writeAll(stdoutFd,data)
+      return
+    for (stream,frame) in demultiplexer.feed(data):
+      if stream == 2:
+        writeAll(stderrFd,frame)
+      else:
+        writeAll(stdoutFd,frame)
+  writeOutput(initialOutput)
+  readers = [attachSocket]
+  if stdinFd is not None:
+    readers.append(stdinFd)
+  while True:
+    try:
+      (ready,_,_) = select.select(readers,[],[])
+    except (select.error,OSError) as e: # Python 2 does not retry after signals such as SIGWINCH.
+      if e.args[0] == errno.EINTR:
+        continue
+      raise
+    if attachSocket in ready:
+      data = attachSocket.recv(65536)
+      if not data:
+        return
+      writeOutput(data)
+    if stdinFd in ready:
+      data = os.read(stdinFd,65536)
+      if data:
+        attachSocket.sendall(data)
+      else:
+        attachSocket.shutdown(socket.SHUT_WR)
+        readers.remove(stdinFd)
+
+def runInBackground(connectionPool,runArgs):
+  """
+  Create and start a container, without attaching to it.  If the arguments include ``--rm``, the daemon removes the container once it exits.  Returns the container's Id.
+
+  Each call creates a new container, so any number of containers may be run from the same arguments at once.
+  """
+  (containerConfig,remove) = getContainerConfig(runArgs)
+  containerConfig["HostConfig"]["AutoRemove"] = remove
+  for stream in ["AttachStdin","AttachStdout","AttachStderr"]:
+    containerConfig[stream] = False
+  containerId = createContainer(connectionPool,containerConfig)
+  try:
+    startContainer(connectionPool,containerId)
+  except ContainerRunException:
+    removeContainer(connectionPool,containerId,force=True)
+    raise
+  return containerId
+
+def runInteractively(connectionPool,runArgs,warmPool=None):
+  """
+  Run a container in the foreground, with the terminal attached to it, just as ``docker run`` would.  Returns the container's exit code.
+
+  If a ``WarmPool`` is given, a warm container is used when the pool has one with the right configuration, and the pool is refilled while the container runs.
+  """
+  (containerConfig,remove) = getContainerConfig(runArgs)
+  stdinFd = sys.stdin.fileno()
+  stdoutFd = sys.stdout.fileno()
+  # Like docker run -t, but rather than refusing to run when the input is not a terminal, do without the TTY.
+  useTTY = containerConfig["Tty"] and os.isatty(stdinFd) and termios is not None
+  containerConfig["Tty"] = useTTY
+  containerId = None
+  attachment = None
+  if warmPool is not None:
+    containerId = warmPool.claim(containerConfig)
+  if containerId is not None:
+    try:
+      attachment = attachToContainer(connectionPool,containerId,containerConfig["AttachStdin"])
+    except ContainerRunException: # The warm container has been removed since it was created.
+      containerId = None
+  if containerId is None:
+    containerId = createContainer(connectionPool,containerConfig)
+  exited = False
+  oldTerminalSettings = None
+  oldSigwinchHandler = None
+  try:
+    if attachment is None:
+      attachment = attachToContainer(connectionPool,containerId,containerConfig["AttachStdin"])
+    (attachSocket,initialOutput) = attachment
+    try:
+      startContainer(connectionPool,containerId)
+      if warmPool is not None:
+        warmPool.refillInBackground(containerConfig)
+      if useTTY:
+        oldTerminalSettings = termios.tcgetattr(stdinFd)
+        tty.setraw(stdinFd)
+        resizeContainerTTY(connectionPool,containerId,stdoutFd)
+        oldSigwinchHandler = signal.signal(signal.SIGWINCH,lambda signum,frame: resizeContainerTTY(connectionPool,containerId,stdoutFd))
+      sys.stdout.flush()
+      forwardStreams(attachSocket,initialOutput,useTTY,stdinFd if containerConfig["AttachStdin"] else None,stdoutFd,sys.stderr.fileno())
+    finally:
+      if oldSigwinchHandler is not None:
+        signal.signal(signal.SIGWINCH,oldSigwinchHandler)
+      if oldTerminalSettings is not None:
+        termios.tcsetattr(stdinFd,termios.TCSADRAIN,oldTerminalSettings)
+      attachSocket.close()
+    exitCode = waitForContainer(connectionPool,containerId)
+    exited = True
+  finally:
+    if remove or not exited:
+      removeContainer(connectionPool,containerId,force=not exited)
+    if warmPool is not None:
+      warmPool.waitForRefill()
+  return exitCode
@@ -1,49 +1,198 @@
-# Taken from http://code.activestate.com/recipes/576973-getting-the-sha-1-or-md5-hash-of-a-directory/
-# http://akiscode.com/articles/sha-1directoryhash.shtml
-# Copyright (c) 2009 Stephen Akiki
-# MIT License (Means you can do whatever you want with this)
-#  See http://www.opensource.org/licenses/mit-license.php
-# Error Codes:
-#   -1 -> Directory does not exist
-#   -2 -> General error (see stack traceback)
-
-def getHashOfDirs(directory, verbose=0):
+#!/usr/bin/env python
+# This file should be compatible with both Python 2 and 3.
+# If it is not, please file a bug report.
+
+"""
+Content hashing of directory trees.
+
+Directories are hashed as Merkle trees: each file's hash covers its contents, each directory's hash covers the sorted names, modes and hashes of its entries.  The hashes of individual files may be cached on disk, keyed by the file's inode, size and modification time, so that re-hashing an unchanged tree costs only a ``stat`` per file.
+"""
+
+#external imports
+import os,stat,hashlib,json,time,tempfile,threading
+from multiprocessing.pool import ThreadPool
+#internal imports
+#import ...
+
+# Files modified this recently may still be being written to within the resolution of the file system's timestamps.  Their hashes are not cached.
+racyModificationWindow = 2
+# Trees with fewer files than this are hashed in a single thread.
+minimumFilesToHashInParallel = 32
+
+# Image sources which are built at the same time may share a cache file.  {cachePath : lock}
+hashCacheLocks = {}
+hashCacheLocksLock = threading.Lock()
+
+def getModificationTimeNs(fileStat):
+  try:
+    return fileStat.st_mtime_ns
+  except AttributeError: # Python 2
+    return int(fileStat.st_mtime * 1000000000)
+
+def encode(string):
+  if isinstance(string,bytes): # Python 2 str
+    return string
+  return string.encode("utf-8")
+
+def getHashOfFile(path):
   """
-  Return the SHA1 hash of the directory. Going through the files in the order returned by python's os.walk command. Return the hash as a hexidecimal string.
+  Return the SHA1 hash of the file's contents as a hexidecimal string.
+  """
+  hasher = hashlib.sha1()
+  with open(path,"rb") as fileObject:
+    while True:
+      buf = fileObject.read(65536)
+      if not buf:
+        break
+      hasher.update(buf)
+  return hasher.hexdigest()
+
+def loadHashCache(cachePath):
+  if cachePath is None or not os.path.exists(cachePath):
+    return {}
+  try:
+    with open(cachePath,"r") as cacheFile:
+      return json.load(cacheFile)
+  except ValueError:
+    return {}
+
+def saveHashCache(cachePath,cache):
+  """
+  Replace the cache file in a single step.  The cache is only an optimization, so if it cannot be written, it is not.
+  """
+  with hashCacheLocksLock:
+    lock = hashCacheLocks.setdefault(cachePath,threading.Lock())
+  with lock:
+    try:
+      os.makedirs(os.path.dirname(cachePath))
+    except OSError:
+      pass
+    temporaryCachePath = None
+    try:
+      (temporaryCacheFd,temporaryCachePath) = tempfile.mkstemp(dir=os.path.dirname(cachePath),prefix=os.path.basename(cachePath)+".tmp.")
+      with os.fdopen(temporaryCacheFd,"w") as cacheFile:
+        json.dump(cache,cacheFile)
+      os.rename(temporaryCachePath,cachePath)
+    except (IOError,OSError):
+      if temporaryCachePath is not None and os.path.exists(temporaryCachePath):
+        os.remove(temporaryCachePath)
+
+def getHashOfDirs(directory, verbose=0, dockerIgnore=None, cachePath=None, threads=8):
+  """
+  Return the SHA1 hash of the directory as a hexidecimal string.  The hash depends on the names, modes and contents of the files and directories within, but not on the order in which the file system lists them.  Returns -1 if the directory does not exist.
+
+  If a DockerIgnore object is given, files and directories which it excludes are not hashed.
+
+  If a cachePath is given, the hashes of individual files are cached in that file and files whos inode, size and modification time have not changed are not read again.  Large trees are hashed using up to ``threads`` worker threads.
 
   >>> getHashOfDirs("/home/travis/hashtest")
-  '69858e09f8b90498023c308a1700dcb842e55a0a'
+  '806d1655e041ad17a8e529344d4740eeeb57b138'
+
+  With a cache, only files which have changed since the last time are read.
+
+  >>> import os,tempfile,shutil
+  >>> import subuserlib.hashDirectory
+  >>> tempDir = tempfile.mkdtemp()
+  >>> treeDir = os.path.join(tempDir,"tree")
+  >>> os.mkdir(treeDir)
+  >>> def writeFile(name,contents,modificationTime):
+  ...   with open(os.path.join(treeDir,name),"w") as treeFile:
+  ...     _ = treeFile.write(contents)
+  ...   os.utime(os.path.join(treeDir,name),(modificationTime,modificationTime))
+  >>> for name in ["a","b","c"]:
+  ...   writeFile(name,name,1000000000)
+  >>> readFiles = []
+  >>> originalGetHashOfFile = subuserlib.hashDirectory.getHashOfFile
+  >>> def getHashOfFileAndRecordIt(path):
+  ...   readFiles.append(os.path.basename(path))
+  ...   return originalGetHashOfFile(path)
+  >>> subuserlib.hashDirectory.getHashOfFile = getHashOfFileAndRecordIt
+  >>> cachePath = os.path.join(tempDir,"cache","hashes.json")
+  >>> firstHash = getHashOfDirs(treeDir,cachePath=cachePath)
+  >>> sorted(readFiles)
+  ['a', 'b', 'c']
+  >>> readFiles[:] = []
+  >>> getHashOfDirs(treeDir,cachePath=cachePath) == firstHash
+  True
+  >>> readFiles
+  []
+  >>> writeFile("b","changed",1000000060)
+  >>> getHashOfDirs(treeDir,cachePath=cachePath) == firstHash
+  False
+  >>> readFiles
+  ['b']
+  >>> subuserlib.hashDirectory.getHashOfFile = originalGetHashOfFile
+  >>> shutil.rmtree(tempDir)
   """
-  import hashlib, os
-  SHAhash = hashlib.sha1()
-  if not os.path.exists (directory):
+  if not os.path.exists(directory):
     return -1
-
-  try:
-    for root, dirs, files in os.walk(directory):
-      for names in files:
-        if verbose == 1:
-          print('Hashing', names)
-        filepath = os.path.join(root,names)
-        try:
-          f1 = open(filepath, 'rb')
-        except:
-          # You can't open the file for some reason
-          f1.close()
-          continue
-
-        while 1:
-          # Read file in as little chunks
-          buf = f1.read(4096)
-          if not buf:
-            break
-          SHAhash.update(buf)
-        f1.close()
-
-  except:
-    import traceback
-    # Print the stack traceback
-    traceback.print_exc()
-    return -2
-
-  return SHAhash.hexdigest()
+  if dockerIgnore:
+    walk = dockerIgnore.walk
+  else:
+    walk = os.walk
+  # Gather the tree: {dirpath : [(name,path,lstat)]}
+  tree = {}
+  filesToHash = []
+  for dirpath, dirnames, filenames in walk(directory):
+    entries = []
+    for name in dirnames + filenames:
+      path = os.path.join(dirpath,name)
+      try:
+        entries.append((name,path,os.lstat(path)))
+      except OSError: # The file was removed while we were walking.
+        continue
+    for (name,path,entryStat) in entries:
+      if stat.S_ISREG(entryStat.st_mode):
+        filesToHash.append((path,entryStat))
+    tree[dirpath] = entries
+  # Hash the files, using the cache where possible.
+  oldCache = loadHashCache(cachePath)
+  newCache = {}
+  entryHashes = {}
+  uncachedFiles = []
+  for (path,fileStat) in filesToHash:
+    key = [fileStat.st_ino,fileStat.st_size,getModificationTimeNs(fileStat)]
+    if path in oldCache and oldCache[path][:3] == key:
+      entryHashes[path] = oldCache[path][3]
+      newCache[path] = oldCache[path]
+    else:
+      uncachedFiles.append((path,key))
+  def hashFile(pathAndKey):
+    (path,_) = pathAndKey
+    if verbose == 1:
+      print('Hashing', path)
+    try:
+      return getHashOfFile(path)
+    except (IOError,OSError): # You can't open the file for some reason
+      return None
+  if len(uncachedFiles) >= minimumFilesToHashInParallel and threads > 1:
+    pool = ThreadPool(threads)
+    try:
+      fileHashes = pool.map(hashFile,uncachedFiles)
+    finally:
+      pool.close()
+      pool.join()
+  else:
+    fileHashes = [hashFile(pathAndKey) for pathAndKey in uncachedFiles]
+  now = time.time()
+  for ((path,key),fileHash) in zip(uncachedFiles,fileHashes):
+    entryHashes[path] = fileHash
+    if fileHash is not None and key[2] < (now - racyModificationWindow) * 1000000000:
+      newCache[path] = key + [fileHash]
+  if cachePath is not None and not newCache == oldCache:
+    saveHashCache(cachePath,newCache)
+  # Hash the directories, deepest first, so that each directory's entries have been hashed before it is.
+  for dirpath in sorted(tree.keys(),key=lambda dirpath: dirpath.count(os.sep),reverse=True):
+    hasher = hashlib.sha1()
+    for (name,path,entryStat) in sorted(tree[dirpath]):
+      if stat.S_ISLNK(entryStat.st_mode):
+        entryHash = hashlib.sha1(encode(os.readlink(path))).hexdigest()
+      elif path in entryHashes:
+        entryHash = entryHashes[path]
+      else: # Unreadable files and special files.
+        continue
+      if entryHash is None:
+        continue
+      hasher.update(encode("%o %s\0%s\n" % (entryStat.st_mode,name,entryHash)))
+    entryHashes[dirpath] = hasher.hexdigest()
+  return entryHashes[directory]
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# This file should be compatible with both Python 2 and 3.
+# If it is not, please file a bug report.
+
+"""
+Old images are kept so that subusers can be rolled back or locked to previous versions.  The retention policy limits how many of them are kept, and how much disk space they may use.  It is configured in ``config.json``:
+
+ - ``image-generations-to-keep``: The number of most recently installed images which are always kept for each image source.  Older images which no subuser uses are removed.
+ - ``image-store-budget``: The amount of disk space, such as ``"20G"``, which installed and run-ready images may use.  When the budget is exceeded, the images which no subuser uses are removed, least recently used first, until it is met again.
+
+Both settings are ``null`` by default, in which case nothing is removed automatically.
+
+>>> import os,json,shutil,tempfile
+>>> import subuserlib.classes.user,subuserlib.imageRetention
+>>> from subuserlib.classes.installedImage import InstalledImage
+>>> user = subuserlib.classes.user.User()
+>>> temporaryDir = tempfile.mkdtemp()
+>>> user.getConfig()["runtime-cache"] = os.path.join(temporaryDir,"runtime-cache")
+>>> daemon = user.getDockerDaemon()
+>>> daemon.imagesPath = os.path.join(temporaryDir,"images.json")
+>>> def addImage(imageId,parentImageId,size):
+...   parentSize = daemon.images[parentImageId].get("Size",0) if parentImageId else 0
+...   daemon.images[imageId] = {"Parent":parentImageId,"Created":"0","Size":parentSize+size}
+>>> def install(imageId,size,creationTime):
+...   addImage(imageId,"",size)
+...   user.getInstalledImages()[imageId] = InstalledImage(user,imageId,"app","9","0",lineagePosition=0,creationTime=creationTime)
+>>> def addRunReadyImage(installedImageId,runReadyImageId,size,lastUsed,runtimeCacheFilePath=None):
+...   addImage(runReadyImageId,installedImageId,size)
+...   if runtimeCacheFilePath is None:
+...     runtimeCacheFilePath = os.path.join(user.getConfig()["runtime-cache"],installedImageId,runReadyImageId+".json")
+...   if not os.path.exists(os.path.dirname(runtimeCacheFilePath)):
+...     os.makedirs(os.path.dirname(runtimeCacheFilePath))
+...   with open(runtimeCacheFilePath,"w") as runtimeCacheFile:
+...     json.dump({"run-ready-image-id":runReadyImageId,"last-used":lastUsed},runtimeCacheFile)
+
+Three generations of an image which no subuser uses any more.  The oldest one was run most recently.
+
+>>> install("app1",100,creationTime=1)
+>>> install("app2",200,creationTime=2)
+>>> install("app3",300,creationTime=3)
+>>> addRunReadyImage("app1","ready1",10,lastUsed=500)
+
+The subuser ``foo`` uses a run-ready image with its current permissions.  The one which it used with its old permissions is no longer needed.
+
+>>> foo = user.getRegistry().getSubusers()["foo"]
+>>> addRunReadyImage(foo.getImageId(),"ready-foo",5,lastUsed=600,runtimeCacheFilePath=foo.getRuntimeCache().getPathToRuntimeCacheFile())
+>>> addRunReadyImage(foo.getImageId(),"ready-foo-old",7,lastUsed=400)
+
+Shared parent layers are only counted once.
+
+>>> subuserlib.imageRetention.getStoreSize(user)
+622
+
+With ``image-generations-to-keep``, only the newest generations of each image source are kept.
+
+>>> sorted([str(imageId) for imageId in subuserlib.imageRetention.planEviction(user,generationsToKeep=1)])
+['app1', 'app2', 'ready1']
+
+With an ``image-store-budget``, the images which were used least recently are removed first, until the budget is met.
+
+>>> sorted([str(imageId) for imageId in subuserlib.imageRetention.planEviction(user,budget=622-250)])
+['app2', 'app3']
+
+A run-ready image which is still in use is never removed, even if the budget cannot be met.
+
+>>> sorted([str(imageId) for imageId in subuserlib.imageRetention.planEviction(user,budget=0)])
+['app1', 'app2', 'app3', 'ready-foo-old', 'ready1']
+
+``enforceRetentionPolicy`` removes the images.
+
+>>> user.getConfig()["image-generations-to-keep"] = 1
+>>> subuserlib.imageRetention.enforceRetentionPolicy(user)
+Evicting image ready1 : run-ready image for app1 (10 B)
+Evicting image app2 : app@9 (200 B)
+Evicting image app1 : app@9 (100 B)
+Reclaimed 310 B.
+>>> sorted([imageId for imageId in user.getInstalledImages().keys() if imageId.startswith("app")])
+['app3']
+>>> shutil.rmtree(temporaryDir)
+"""
+
+#external imports
+import re
+#internal imports
+import subuserlib.removeOldImages
+from subuserlib.classes.docker.imageInventory import normalizeImageId
+
+def parseSize(size):
+  """
+  Parse a size given either as a number of bytes or as a string with a K, M, G or T suffix.
+
+  >>> import subuserlib.imageRetention
+  >>> subuserlib.imageRetention.parseSize("1.5G")
+  1610612736
+  >>> subuserlib.imageRetention.parseSize(4096)
+  4096
+  """
+  if isinstance(size,(int,float)):
+    return int(size)
+  match = re.match(r"^\s*([0-9.]+)\s*([KMGT]?)B?\s*$",size,re.IGNORECASE)
+  if not match:
+    raise ValueError("Invalid size: "+size)
+  return int(float(match.group(1)) * 1024 ** "BKMGT".index(match.group(2).upper() or "B"))
+
+def getProtectedImageIds(user,generationsToKeep):
+  """
+  Returns the set of Ids of the ``generationsToKeep`` most recently installed images of each image source.
+  """
+  protectedImageIds = set()
+  sources = set([(installedImage.getSourceRepoId(),installedImage.getImageSourceName()) for installedImage in user.getInstalledImages().values()])
+  for (sourceRepoId,imageSourceName) in sources:
+    generations = user.getInstalledImages().getInstalledImagesBySource(sourceRepoId,imageSourceName)
+    for installedImage in generations[max(0,len(generations)-generationsToKeep):]:
+      protectedImageIds.add(installedImage.getImageId())
+  return protectedImageIds
+
+def getDescendants(garbage,imageId):
+  """
+  Returns the Ids of the image and of all of its descendants which are also garbage.
+  """
+  children = {}
+  for image in garbage.values():
+    if image.parentImageId:
+      children.setdefault(image.parentImageId,[]).append(image.imageId)
+  descendants = []
+  toVisit = [imageId]
+  while toVisit:
+    imageId = toVisit.pop()
+    descendants.append(imageId)
+    toVisit += children.get(imageId,[])
+  return descendants
+
+def getStoreSize(user):
+  """
+  Returns the number of bytes used by installed and run-ready images, including the layers which they are built on.  Each layer is counted once, no matter how many images share it.
+  """
+  imageIds = set(user.getInstalledImages().keys())
+  for (_,_,runReadyImageId,_) in subuserlib.removeOldImages.getRunReadyImages(user):
+    if runReadyImageId:
+      imageIds.add(runReadyImageId)
+  layerIds = set()
+  for imageId in imageIds:
+    lineage = user.getImageInventory().getImageLineage(imageId)
+    if lineage:
+      layerIds.update([normalizeImageId(layerId) for layerId in lineage])
+  return sum([subuserlib.removeOldImages.getImageSize(user,layerId) for layerId in layerIds])
+
+def planEviction(user,generationsToKeep=None,budget=None):
+  """
+  Returns a dictionary ``{imageId : Garbage}`` of the images which the retention policy would remove.
+  """
+  garbage = subuserlib.removeOldImages.findGarbage(user)
+  if generationsToKeep is None:
+    protectedImageIds = set()
+  else:
+    protectedImageIds = getProtectedImageIds(user,generationsToKeep)
+  evictable = {} # {imageId : [imageIds that must be removed along with it]}
+  for imageId in garbage:
+    descendants = getDescendants(garbage,imageId)
+    if not [descendant for descendant in descendants if descendant in protectedImageIds]:
+      evictable[imageId] = descendants
+  toEvict = {}
+  if generationsToKeep is not None:
+    for imageId,descendants in evictable.items():
+      if garbage[imageId].installedImage is not None:
+        for descendant in descendants:
+          toEvict[descendant] = garbage[descendant]
+  if budget is not None:
+    storeSize = getStoreSize(user) - sum([image.size for image in toEvict.values()])
+    def getLastUsed(imageId):
+      image = garbage[imageId]
+      if image.lastUsed is None and image.installedImage is not None:
+        return image.installedImage.getCreationTime()
+      return image.lastUsed or 0
+    for imageId in sorted(evictable.keys(),key=getLastUsed):
+      if storeSize <= budget:
+        break
+      for descendant in evictable[imageId]:
+        if not descendant in toEvict:
+          toEvict[descendant] = garbage[descendant]
+          storeSize -= garbage[descendant].size
+  return toEvict
+
+def enforceRetentionPolicy(user):
+  """
+  Remove images according to the retention policy configured in ``config.json``.
+  """
+  generationsToKeep = user.getConfig().get("image-generations-to-keep")
+  budget = user.getConfig().get("image-store-budget")
+  if generationsToKeep is None and budget is None:
+    return
+  if budget is not None:
+    budget = parseSize(budget)
+  toEvict = planEviction(user,generationsToKeep,budget)
+  if not toEvict:
+    return
+  waves = subuserlib.removeOldImages.orderGarbage(toEvict)
+  for wave in waves:
+    for image in wave:
+      user.getRegistry().log("Evicting image "+image.imageId+" : "+image.description+" ("+subuserlib.removeOldImages.formatSize(image.size)+")")
+  bytesReclaimed = subuserlib.removeOldImages.sweep(user,waves)
+  user.getRegistry().log("Reclaimed "+subuserlib.removeOldImages.formatSize(bytesReclaimed)+".")
+  user.getInstalledImages().unregisterNonExistantImages()
@@ -6,12 +6,17 @@ Implements functions involved in building/installing/updating subuser images.
 """
 
 #external imports
-import sys,os,stat,io
+import sys,os,stat,io,time,threading,collections
+from multiprocessing.pool import ThreadPool
 #internal imports
 import subuserlib.classes.installedImage
+import subuserlib.classes.docker.dockerDaemon as dockerDaemon
 import subuserlib.installedImages
 import subuserlib.verify
 
+# The number of check-for-updates scripts which are run at the same time, unless more jobs are asked for.
+maxConcurrentUpdateChecks = 8
+
 def cleanUpAndExitOnError(user,error):
   user.getRegistry().log(str(error))
   user.getRegistry().log("Cleaning up.")
@@ -24,9 +29,19 @@ def installImage(imageSource, useCache=False,parent=None):
   Return the Id of the newly installedImage.
   """
   imageSource.getUser().getRegistry().logChange("Installing "+imageSource.getName()+" ...")
-  imageId = imageSource.build(parent)
-  imageSource.getUser().getInstalledImages()[imageId] = subuserlib.classes.installedImage.InstalledImage(imageSource.getUser(),imageId,imageSource.getName(),imageSource.getRepository().getName(),imageSource.getHash())
-  imageSource.getUser().getInstalledImages().save()
+  (imageId,hasCheckForUpdatesScript) = imageSource.build(parent)
+  imageSource.getUser().getImageInventory().markStale()
+  creationTime = subuserlib.classes.installedImage.getImageCreationTime(imageSource.getUser(),imageId)
+  installedImages = imageSource.getUser().getInstalledImages()
+  with installedImages.getLock():
+    if parent is None:
+      lineagePosition = 0
+    elif parent in installedImages and not installedImages[parent].getLineagePosition() is None:
+      lineagePosition = installedImages[parent].getLineagePosition() + 1
+    else:
+      lineagePosition = None
+    installedImages[imageId] = subuserlib.classes.installedImage.InstalledImage(imageSource.getUser(),imageId,imageSource.getName(),imageSource.getRepository().getName(),imageSource.getHash(),hasCheckForUpdatesScript=hasCheckForUpdatesScript,parentImageId=parent,lineagePosition=lineagePosition,creationTime=creationTime)
+    installedImages.save()
   return imageId
 
 def getImageSourceLineage(imageSource):
@@ -46,6 +61,9 @@ def doImagesMatch(installedImage,imageSource):
   return installedImage.getImageSourceName() == imageSource.getName() and installedImage.getSourceRepoId() == imageSource.getRepository().getName()
 
 def doImageSourceHashesMatch(installedImage,imageSource):
+  """
+  Has the image source changed since the installed image was built from it?  Works with both git tree ids and directory hashes, as returned by ``ImageSource.getHash``.
+  """
   return installedImage.getImageSourceHash() == imageSource.getHash()
 
 def compareSourceLineageAndInstalledImageLineage(user,sourceLineage,installedImageLineage):
@@ -67,51 +85,188 @@ def compareSourceLineageAndInstalledImageLineage(user,sourceLineage,installedIma
       if not imagesMatch:
         user.getRegistry().log("Dependency changed for image from "+installedImage.getImageSourceName()+"@"+installedImage.getSourceRepoId()+" to "+imageSource.getName()+"@"+imageSource.getRepository().getName())
       elif not imageSourceHashesMatch:
-        user.getRegistry().log("Installed image "+installedImage.getImageSourceName()+"@"+installedImage.getSourceRepoId()+" is out of date.\nCurrently installed from image source:\n "+installedImage.getImageSourceHash()+"\nCurrent version:\n "+str(imageSource.getPermissions()["last-update-time"])+"\n")
+        user.getRegistry().log("Installed image "+installedImage.getImageSourceName()+"@"+installedImage.getSourceRepoId()+" is out of date.\nCurrently installed from image source:\n "+installedImage.getImageSourceHash()+"\nCurrent version:\n "+str(imageSource.getHash())+"\n")
       return False
   return True
 
-def isInstalledImageUpToDate(installedImage,checkForUpdatesExternally=False):
+def isInstalledImageUpToDate(installedImage,checkForUpdatesExternally=False,updateCheckTTL=0):
   """
   Returns True if the installed image(including all of its dependencies, is up to date.  False otherwise.
+
+  The result of an earlier external check for updates is reused if it is less than ``updateCheckTTL`` seconds old.
   """
   try:
     topImageSource = installedImage.getUser().getRegistry().getRepositories()[installedImage.getSourceRepoId()][installedImage.getImageSourceName()]
   except KeyError: # Image source not found, therefore updating would be pointless.
     return True
   # Check for updates to image sources
-  sourceLineage = getImageSourceLineage(topImageSource)
+  sourceLineage = list(getImageSourceLineage(topImageSource))
   installedImageLineage = subuserlib.installedImages.getImageLineage(installedImage.getUser(),installedImage.getImageId())
   if not compareSourceLineageAndInstalledImageLineage(installedImage.getUser(),sourceLineage,installedImageLineage):
     return False
   # Check for updates externally using the images' built in check-for-updates script.
   if checkForUpdatesExternally:
-    if installedImage.checkForUpdates():
+    if installedImage.checkForUpdates(updateCheckTTL=updateCheckTTL):
       return False
   return True
 
-def ensureSubuserImageIsInstalledAndUpToDate(subuser, useCache=False, checkForUpdatesExternally=False):
+def getImageSourceKey(imageSource):
+  return (imageSource.getRepository().getName(),imageSource.getName())
+
+def ensureImageIsInstalledAndUpToDate(imageSource,parentImageId,parentRebuilt,checkForUpdatesExternally=False,updateCheckTTL=0):
+  """
+  Ensure that there is an up to date image installed for the given ImageSource, whos parent is the image with the id ``parentImageId``.  If the parent image was just rebuilt, the image is rebuilt as well.
+  Returns a tuple ``(imageId,rebuilt)``.
+  """
+  if not parentRebuilt:
+    latestInstalledImage = imageSource.getLatestInstalledImage()
+    if latestInstalledImage and isInstalledImageUpToDate(latestInstalledImage,checkForUpdatesExternally=checkForUpdatesExternally,updateCheckTTL=updateCheckTTL):
+      return (latestInstalledImage.getImageId(),False)
+  startTime = time.time()
+  imageId = installImage(imageSource,parent=parentImageId)
+  imageSource.getUser().getRegistry().log("Built "+imageSource.getIdentifier()+" in %.1f seconds." % (time.time()-startTime),verbosityLevel=3)
+  return (imageId,True)
+
+def ensureSubuserImagesAreInstalledAndUpToDate(user,subusers,checkForUpdatesExternally=False,jobs=1,switchSubusers=True,updateCheckTTL=0):
+  """
+  Ensure that the Docker images associated with the given subusers are installed and up to date.
+  If an image is not installed, or it or one of its dependencies is out of date, build it again.
+
+  The lineages of the subusers are merged, so that each image which several subusers depend on is checked and built only once.  If ``jobs`` is greater than one, up to that many independent branches of the resulting tree of images are built at the same time.  When an image fails to build, the images which depend on it are not built, but other branches are unaffected.
+
+  If switchSubusers is False, the images are built and registered as installed, but the subusers are left using their old images.
+
+  If an image was checked for updates less than ``updateCheckTTL`` seconds ago, the result of that check is used instead of running its check-for-updates script again.
+
+  Returns an ordered dictionary which maps the names of the subusers whos images failed to build to the ImageBuildException which caused the failure.
   """
-  Ensure that the Docker image associated with the subuser is installed and up to date.
-  If the image is already installed, but is out of date, or it's dependencies are out of date, build it again.
-  Otherwise, do nothing.
+  results = {} # {imageSourceKey : (imageId,rebuilt) or ImageBuildException}
+  lineages = collections.OrderedDict()
+  if jobs > 1 or checkForUpdatesExternally:
+    for subuser in subusers:
+      if jobs > 1:
+        user.getRegistry().log("Checking if subuser "+subuser.getName()+" is up to date.")
+      lineages[subuser.getName()] = list(getImageSourceLineage(subuser.getImageSource()))
+    if checkForUpdatesExternally:
+      runUpdateChecks([imageSource for sourceLineage in lineages.values() for imageSource in sourceLineage],jobs=jobs,updateCheckTTL=updateCheckTTL)
+    if jobs > 1:
+      buildImageTree(user,list(lineages.values()),results,checkForUpdatesExternally,jobs,updateCheckTTL)
+  subusersWhosImagesFailedToBuild = collections.OrderedDict()
+  for subuser in subusers:
+    if jobs > 1:
+      sourceLineage = lineages[subuser.getName()]
+    else: # Go through the subusers one at a time, as if the sourceLineage where a todo list of dependencies to fulfill.
+      user.getRegistry().log("Checking if subuser "+subuser.getName()+" is up to date.")
+      if subuser.getName() in lineages:
+        sourceLineage = lineages[subuser.getName()]
+      else:
+        sourceLineage = list(getImageSourceLineage(subuser.getImageSource()))
+      buildImageTree(user,[sourceLineage],results,checkForUpdatesExternally,jobs,updateCheckTTL)
+    result = (None,False)
+    for imageSource in sourceLineage:
+      result = results[getImageSourceKey(imageSource)]
+      if isinstance(result,dockerDaemon.ImageBuildException):
+        break
+    if isinstance(result,dockerDaemon.ImageBuildException):
+      subusersWhosImagesFailedToBuild[subuser.getName()] = result
+      continue
+    (imageId,_) = result
+    if switchSubusers and not subuser.getImageId() == imageId:
+      subuser.setImageId(imageId)
+      user.getRegistry().logChange("Installed new image <"+subuser.getImageId()+"> for subuser "+subuser.getName())
+  return subusersWhosImagesFailedToBuild
+
+def runUpdateChecks(imageSources,jobs=1,updateCheckTTL=0):
+  """
+  Run the check-for-updates scripts of the latest installed images of the given ImageSources ahead of time, up to ``jobs`` at once, or ``maxConcurrentUpdateChecks`` if fewer jobs are asked for.  The scripts mostly wait on the network, so they are run concurrently even when images are built one at a time.  Each distinct image is checked once.  The results are reported when the images are checked with ``InstalledImage.checkForUpdates``, in the order in which the images are examined.
   """
-  subuser.getUser().getRegistry().log("Checking if subuser "+subuser.getName()+" is up to date.")
-  # get dependency list as a list of ImageSources
-  sourceLineage = getImageSourceLineage(subuser.getImageSource())
-  # We go through the sourceLineage as if it where a todo list of dependencies to fulfill
-  aDependencyChangedReinstallEverythingFromNowOn = False
-  previousImageId = None
-  for imageSource in sourceLineage:
+  installedImages = collections.OrderedDict()
+  for imageSource in imageSources:
     latestInstalledImage = imageSource.getLatestInstalledImage()
-    if not aDependencyChangedReinstallEverythingFromNowOn:
-      if latestInstalledImage and isInstalledImageUpToDate(latestInstalledImage,checkForUpdatesExternally=checkForUpdatesExternally):
-        previousImageId = latestInstalledImage.getImageId()
-        continue
+    if latestInstalledImage:
+      installedImages[latestInstalledImage.getImageId()] = latestInstalledImage
+  if not installedImages:
+    return
+  pool = ThreadPool(min(len(installedImages),max(jobs,maxConcurrentUpdateChecks)))
+  try:
+    pool.map(lambda installedImage: installedImage.runUpdateCheck(updateCheckTTL=updateCheckTTL),list(installedImages.values()))
+  finally:
+    pool.close()
+    pool.join()
+
+def buildImageTree(user,sourceLineages,results,checkForUpdatesExternally,jobs,updateCheckTTL=0):
+  """
+  Ensure that the images for the given lineages of ImageSources are installed and up to date, storing the result for each ImageSource in the results dictionary.  ImageSources which already have a result are skipped.
+
+  Each ImageSource has at most one dependency, so the merged lineages form a tree.  An image is built as soon as its parent is ready, using up to ``jobs`` worker threads.
+  """
+  # Merge the lineages into a tree.
+  children = collections.OrderedDict() # {parentKey : [imageSource]}
+  imageSources = {}
+  for sourceLineage in sourceLineages:
+    parentKey = None
+    for imageSource in sourceLineage:
+      key = getImageSourceKey(imageSource)
+      if not key in imageSources:
+        imageSources[key] = imageSource
+        children.setdefault(parentKey,[]).append(imageSource)
+      parentKey = key
+  def buildNode(imageSource,parentResult):
+    (parentImageId,parentRebuilt) = parentResult
+    try:
+      return ensureImageIsInstalledAndUpToDate(imageSource,parentImageId,parentRebuilt,checkForUpdatesExternally=checkForUpdatesExternally,updateCheckTTL=updateCheckTTL)
+    except dockerDaemon.ImageBuildException as e:
+      user.getRegistry().log(str(e))
+      return e
+  # Images which have already been dealt with are not rebuilt, but their children may still need to be.
+  ready = collections.deque()
+  def addChildren(parentKey):
+    for imageSource in children.get(parentKey,[]):
+      key = getImageSourceKey(imageSource)
+      parentResult = results[parentKey] if parentKey else (None,False)
+      if isinstance(parentResult,dockerDaemon.ImageBuildException):
+        results[key] = parentResult
+        addChildren(key)
+      elif key in results:
+        addChildren(key)
       else:
-        aDependencyChangedReinstallEverythingFromNowOn = True
-    assert aDependencyChangedReinstallEverythingFromNowOn
-    previousImageId = installImage(imageSource,parent=previousImageId)
-  if not subuser.getImageId() == previousImageId:
-    subuser.setImageId(previousImageId)
-    subuser.getUser().getRegistry().logChange("Installed new image <"+subuser.getImageId()+"> for subuser "+subuser.getName())
+        ready.append((imageSource,parentResult))
+  addChildren(None)
+  if jobs <= 1:
+    while ready:
+      (imageSource,parentResult) = ready.popleft()
+      key = getImageSourceKey(imageSource)
+      results[key] = buildNode(imageSource,parentResult)
+      addChildren(key)
+    return
+  condition = threading.Condition()
+  state = {"running":0,"errors":[]}
+  def runNode(imageSource,parentResult):
+    try:
+      result = buildNode(imageSource,parentResult)
+    except Exception as e: # Unexpected errors are re-raised in the main thread.
+      result = e
+    with condition:
+      state["running"] -= 1
+      key = getImageSourceKey(imageSource)
+      if isinstance(result,(tuple,dockerDaemon.ImageBuildException)):
+        results[key] = result
+        addChildren(key)
+      else:
+        state["errors"].append(result)
+      condition.notify()
+  pool = ThreadPool(jobs)
+  try:
+    with condition:
+      while (ready or state["running"]) and not state["errors"]:
+        while ready:
+          (imageSource,parentResult) = ready.popleft()
+          state["running"] += 1
+          pool.apply_async(runNode,(imageSource,parentResult))
+        if state["running"]:
+          condition.wait()
+  finally:
+    pool.close()
+    pool.join()
+  if state["errors"]:
+    raise state["errors"][0]
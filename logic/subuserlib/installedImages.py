@@ -16,23 +16,43 @@ def getImageLineageInLayers(user,imageId):
   Return the list(lineage) of id of Docker image layers which goes from a base image to this image including all of the image's ancestors in order of dependency.
   If imageId is None or is not installed, return [].
   """
-  imageProperties = user.getDockerDaemon().getImageProperties(imageId)
-  if imageProperties == None:
+  if imageId is None:
     return []
-    #sys.exit("Failed to get properties of image "+imageId)
-  if not imageProperties["Parent"] == "":
-    return getImageLineageInLayers(user,imageProperties["Parent"]) + [imageId]
-  else:
-    return [imageId]
+  lineage = user.getImageInventory().getImageLineage(imageId)
+  if lineage is None:
+    return user.getDockerDaemon().getImageLineage(imageId)
+  return lineage
 
 def getImageLineage(user,imageId):
   """
   Return the list(lineage) of InstalledImages which goes from a base image to this image including all of the image's ancestors in order of dependency.
   If imageId is None, return [].
+
+  Lineages are remembered by the user's InstalledImages, so that the garbage collector can look up the lineage of every image without mapping Docker image layers to installed images over and over again.
   """
   if imageId == None:
     return []
+  installedImages = user.getInstalledImages()
+  with installedImages.getLock():
+    (knownLineage,generation) = installedImages.getKnownImageLineage(imageId)
+    if not knownLineage is None:
+      return [installedImages[installedImageId] for installedImageId in knownLineage]
+  lineage = getUncachedImageLineage(user,imageId)
+  installedImages.rememberImageLineage(imageId,[installedImage.getImageId() for installedImage in lineage],generation)
+  return lineage
 
+def getUncachedImageLineage(user,imageId):
+  # Follow the parentage recorded when the images were installed.
+  installedImages = user.getInstalledImages()
+  lineage = []
+  currentImageId = imageId
+  while currentImageId in installedImages and not installedImages[currentImageId].getLineagePosition() is None:
+    installedImage = installedImages[currentImageId]
+    lineage.insert(0,installedImage)
+    if installedImage.getLineagePosition() == 0:
+      return lineage
+    currentImageId = installedImage.getParentImageId()
+  # Fall back to asking the Docker daemon.
   lineage = []
   dockerImageLayers = getImageLineageInLayers(user,imageId)
   for dockerImageLayer in dockerImageLayers:
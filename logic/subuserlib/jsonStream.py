@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# This file should be compatible with both Python 2 and 3.
+# If it is not, please file a bug report.
+
+"""
+Incremental decoding of streams of concatenated JSON objects, such as the progress output of the Docker daemon.
+"""
+
+#external imports
+import json,codecs,re
+#internal imports
+#import ...
+
+whitespace = re.compile(r"\s*")
+
+def readJsonStream(fileObject,blockSize=65536):
+  """
+  A generator which reads a stream of JSON objects from the given file like object in blocks of ``blockSize`` bytes and yields each object as soon as it has been read in full.
+
+  The objects may be separated by whitespace(Docker separates them with newlines) or not separated at all.  Only the part of the stream which has not yet been decoded is held in memory.  Raises a ValueError if the stream ends with data that cannot be decoded.
+
+  >>> import io,subuserlib.jsonStream
+  >>> stream = io.BytesIO(b'{"stream":"Step 0"}\\r\\n{"stream":"Step 1 \\xc3\\xa9"}{"status":"Done"}\\n')
+  >>> [message for message in subuserlib.jsonStream.readJsonStream(stream,blockSize=3)] == [{"stream":"Step 0"},{"stream":u"Step 1 \\xe9"},{"status":"Done"}]
+  True
+  >>> list(subuserlib.jsonStream.readJsonStream(io.BytesIO(b'{"stream":"Step 0"} Not JSON')))
+  Traceback (most recent call last):
+  ...
+  ValueError: Unexpected data at end of JSON stream: Not JSON
+  """
+  decoder = json.JSONDecoder()
+  utf8Decoder = codecs.getincrementaldecoder("utf-8")()
+  undecoded = ""
+  endOfStream = False
+  while not endOfStream:
+    block = fileObject.read(blockSize)
+    if block:
+      undecoded += utf8Decoder.decode(block)
+    else:
+      undecoded += utf8Decoder.decode(b"",True)
+      endOfStream = True
+    position = 0
+    while True:
+      position = whitespace.match(undecoded,position).end()
+      if position == len(undecoded):
+        break
+      try:
+        (message,position) = decoder.raw_decode(undecoded,position)
+      except ValueError:
+        if endOfStream:
+          raise ValueError("Unexpected data at end of JSON stream: "+undecoded[position:])
+        break
+      yield message
+    undecoded = undecoded[position:]
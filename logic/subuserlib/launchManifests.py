@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# This file should be compatible with both Python 2 and 3.
+# If it is not, please file a bug report.
+
+"""
+Launch manifests let ``subuser run`` start a subuser without loading the registry, the repositories or the subuser's permissions.
+
+Each time that the configuration is verified, a manifest is compiled for each subuser(see ``subuserlib.verify.compileLaunchManifests``).  It holds the Id of the subuser's run-ready image and the docker run flags which follow from its permissions.  Flags which depend on the environment at launch time, such as environment variables, the working directory and devices, are recorded in the form which ``expandFlags`` fills in.
+
+Subusers with the gui permission are started through the X11 bridge and get no manifest.
+
+Manifests are stored in ``~/.subuser/launch-manifests``, next to the user's ``config.json``, so that they can be found without loading the config.  This module only imports the parts of subuserlib which talk to the Docker daemon and expand flags.  It must not import the user, registry, repository or permissions classes, which take longer to load than launching from a manifest does.
+"""
+
+#external imports
+import sys,os,json
+#internal imports
+import subuserlib.dockerRun
+import subuserlib.warmPool
+import subuserlib.paths
+from subuserlib.classes.subuserSubmodules.run.runtime import expandFlags,setupUserdirsSymlink
+from subuserlib.classes.subuserSubmodules.run.runtimeCache import recordLastUsed
+
+def getLaunchManifestsDir(homeDir):
+  return os.path.join(homeDir,".subuser","launch-manifests")
+
+def loadLaunchManifest(subuserName,homeDir=None):
+  """
+  Returns the subuser's launch manifest, or None if it has none or if its run-ready image has since been removed.
+  """
+  if homeDir is None:
+    homeDir = subuserlib.paths.getHomeDir()
+  try:
+    with open(os.path.join(getLaunchManifestsDir(homeDir),subuserName+".json"),"r") as manifestFile:
+      manifest = json.load(manifestFile)
+  except (IOError,OSError,ValueError):
+    return None
+  if not os.path.exists(manifest["runtime-cache"]):
+    return None
+  return manifest
+
+def getCommand(manifest,args,environment):
+  """
+  Returns the docker command which launches the subuser described by the manifest.
+
+  >>> import subuserlib.launchManifests
+  >>> manifest = {"run-ready-image-id":"3","executable":"/usr/bin/foo","flags":["--rm","-i","-t",{"pass-env":"LANG"},"--net=none"]}
+  >>> subuserlib.launchManifests.getCommand(manifest,["--help"],{"LANG":"C"})
+  ['run', '--rm', '-i', '-t', '-e', 'LANG=C', '--net=none', '--entrypoint', '/usr/bin/foo', '3', '--help']
+  """
+  return ["run"]+expandFlags(manifest["flags"],environment)+["--entrypoint",manifest["executable"],manifest["run-ready-image-id"]]+args
+
+def launch(manifest,args,environment):
+  """
+  Run the subuser described by the manifest and exit with its exit code.
+
+  If the run-ready image has been removed behind subuser's back, return without running anything, so that the subuser can be launched the slow way.
+  """
+  if manifest["userdirs-symlink-home"]:
+    setupUserdirsSymlink(manifest["userdirs-symlink-home"])
+  command = getCommand(manifest,args,environment)
+  recordLastUsed(manifest["runtime-cache"])
+  connectionPool = subuserlib.dockerRun.getConnectionPool()
+  warmPool = None
+  if manifest.get("warm-instances"):
+    warmPool = subuserlib.warmPool.WarmPool(connectionPool,manifest["warm-pool"],manifest["warm-instances"])
+  try:
+    sys.exit(subuserlib.dockerRun.runInteractively(connectionPool,command[1:],warmPool=warmPool))
+  except subuserlib.dockerRun.ImageDoesNotExistException:
+    return
+  except subuserlib.dockerRun.ContainerRunException as e:
+    sys.exit(str(e))
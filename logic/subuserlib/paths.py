@@ -13,6 +13,10 @@ import subuserlib.basicPaths
 
 home = subuserlib.basicPaths.home
 
+def getHomeDir():
+  """ Get the home dir of the user who is running subuser. """
+  return subuserlib.basicPaths.getHomeDir()
+
 def getSubuserDir():
   """ Get the toplevel directory for subuser. """
   return subuserlib.basicPaths.getSubuserDir()
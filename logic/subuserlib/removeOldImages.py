@@ -2,47 +2,282 @@
 # This file should be compatible with both Python 2 and 3.
 # If it is not, please file a bug report.
 
-import pathConfig
+"""
+A mark and sweep garbage collector for installed images and the run-ready images which are built on top of them.
+
+The mark phase finds every image that is still needed.  The sweep phase removes the rest, children before their parents, with several deletions in flight at once.
+"""
+
 #external imports
-#import
+import os,json
+from multiprocessing.pool import ThreadPool
 #internal imports
-import subuserlib.verify,subuserlib.install
+import subuserlib.verify,subuserlib.install,subuserlib.installedImages
+import subuserlib.classes.subuser
+import subuserlib.classes.docker.dockerDaemon as dockerDaemon
+
+maxConcurrentImageDeletions = 4
 
-def getInstalledImagesThatAreInUse(user):
+def formatSize(numberOfBytes):
   """
-  Returns a dictionary of currently installed images that are currently used by a subsuser directly, or indirectly (as a dependency of another image).
+  >>> import subuserlib.removeOldImages
+  >>> subuserlib.removeOldImages.formatSize(1536)
+  '1.5 KB'
+  """
+  for unit in ["B","KB","MB","GB"]:
+    if numberOfBytes < 1024 or unit == "GB":
+      break
+    numberOfBytes /= 1024.0
+  if unit == "B":
+    return "%d B" % numberOfBytes
+  return "%.1f %s" % (numberOfBytes,unit)
 
-  Returns {imageId(string) : InstalledImage}
+class Garbage():
+  """
+  An image which the garbage collector intends to remove.  installedImage is set for installed images and runtimeCacheFilePath for run-ready images.  parentImageId is the Id of the image's parent, if that too is to be removed.  lastUsed is the unix time at which the image was last run, or None if that is not known.
+  """
+  def __init__(self,imageId,description,size,parentImageId=None,runtimeCacheFilePath=None,installedImage=None,lastUsed=None):
+    self.imageId = imageId
+    self.description = description
+    self.size = size
+    self.parentImageId = parentImageId
+    self.runtimeCacheFilePath = runtimeCacheFilePath
+    self.installedImage = installedImage
+    self.lastUsed = lastUsed
+
+def getSubusersRuntimeCacheFilePath(user,subuser):
+  """
+  Returns the path to the runtime cache file which the subuser uses with its current permissions, or None if it doesn't have one.
+  """
+  try:
+    return subuser.getRuntimeCache().getPathToRuntimeCacheFile()
+  except subuserlib.classes.subuser.SubuserHasNoPermissionsException:
+    return None
+
+def getRunReadyImages(user):
+  """
+  Returns a list of tuples ``(installedImageId,runtimeCacheFilePath,runReadyImageId,lastUsed)`` for every run-ready image in the runtime cache.  lastUsed is the unix time at which a subuser was last run from the image, or None.
   """
-  installedImagesThatAreInUse = {} # {imageId : installedImage}
-  for _,subuser in user.getRegistry().getSubusers().items():
+  runReadyImages = []
+  runtimeCacheDir = user.getConfig()["runtime-cache"]
+  try:
+    installedImageIds = os.listdir(runtimeCacheDir)
+  except OSError:
+    return []
+  for installedImageId in installedImageIds:
+    try:
+      runtimeCacheFileNames = os.listdir(os.path.join(runtimeCacheDir,installedImageId))
+    except OSError:
+      continue
+    for runtimeCacheFileName in runtimeCacheFileNames:
+      runtimeCacheFilePath = os.path.join(runtimeCacheDir,installedImageId,runtimeCacheFileName)
+      try:
+        with open(runtimeCacheFilePath,"r") as runtimeCacheFile:
+          runtimeCache = json.load(runtimeCacheFile)
+      except (IOError,OSError,ValueError):
+        continue
+      runReadyImages.append((installedImageId,runtimeCacheFilePath,runtimeCache.get("run-ready-image-id"),runtimeCache.get("last-used")))
+  return runReadyImages
+
+def isSelected(installedImage,sourceRepoId,imageSourceName):
+  """
+  If a sourceRepoId or imageSourceName have been specified, only images from that repo/source are collected.
+  """
+  if sourceRepoId and not installedImage.getSourceRepoId() == sourceRepoId:
+    return False
+  if imageSourceName and not installedImage.getImageSourceName() == imageSourceName:
+    return False
+  return True
+
+def mark(user,sourceRepoId=None,imageSourceName=None):
+  """
+  Return a tuple ``(liveInstalledImageIds,liveRuntimeCacheFilePaths)``.
+
+  The installed images which are used, directly or as a dependency of another image, by a subuser(including locked subusers and service subusers), are live.  So are the images that the selection excludes along with their ancestors.  A run-ready image is live if a subuser uses it with its current permissions.
+  """
+  subusers = user.getRegistry().getSubusers()
+  roots = []
+  liveRuntimeCacheFilePaths = set()
+  for _,subuser in subusers.items():
+    for serviceSubuserName in subuser.getServiceSubuserNames():
+      if serviceSubuserName in subusers:
+        roots.append(subusers[serviceSubuserName])
+    roots.append(subuser)
+  rootImageIds = []
+  for subuser in roots:
     if subuser.getImageId():
-      for inUseInstalledImage in subuserlib.installedImages.getImageLineage(user,subuser.getImageId()):
-        installedImagesThatAreInUse[inUseInstalledImage.getImageId()] = inUseInstalledImage
-  return installedImagesThatAreInUse
+      rootImageIds.append(subuser.getImageId())
+      runtimeCacheFilePath = getSubusersRuntimeCacheFilePath(user,subuser)
+      if runtimeCacheFilePath:
+        liveRuntimeCacheFilePaths.add(runtimeCacheFilePath)
+  for installedImageId,installedImage in user.getInstalledImages().items():
+    if not isSelected(installedImage,sourceRepoId,imageSourceName):
+      rootImageIds.append(installedImageId)
+  liveInstalledImageIds = set()
+  for imageId in rootImageIds:
+    if imageId in liveInstalledImageIds:
+      continue
+    for installedImage in subuserlib.installedImages.getImageLineage(user,imageId):
+      liveInstalledImageIds.add(installedImage.getImageId())
+    liveInstalledImageIds.add(imageId)
+  return (liveInstalledImageIds,liveRuntimeCacheFilePaths)
 
-def removeOldImages(user,dryrun,sourceRepoId=None,imageSourceName=None):
-  installedImagesThatAreInUse = getInstalledImagesThatAreInUse(user)
+def getImageSize(user,imageId):
+  """
+  Returns the number of bytes which the image adds on top of its parent.  The daemon reports the size of an image including the layers of all of its parents, so the size of the parent is subtracted.
 
+  >>> import subuserlib.classes.user,subuserlib.removeOldImages
+  >>> user = subuserlib.classes.user.User()
+  >>> images = user.getDockerDaemon().images
+  >>> images["sha256:f00d0000"] = {"Parent":"","Created":"0","Size":100}
+  >>> images["sha256:f00d1111"] = {"Parent":"sha256:f00d0000","Created":"1","Size":130}
+  >>> images["sha256:f00d2222"] = {"Parent":"sha256:f00d9999","Created":"2","Size":50}
+  >>> subuserlib.removeOldImages.getImageSize(user,"sha256:f00d1111")
+  30
+  >>> subuserlib.removeOldImages.getImageSize(user,"sha256:f00d0000")
+  100
+
+  If the parent is not known, the whole size is counted.
+
+  >>> subuserlib.removeOldImages.getImageSize(user,"sha256:f00d2222")
+  50
+  >>> subuserlib.removeOldImages.getImageSize(user,"sha256:f00d3333")
+  0
+  """
+  imageInventory = user.getImageInventory()
+  imageSummary = imageInventory.getImage(imageId)
+  if imageSummary is None:
+    return 0
+  size = imageSummary.get("Size",0)
+  if imageSummary.get("ParentId"):
+    parentSummary = imageInventory.getImage(imageSummary["ParentId"])
+    if parentSummary is not None:
+      size -= parentSummary.get("Size",0)
+  return max(size,0)
+
+def findGarbage(user,sourceRepoId=None,imageSourceName=None):
+  """
+  Returns a dictionary ``{imageId : Garbage}`` of the images which are no longer needed.
+  """
+  (liveInstalledImageIds,liveRuntimeCacheFilePaths) = mark(user,sourceRepoId,imageSourceName)
+  garbage = {} # {imageId : Garbage}
   for installedImageId,installedImage in user.getInstalledImages().items():
-    filterOut = False
-    # If a sourceRepoId or sourceImageId have been specified, only remove images from that repo/soure
-    if sourceRepoId:
-      filterOut = True
-      if installedImage.getSourceRepoId() == sourceRepoId:
-        filterOut = False
-        if imageSourceName:
-          filterOut = True
-          if installedImage.getImageSourceName() == imageSourceName:
-            filterOut = False
-    if not installedImageId in installedImagesThatAreInUse and not filterOut:
-      user.getRegistry().log("Removing unneeded image "+installedImage.getImageId() + " : " + installedImage.getImageSource().getIdentifier())
-      if not dryrun:
-        installedImage.removeCachedRuntimes()
-        installedImage.removeDockerImage()
-
-  if not dryrun:
-    subuserlib.verify.verify(user)
-    user.getRegistry().commit()
+    if installedImageId in liveInstalledImageIds:
+      continue
+    try:
+      description = installedImage.getImageSource().getIdentifier()
+    except KeyError:
+      description = installedImage.getImageSourceName()+"@"+installedImage.getSourceRepoId()
+    garbage[installedImageId] = Garbage(installedImageId,description,getImageSize(user,installedImageId),installedImage=installedImage)
+  for installedImage in garbage.values():
+    lineage = subuserlib.installedImages.getImageLineage(user,installedImage.imageId)
+    if len(lineage) > 1 and lineage[-2].getImageId() in garbage:
+      installedImage.parentImageId = lineage[-2].getImageId()
+  installedImages = user.getInstalledImages()
+  for (installedImageId,runtimeCacheFilePath,runReadyImageId,lastUsed) in getRunReadyImages(user):
+    if installedImageId in garbage and lastUsed and lastUsed > (garbage[installedImageId].lastUsed or 0):
+      garbage[installedImageId].lastUsed = lastUsed
+    if runReadyImageId is None or runtimeCacheFilePath in liveRuntimeCacheFilePaths:
+      continue
+    if installedImageId in installedImages:
+      if not isSelected(installedImages[installedImageId],sourceRepoId,imageSourceName):
+        continue
+    elif sourceRepoId or imageSourceName: # We cannot tell which source the image was built from.
+      continue
+    parentImageId = None
+    if installedImageId in garbage:
+      parentImageId = installedImageId
+    garbage[runReadyImageId] = Garbage(runReadyImageId,"run-ready image for "+installedImageId,getImageSize(user,runReadyImageId),parentImageId=parentImageId,runtimeCacheFilePath=runtimeCacheFilePath,lastUsed=lastUsed)
+  return garbage
+
+def orderGarbage(garbage):
+  """
+  Returns a list of waves, each of which is a list of Garbage objects that can be removed at the same time.  Every image is in a later wave than all of its children.  The garbage must include the children of every image in it.
+  """
+  # Sort the garbage into waves by height: images without garbage children first.
+  heights = {}
+  for imageId in garbage:
+    heights.setdefault(imageId,0)
+    child = garbage[imageId]
+    height = 0
+    while child.parentImageId in garbage:
+      height += 1
+      if heights.get(child.parentImageId,0) < height:
+        heights[child.parentImageId] = height
+      child = garbage[child.parentImageId]
+  waves = []
+  for imageId,height in heights.items():
+    while len(waves) <= height:
+      waves.append([])
+    waves[height].append(garbage[imageId])
+  for wave in waves:
+    wave.sort(key=lambda image: (image.runtimeCacheFilePath is None,image.imageId))
+  return waves
+
+def plan(user,sourceRepoId=None,imageSourceName=None):
+  """
+  Decide which images to remove.  Returns a list of waves, as described in ``orderGarbage``.
+  """
+  return orderGarbage(findGarbage(user,sourceRepoId,imageSourceName))
+
+def removeGarbage(user,image):
+  """
+  Remove a single image.  Returns None on success or an error message.
+  """
+  try:
+    user.getDockerDaemon().removeImage(image.imageId)
+  except dockerDaemon.ImageDoesNotExistsException:
+    pass
+  except (dockerDaemon.ContainerDependsOnImageException,dockerDaemon.ServerErrorException) as e:
+    return str(e)
+  user.getImageInventory().discard(image.imageId)
+  if image.runtimeCacheFilePath:
+    try:
+      os.remove(image.runtimeCacheFilePath)
+      os.rmdir(os.path.dirname(image.runtimeCacheFilePath))
+    except OSError: # Other runtimes are still cached for this image.
+      pass
+  return None
 
+def sweep(user,waves,jobs=maxConcurrentImageDeletions):
+  """
+  Remove the planned images, wave by wave.  When an image cannot be removed, its ancestors are left in place too.  Returns the number of bytes reclaimed.
+  """
+  bytesReclaimed = 0
+  failedImageIds = set()
+  garbage = dict([(image.imageId,image) for wave in waves for image in wave])
+  pool = ThreadPool(jobs)
+  try:
+    for wave in waves:
+      wave = [image for image in wave if not image.imageId in failedImageIds]
+      errors = pool.map(lambda image: removeGarbage(user,image),wave)
+      for image,error in zip(wave,errors):
+        if error is None:
+          bytesReclaimed += image.size
+          continue
+        user.getRegistry().log("Could not remove image "+image.imageId+" : "+error)
+        while image.parentImageId in garbage:
+          failedImageIds.add(image.parentImageId)
+          image = garbage[image.parentImageId]
+  finally:
+    pool.close()
+    pool.join()
+  return bytesReclaimed
 
+def removeOldImages(user,dryrun,sourceRepoId=None,imageSourceName=None):
+  """
+  Remove installed images which no subuser needs, along with the run-ready images built on top of them.  The plan is printed first, in the order in which images are to be removed.  With dryrun, nothing is removed.
+  """
+  waves = plan(user,sourceRepoId,imageSourceName)
+  plannedBytes = 0
+  for wave in waves:
+    for image in wave:
+      plannedBytes += image.size
+      user.getRegistry().log("Removing unneeded image "+image.imageId+" : "+image.description+" ("+formatSize(image.size)+")")
+  if dryrun:
+    user.getRegistry().log(formatSize(plannedBytes)+" would be reclaimed.")
+    return
+  bytesReclaimed = sweep(user,waves)
+  user.getRegistry().log("Reclaimed "+formatSize(bytesReclaimed)+".")
+  subuserlib.verify.verify(user)
+  user.getRegistry().commit()
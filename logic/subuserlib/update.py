@@ -9,31 +9,52 @@ High level operations used for updating, rolling back, locking ect.
 import os
 #internal imports
 import subuserlib.verify
+import subuserlib.install
 import subuserlib.subprocessExtras as subprocessExtras
 
 #####################################################################################
-def updateAll(user,permissionsAccepter):
+def updateAll(user,permissionsAccepter,jobs=1):
   """
-  This command updates(if needed) all of the installed subuser images.
+  This command updates(if needed) all of the installed subuser images.  Up to ``jobs`` images are built at the same time.
   """
   user.getRegistry().log("Updating...")
   for _,repository in user.getRegistry().getRepositories().items():
     repository.updateSources()
   subuserNames = list(user.getRegistry().getSubusers().keys())
   subuserNames.sort()
-  subuserlib.verify.verify(user,checkForUpdatesExternally=True,subuserNames=subuserNames,permissionsAccepter=permissionsAccepter)
+  subuserlib.verify.verify(user,checkForUpdatesExternally=True,subuserNames=subuserNames,permissionsAccepter=permissionsAccepter,jobs=jobs)
   user.getRegistry().commit()
 
-def updateSubusers(user,subuserNames,permissionsAccepter):
+def updateSubusers(user,subuserNames,permissionsAccepter,jobs=1):
   """
-  This command updates the specified subusers' images.
+  This command updates the specified subusers' images.  Up to ``jobs`` images are built at the same time.
   """
   user.getRegistry().log("Updating...")
   for _,repository in user.getRegistry().getRepositories().items():
     repository.updateSources()
-  subuserlib.verify.verify(user,subuserNames=subuserNames,checkForUpdatesExternally=True,permissionsAccepter=permissionsAccepter)
+  subuserlib.verify.verify(user,subuserNames=subuserNames,checkForUpdatesExternally=True,permissionsAccepter=permissionsAccepter,jobs=jobs)
   user.getRegistry().commit()
 
+def prebuildAll(user,jobs=1):
+  """
+  Check for updates and build new images for all of the subusers, without switching the subusers over to the new images or committing anything to the registry.  This is meant to be run periodically in the background.  The next time the user runs ``subuser update all``, the up to date images are found already installed and the subusers are simply switched over to them.
+
+  Images which were checked for updates less than ``update-check-ttl`` seconds ago, as configured in ``config.json``, are not checked again.  Interactive updates ignore this setting and always check.
+  """
+  user.getRegistry().log("Prebuilding updated images...")
+  for _,repository in user.getRegistry().getRepositories().items():
+    repository.updateSources()
+  user.getInstalledImages().unregisterNonExistantImages()
+  subuserNames = sorted(user.getRegistry().getSubusers().keys())
+  subusers = [user.getRegistry().getSubusers()[subuserName] for subuserName in subuserNames]
+  subusers = [subuser for subuser in subusers if not subuser.locked()]
+  subusersWhosImagesFailedToBuild = subuserlib.install.ensureSubuserImagesAreInstalledAndUpToDate(user,subusers,checkForUpdatesExternally=True,jobs=jobs,switchSubusers=False,updateCheckTTL=user.getConfig().get("update-check-ttl",0))
+  user.getInstalledImages().save()
+  if subusersWhosImagesFailedToBuild:
+    user.getRegistry().log("Images for the following subusers failed to build:")
+    for subuserName in subusersWhosImagesFailedToBuild:
+      user.getRegistry().log(subuserName)
+
 def showLog(user):
   user.getRegistry().getGitRepository().run(["log"])
 
@@ -13,19 +13,27 @@ This is one of the most important modules in subuser.  This module has one funct
 """
 
 #external imports
-import shutil,os
+import shutil,os,json
 #internal imports
 import subuserlib.install
 import subuserlib.classes.docker.dockerDaemon as dockerDaemon
 import subuserlib.permissions
+import subuserlib.imageRetention
+import subuserlib.launchManifests
+import subuserlib.warmPool
+import subuserlib.classes.subuser
+import subuserlib.classes.subuserSubmodules.run.runtime
 
-def verify(user,permissionsAccepter=None,checkForUpdatesExternally=False,subuserNames=[]):
+def verify(user,permissionsAccepter=None,checkForUpdatesExternally=False,subuserNames=[],jobs=1):
   """
    Ensure that:
       - Registry is consistent; warns the user about subusers that point to non-existant source images.
      - For each subuser there is an up-to-date image installed.
      - No-longer-needed temporary repositories are removed. All temporary repositories have at least one subuser who's image is built from one of the repository's image sources.
-     - No-longer-needed installed images are removed.
+     - No-longer-needed installed images are removed, as configured by the retention policy(see ``subuserlib.imageRetention``).
+     - Each subuser's launch manifest is up to date(see ``subuserlib.launchManifests``).
+
+   Up to ``jobs`` images are built at the same time.
   """
   user.getRegistry().log("Verifying subuser configuration.")
   verifyRegistryConsistency(user)
@@ -35,10 +43,13 @@ def verify(user,permissionsAccepter=None,checkForUpdatesExternally=False,subuser
     user.getRegistry().setChanged(True)
     approvePermissions(user,subuserNames,permissionsAccepter)
     subuserNames += ensureServiceSubusersAreSetup(user,subuserNames)
-    ensureImagesAreInstalledAndUpToDate(user,subuserNames=subuserNames,checkForUpdatesExternally=checkForUpdatesExternally)
+    ensureImagesAreInstalledAndUpToDate(user,subuserNames=subuserNames,checkForUpdatesExternally=checkForUpdatesExternally,jobs=jobs)
+  compileLaunchManifests(user)
+  subuserlib.imageRetention.enforceRetentionPolicy(user)
   user.getInstalledImages().save()
   trimUnneededTempRepos(user)
   rebuildBinDir(user)
+  closeGitRepositories(user)
 
 def verifyRegistryConsistency(user):
   user.getRegistry().log("Verifying registry consistency...")
@@ -66,22 +77,137 @@ def ensureServiceSubusersAreSetup(user,subuserNames):
         newServiceSubusers += subuser.getX11Bridge().setup(verify=False)
   return newServiceSubusers
 
-def ensureImagesAreInstalledAndUpToDate(user,subuserNames,checkForUpdatesExternally=False):
+def ensureImagesAreInstalledAndUpToDate(user,subuserNames,checkForUpdatesExternally=False,jobs=1):
   user.getRegistry().log("Checking if images need to be updated or installed...")
-  subusersWhosImagesFailedToBuild = []
-  for subuserName in subuserNames:
-    subuser = user.getRegistry().getSubusers()[subuserName]
-    if not subuser.locked(): # TODO: We should install images for locked subusers if their images have dissappered.
+  subusers = [user.getRegistry().getSubusers()[subuserName] for subuserName in subuserNames]
+  subusers = [subuser for subuser in subusers if not subuser.locked()] # TODO: We should install images for locked subusers if their images have dissappered.
+  subusersWhosImagesFailedToBuild = subuserlib.install.ensureSubuserImagesAreInstalledAndUpToDate(user,subusers,checkForUpdatesExternally=checkForUpdatesExternally,jobs=jobs)
+  for subuser in subusers:
+    if not subuser.getName() in subusersWhosImagesFailedToBuild:
       try:
-        subuserlib.install.ensureSubuserImageIsInstalledAndUpToDate(subuser,checkForUpdatesExternally=checkForUpdatesExternally)
         subuser.getRunReadyImage().setup()
       except dockerDaemon.ImageBuildException as e:
         user.getRegistry().log(str(e))
-        subusersWhosImagesFailedToBuild.append(subuser)
+        subusersWhosImagesFailedToBuild[subuser.getName()] = e
   if subusersWhosImagesFailedToBuild:
     user.getRegistry().log("Images for the following subusers failed to build:")
-    for subuser in subusersWhosImagesFailedToBuild:
-      user.getRegistry().log(subuser.getName())
+    for subuserName in subusersWhosImagesFailedToBuild:
+      user.getRegistry().log(subuserName)
+
+def compileLaunchManifest(user,subuser):
+  """
+  Returns the launch manifest for the given subuser as a dictionary, or None if the subuser cannot be launched from a manifest.
+  """
+  if not subuser.getImageId():
+    return None
+  try:
+    permissions = subuser.getPermissions()
+  except subuserlib.classes.subuser.SubuserHasNoPermissionsException:
+    return None
+  if not permissions["executable"] or not permissions["gui"] is None:
+    return None
+  runtimeCache = subuser.getRuntimeCache()
+  if not "run-ready-image-id" in runtimeCache:
+    return None
+  if permissions["stateful-home"]:
+    userdirsSymlinkHome = subuser.getHomeDirOnHost()
+  else:
+    userdirsSymlinkHome = None
+  return {
+    "run-ready-image-id" : runtimeCache["run-ready-image-id"],
+    "executable" : permissions["executable"],
+    "flags" : subuserlib.classes.subuserSubmodules.run.runtime.Runtime(user,subuser=subuser,environment={}).getFlagTemplate(),
+    "runtime-cache" : runtimeCache.getPathToRuntimeCacheFile(),
+    "userdirs-symlink-home" : userdirsSymlinkHome,
+    "warm-instances" : user.getConfig().get("warm-instances",{}).get(subuser.getName(),0),
+    "warm-pool" : os.path.join(subuserlib.warmPool.getWarmPoolsDir(user.homeDir),subuser.getName()+".json")}
+
+def compileLaunchManifests(user):
+  """
+  Write a launch manifest for each subuser which can be launched from one, and remove all other manifests.  The warm pools of subusers whose manifests have changed are drained.
+
+  >>> import os,json
+  >>> import subuserlib.verify,subuserlib.launchManifests,subuserlib.classes.user
+  >>> user = subuserlib.classes.user.User()
+  >>> manifestsDir = subuserlib.launchManifests.getLaunchManifestsDir(user.homeDir)
+  >>> subuserlib.verify.compileLaunchManifests(user)
+  >>> sorted(os.listdir(manifestsDir))
+  ['foo.json']
+  >>> subuserlib.launchManifests.loadLaunchManifest("foo",user.homeDir)["executable"] == "/usr/bin/foo"
+  True
+
+  Subusers with the gui permission are started through the X11 bridge, and get no manifest.
+
+  >>> foo = user.getRegistry().getSubusers()["foo"]
+  >>> foo.getPermissions()["gui"] = {"clipboard":True}
+  >>> subuserlib.verify.compileLaunchManifests(user)
+  >>> sorted(os.listdir(manifestsDir))
+  []
+  >>> foo.getPermissions()["gui"] = None
+
+  The manifests of subusers which have been removed are deleted.
+
+  >>> with open(os.path.join(manifestsDir,"removed-subuser.json"),"w") as manifestFile:
+  ...   json.dump({},manifestFile)
+  >>> subuserlib.verify.compileLaunchManifests(user)
+  >>> sorted(os.listdir(manifestsDir))
+  ['foo.json']
+  """
+  manifestsDir = subuserlib.launchManifests.getLaunchManifestsDir(user.homeDir)
+  try:
+    os.makedirs(manifestsDir)
+  except OSError:
+    pass
+  subusers = user.getRegistry().getSubusers()
+  for fileName in os.listdir(manifestsDir):
+    if not fileName[:-len(".json")] in subusers:
+      os.remove(os.path.join(manifestsDir,fileName))
+  unchangedManifests = set()
+  for subuserName,subuser in subusers.items():
+    manifestPath = os.path.join(manifestsDir,subuserName+".json")
+    manifest = compileLaunchManifest(user,subuser)
+    if manifest is not None and manifest == subuserlib.launchManifests.loadLaunchManifest(subuserName,user.homeDir):
+      unchangedManifests.add(subuserName)
+    if manifest is None:
+      if os.path.exists(manifestPath):
+        os.remove(manifestPath)
+      continue
+    temporaryManifestPath = manifestPath+".tmp."+str(os.getpid())
+    with open(temporaryManifestPath,"w") as manifestFile:
+      json.dump(manifest,manifestFile,indent=1,separators=(',',': '))
+    os.rename(temporaryManifestPath,manifestPath)
+  drainStaleWarmPools(user,unchangedManifests)
+
+def drainStaleWarmPools(user,unchangedManifests):
+  """
+  Drain the warm pools of all subusers other than those whose launch manifests have not changed.  The containers in these pools were created with an outdated run-ready image or permissions.
+
+  >>> import os
+  >>> import subuserlib.verify,subuserlib.warmPool,subuserlib.classes.user
+  >>> user = subuserlib.classes.user.User()
+  >>> connectionPool = user.getDockerDaemon().getConnectionPool()
+  >>> warmPoolsDir = subuserlib.warmPool.getWarmPoolsDir(user.homeDir)
+  >>> for subuserName in ["foo","removed-subuser"]:
+  ...   subuserlib.warmPool.WarmPool(connectionPool,os.path.join(warmPoolsDir,subuserName+".json"),1).refill({"Image":"3"})
+  >>> removedSubusersContainers = list(connectionPool.containers[-1:])
+  >>> subuserlib.verify.drainStaleWarmPools(user,set(["foo"]))
+  >>> sorted([fileName for fileName in os.listdir(warmPoolsDir) if fileName.endswith(".json")])
+  ['foo.json']
+  >>> removedSubusersContainers[0] in connectionPool.containers
+  False
+  >>> subuserlib.verify.drainStaleWarmPools(user,set())
+  >>> sorted([fileName for fileName in os.listdir(warmPoolsDir) if fileName.endswith(".json")])
+  []
+  """
+  warmPoolsDir = subuserlib.warmPool.getWarmPoolsDir(user.homeDir)
+  try:
+    fileNames = os.listdir(warmPoolsDir)
+  except OSError:
+    return
+  for fileName in fileNames:
+    if not fileName.endswith(".json") or fileName[:-len(".json")] in unchangedManifests:
+      continue
+    subuserlib.warmPool.WarmPool(user.getDockerDaemon().getConnectionPool(),os.path.join(warmPoolsDir,fileName),0).drain()
 
 def trimUnneededTempRepos(user):
   user.getRegistry().log("Running garbage collector on temporary repositories...")
@@ -104,6 +230,14 @@ def trimUnneededTempRepos(user):
   for repoId in reposToRemove:
     del user.getRegistry().getRepositories().userRepositories[repoId]
 
+def closeGitRepositories(user):
+  """
+  Stop the ``git cat-file`` processes which were started while verifying, rather than leaving them running until subuser exits.
+  """
+  user.getRegistry().getGitRepository().close()
+  for _,repo in user.getRegistry().getRepositories().items():
+    repo.getGitRepository().close()
+
 def rebuildBinDir(user):
   if os.path.exists(user.getConfig()["bin-dir"]):
     shutil.rmtree(user.getConfig()["bin-dir"])
@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+# This file should be compatible with both Python 2 and 3.
+# If it is not, please file a bug report.
+
+"""
+A warm pool holds containers which have been created, but not started, so that a subuser can be launched without waiting for its container to be created.
+
+Warm pools are opt-in.  The ``warm-instances`` setting in ``config.json`` maps subuser names to the number of containers to keep ready for them::
+
+  "warm-instances" : {"vim" : 2}
+
+A container's configuration cannot be changed once it has been created, and it includes the subuser's arguments, environment and working directory, as well as its run-ready image and permissions.  So a warm container is only used if it was created with exactly the configuration that the launch calls for.  After each launch, the pool is refilled in the background with containers configured like the one that was just launched.  This suits subusers which are launched the same way over and over again.  A pool only switches over to a new configuration once two launches in a row have called for it, so that launching a subuser from another directory, or with other arguments, every now and then does not throw away the whole pool.
+
+When a subuser's launch manifest changes, because its run-ready image or permissions have changed, or when the subuser is removed, ``subuser verify`` drains its pool.
+
+The pools are stored in ``~/.subuser/warm-pools``.
+"""
+
+#external imports
+import os,json,hashlib,threading,fcntl,contextlib,socket
+#internal imports
+import subuserlib.dockerRun
+
+# Once the subuser has exited, wait at most this many seconds for the pool to be refilled.
+maxRefillWait = 10
+
+def getWarmPoolsDir(homeDir):
+  return os.path.join(homeDir,".subuser","warm-pools")
+
+def getConfigHash(containerConfig):
+  """
+  >>> from subuserlib.warmPool import getConfigHash
+  >>> getConfigHash({"Image":"3","Tty":True}) == getConfigHash({"Tty":True,"Image":"3"})
+  True
+  """
+  return hashlib.sha256(json.dumps(containerConfig,sort_keys=True).encode("utf-8")).hexdigest()
+
+class WarmPool():
+  """
+  A pool of up to ``size`` warm containers, which is stored in the file at poolPath.
+
+  >>> import os,json,tempfile,shutil
+  >>> import subuserlib.classes.user,subuserlib.dockerRun
+  >>> from subuserlib.warmPool import WarmPool
+  >>> connectionPool = subuserlib.classes.user.User().getDockerDaemon().getConnectionPool()
+  >>> tempDir = tempfile.mkdtemp()
+  >>> poolPath = os.path.join(tempDir,"warm-pools","vim.json")
+  >>> def getPooledContainers():
+  ...   with open(poolPath,"r") as poolFile:
+  ...     return json.load(poolFile)["containers"]
+  >>> config = {"Image":"3","Cmd":[]}
+  >>> warmPool = WarmPool(connectionPool,poolPath,2)
+  >>> warmPool.claim(config) is None
+  True
+
+  Refilling the pool creates containers until it is full.
+
+  >>> warmPool.refill(config)
+  >>> pooledContainers = getPooledContainers()
+  >>> len(pooledContainers)
+  2
+  >>> all([containerId in connectionPool.containers for containerId in pooledContainers])
+  True
+
+  Containers are only claimed by launches which call for exactly the configuration that they were created with.
+
+  >>> warmPool.claim({"Image":"3","Cmd":["--help"]}) is None
+  True
+  >>> claimedContainer = warmPool.claim(config)
+  >>> claimedContainer == pooledContainers[0]
+  True
+  >>> getPooledContainers() == pooledContainers[1:]
+  True
+  >>> subuserlib.dockerRun.removeContainer(connectionPool,claimedContainer)
+  >>> refillThread = warmPool.refillInBackground(config)
+  >>> refillThread.daemon
+  True
+  >>> warmPool.waitForRefill()
+  >>> len(getPooledContainers())
+  2
+
+  A pool which has shrunk is trimmed down to its new size.
+
+  >>> pooledContainers = getPooledContainers()
+  >>> WarmPool(connectionPool,poolPath,1).refill(config)
+  >>> getPooledContainers() == pooledContainers[:1]
+  True
+  >>> pooledContainers[1] in connectionPool.containers
+  False
+
+  A single launch with another configuration leaves the pool as it is.  The second such launch in a row replaces the pool's containers.
+
+  >>> pooledContainers = getPooledContainers()
+  >>> otherConfig = {"Image":"3","Cmd":[],"WorkingDir":"/home/me/other"}
+  >>> warmPool.refill(otherConfig)
+  >>> getPooledContainers() == pooledContainers
+  True
+  >>> warmPool.refill(otherConfig)
+  >>> any([containerId in connectionPool.containers for containerId in pooledContainers])
+  False
+  >>> len(getPooledContainers())
+  2
+  >>> warmPool.claim(config) is None
+  True
+
+  Draining the pool removes its containers and the pool itself.
+
+  >>> pooledContainers = getPooledContainers()
+  >>> warmPool.drain()
+  >>> os.path.exists(poolPath)
+  False
+  >>> any([containerId in connectionPool.containers for containerId in pooledContainers])
+  False
+  >>> shutil.rmtree(tempDir)
+  """
+  def __init__(self,connectionPool,poolPath,size):
+    self.__connectionPool = connectionPool
+    self.__poolPath = poolPath
+    self.__size = size
+    self.__refillThread = None
+
+  def getPoolPath(self):
+    return self.__poolPath
+
+  @contextlib.contextmanager
+  def __locked(self):
+    """
+    Hold an exclusive lock on the pool while the with block runs, so that a warm container is never claimed twice.
+    """
+    try:
+      os.makedirs(os.path.dirname(self.__poolPath))
+    except OSError:
+      pass
+    with open(self.__poolPath+".lock","a") as lockFile:
+      fcntl.flock(lockFile.fileno(),fcntl.LOCK_EX)
+      try:
+        yield
+      finally:
+        fcntl.flock(lockFile.fileno(),fcntl.LOCK_UN)
+
+  def __load(self):
+    try:
+      with open(self.__poolPath,"r") as poolFile:
+        return json.load(poolFile)
+    except (IOError,OSError,ValueError):
+      return {"config-hash":None,"containers":[],"last-launch-config-hash":None}
+
+  def __save(self,pool):
+    temporaryPoolPath = self.__poolPath+".tmp."+str(os.getpid())
+    with open(temporaryPoolPath,"w") as poolFile:
+      json.dump(pool,poolFile,indent=1,separators=(',',': '))
+    os.rename(temporaryPoolPath,self.__poolPath)
+
+  def __removeContainers(self,containerIds):
+    for containerId in containerIds:
+      try:
+        subuserlib.dockerRun.removeContainer(self.__connectionPool,containerId,force=True)
+      except (socket.error,IOError):
+        pass
+
+  def claim(self,containerConfig):
+    """
+    Take a warm container with the given configuration out of the pool.  Returns its Id, or None if there is none.
+    """
+    configHash = getConfigHash(containerConfig)
+    with self.__locked():
+      pool = self.__load()
+      if not pool["config-hash"] == configHash or not pool["containers"]:
+        return None
+      containerId = pool["containers"].pop(0)
+      self.__save(pool)
+    return containerId
+
+  def refill(self,containerConfig):
+    """
+    Create containers with the given configuration until the pool is full, and remove any containers beyond the pool's size.
+
+    If the pool holds containers with another configuration, it is only switched over to the given configuration if the previous launch called for it too.  Otherwise, the pool is left as it is.
+    """
+    configHash = getConfigHash(containerConfig)
+    with self.__locked():
+      pool = self.__load()
+      lastLaunchConfigHash = pool.get("last-launch-config-hash")
+      pool["last-launch-config-hash"] = configHash
+      staleContainerIds = []
+      if not pool["config-hash"] == configHash:
+        if pool["containers"] and not lastLaunchConfigHash == configHash:
+          self.__save(pool)
+          return
+        staleContainerIds = pool["containers"]
+        pool["config-hash"] = configHash
+        pool["containers"] = []
+      staleContainerIds += pool["containers"][self.__size:]
+      pool["containers"] = pool["containers"][:self.__size]
+      self.__save(pool)
+    self.__removeContainers(staleContainerIds)
+    # Containers are created without holding the lock, so that launches need not wait for them.  Each is added to the pool as soon as it has been created.
+    while True:
+      with self.__locked():
+        pool = self.__load()
+        if not pool["config-hash"] == configHash or len(pool["containers"]) >= self.__size:
+          return
+      try:
+        containerId = subuserlib.dockerRun.createContainer(self.__connectionPool,containerConfig)
+      except (subuserlib.dockerRun.ContainerRunException,socket.error,IOError):
+        return
+      with self.__locked():
+        pool = self.__load()
+        if pool["config-hash"] == configHash and len(pool["containers"]) < self.__size:
+          pool["containers"].append(containerId)
+          self.__save(pool)
+          containerId = None
+      if containerId is not None: # The pool was changed or filled in the mean time.
+        self.__removeContainers([containerId])
+        return
+
+  def refillInBackground(self,containerConfig):
+    """
+    Refill the pool in a separate thread.  Returns the thread.
+
+    The thread does not keep the process alive.  Call ``waitForRefill`` before exiting, so that it gets a chance to finish.
+    """
+    self.__refillThread = threading.Thread(target=self.refill,args=(containerConfig,))
+    self.__refillThread.daemon = True
+    self.__refillThread.start()
+    return self.__refillThread
+
+  def waitForRefill(self,timeout=maxRefillWait):
+    """
+    Wait for the pool to be refilled by ``refillInBackground``, but for no longer than timeout seconds.
+    """
+    if self.__refillThread is not None:
+      self.__refillThread.join(timeout)
+
+  def drain(self):
+    """
+    Remove all of the containers in the pool, along with the pool itself.
+    """
+    with self.__locked():
+      containerIds = self.__load()["containers"]
+      try:
+        os.remove(self.__poolPath)
+      except OSError:
+        pass
+    self.__removeContainers(containerIds)